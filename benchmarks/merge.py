@@ -0,0 +1,154 @@
+"""Times the matcher and the merge steps of a pull on synthetic playlists.
+
+Usage: python -m benchmarks.merge [sizes...] [--phases P ...] [--json FILE] [--no-memory]
+
+Each phase runs on fresh copies of the same seeded library and its remote copy, and
+reports its time and the peak memory allocated by Python. Memory is measured in a
+second, much slower run under tracemalloc, pass --no-memory to skip it.
+Playlist.merge_playlist compares all pairs, so it only runs up to --max-quadratic
+tracks.
+
+The default sizes take about a minute. Pass larger ones explicitly, e.g.
+python -m benchmarks.merge 10000 50000 --no-memory.
+"""
+import argparse
+import contextlib
+import io
+import json
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.synthetic import remote_copy, synthetic_tracks
+from unitunes.candidate_index import CandidateIndex
+from unitunes.matcher import DefaultMatcherStrategy
+from unitunes.playlist import Playlist
+from unitunes.pull_playlist import (
+    add_changed_uris,
+    merge_new_tracks,
+    tracks_to_add,
+    tracks_to_remove,
+)
+from unitunes.track import Track
+from unitunes.types import ServiceType
+
+DEFAULT_SIZES = [100, 1000]
+SIMILARITY_ROWS = 100
+
+
+def copies(tracks: List[Track]) -> List[Track]:
+    return [track.copy(deep=True) for track in tracks]
+
+
+def phases(current: List[Track], remote: List[Track]) -> Dict[str, Callable]:
+    """Phase name -> function that prepares its inputs and returns the timed call."""
+    service = ServiceType.YTM
+
+    def similarity_matrix():
+        rows = current[:SIMILARITY_ROWS]
+        return lambda: DefaultMatcherStrategy().similarity_matrix(rows, remote)
+
+    def candidate_index():
+        return lambda: CandidateIndex(current)
+
+    def merge_new():
+        tracks, new = copies(current), copies(remote)
+        return lambda: merge_new_tracks(tracks, new, DefaultMatcherStrategy())
+
+    def changed_uris():
+        tracks = copies(current)
+        return lambda: add_changed_uris(tracks, remote)
+
+    def to_add():
+        return lambda: tracks_to_add(service, current, remote)
+
+    def to_remove():
+        return lambda: tracks_to_remove(service, current, remote)
+
+    def track_merge():
+        pairs = list(zip(copies(current), copies(remote)))
+        return lambda: [t.merge(other) for t, other in pairs]
+
+    def merge_playlist():
+        playlist = Playlist(name="current", tracks=copies(current))
+        other = Playlist(name="remote", tracks=copies(remote))
+        return lambda: playlist.merge_playlist(other, DefaultMatcherStrategy())
+
+    return {
+        "similarity_matrix": similarity_matrix,
+        "candidate_index": candidate_index,
+        "merge_new_tracks": merge_new,
+        "add_changed_uris": changed_uris,
+        "tracks_to_add": to_add,
+        "tracks_to_remove": to_remove,
+        "Track.merge": track_merge,
+        "Playlist.merge_playlist": merge_playlist,
+    }
+
+
+QUADRATIC_PHASES = {"Playlist.merge_playlist"}
+
+
+def measure(
+    prepare: Callable[[], Callable], memory: bool
+) -> Dict[str, Optional[float]]:
+    """Times a phase, then runs it again under tracemalloc for its peak memory."""
+
+    def run(call: Callable) -> None:
+        with contextlib.redirect_stdout(io.StringIO()):  # merge helpers log changes
+            call()
+
+    call = prepare()
+    start = time.perf_counter()
+    run(call)
+    seconds = time.perf_counter() - start
+
+    peak_mib = None
+    if memory:
+        call = prepare()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        run(call)
+        peak_mib = (tracemalloc.get_traced_memory()[1] - baseline) / 2**20
+        tracemalloc.stop()
+    return {"seconds": seconds, "peak_mib": peak_mib}
+
+
+def bench(
+    size: int, only: Optional[List[str]], max_quadratic: int, memory: bool
+) -> List[Dict]:
+    current = synthetic_tracks(size, seed=1)
+    remote = remote_copy(current, seed=2)
+    results = []
+    for name, prepare in phases(current, remote).items():
+        if only and name not in only:
+            continue
+        if name in QUADRATIC_PHASES and size > max_quadratic:
+            print(f"{size:>6} {name:<24} skipped")
+            continue
+        result = {"size": size, "phase": name, **measure(prepare, memory)}
+        peak = "" if result["peak_mib"] is None else f"{result['peak_mib']:9.1f} MiB"
+        print(f"{size:>6} {name:<24} {result['seconds']:9.3f}s {peak}", flush=True)
+        results.append(result)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sizes", nargs="*", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("--phases", nargs="+", help="only run these phases")
+    parser.add_argument("--max-quadratic", type=int, default=1000)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--no-memory", action="store_true")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        results += bench(size, args.phases, args.max_quadratic, not args.no_memory)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
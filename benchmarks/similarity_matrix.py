@@ -0,0 +1,39 @@
+"""Compares DefaultMatcherStrategy.similarity_matrix with calling similarity per pair.
+
+Usage: python -m benchmarks.similarity_matrix [sizes...]
+
+Comparing every pair of a 5k x 5k input takes hours, so the pairwise time is
+extrapolated from a sample of rows.
+"""
+import sys
+import time
+
+from benchmarks.synthetic import synthetic_tracks
+from unitunes.matcher import DefaultMatcherStrategy
+
+
+def bench(n: int, sample_rows: int = 10) -> None:
+    matcher = DefaultMatcherStrategy()
+    tracks1 = synthetic_tracks(n, seed=1)
+    tracks2 = synthetic_tracks(n, seed=2)
+
+    start = time.perf_counter()
+    for track in tracks1[:sample_rows]:
+        for other in tracks2:
+            matcher.similarity(track, other)
+    pairwise = (time.perf_counter() - start) * n / sample_rows
+
+    start = time.perf_counter()
+    matcher.similarity_matrix(tracks1, tracks2)
+    batched = time.perf_counter() - start
+
+    print(
+        f"{n}x{n}: pairwise {pairwise:.1f}s (extrapolated), "
+        f"similarity_matrix {batched:.1f}s, {pairwise / batched:.1f}x faster"
+    )
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 5000]
+    for size in sizes:
+        bench(size)
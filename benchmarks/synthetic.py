@@ -0,0 +1,88 @@
+"""Synthetic libraries for benchmarks.
+
+Names are built from generated words, so the vocabulary grows with the library
+like it does in real ones. Artists have aliases, some tracks are remixes or live
+versions of other tracks, and remote copies of a playlist can have churned YTM
+uris, like videos that were reuploaded.
+"""
+import random
+from typing import List
+
+from unitunes.track import AliasedString, Track
+from unitunes.uri import SpotifyTrackURI, YtmTrackURI
+
+SYLLABLES = (
+    "ka lo mi ra ne so ti vu be da fe gi ho ja ku le mo na pi qu "
+    "re sa to un ve wi xa yo ze an el in or us ar en il on um"
+).split()
+
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3)))
+
+
+def random_words(rng: random.Random, vocabulary: List[str], n: int) -> str:
+    return " ".join(rng.choice(vocabulary) for _ in range(n)).title()
+
+
+def random_id(rng: random.Random, length: int) -> str:
+    return "".join(
+        rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(length)
+    )
+
+
+def synthetic_tracks(n: int, seed: int = 0) -> List[Track]:
+    """Tracks drawn from pools of artists and albums, like a real library."""
+    rng = random.Random(seed)
+    vocabulary = sorted({random_word(rng) for _ in range(max(n // 2, 50))})
+    artists = []
+    for _ in range(max(n // 8, 1)):
+        name = random_words(rng, vocabulary, rng.randint(1, 2))
+        aliases = [f"The {name}"] if rng.random() < 0.3 else []
+        artists.append((name, aliases))
+    albums = [random_words(rng, vocabulary, 3) for _ in range(max(n // 5, 1))]
+
+    tracks: List[Track] = []
+    for _ in range(n):
+        artist, aliases = rng.choice(artists)
+        if tracks and rng.random() < 0.08:
+            # a version of an existing track
+            original = rng.choice(tracks)
+            name = original.name.value + rng.choice([" (Remix)", " (Live)"])
+            length = (original.length or 200) + rng.randint(-20, 20)
+        else:
+            name = random_words(rng, vocabulary, rng.randint(1, 4))
+            length = rng.randint(120, 360)
+        tracks.append(
+            Track(
+                name=AliasedString(name),
+                artists=[AliasedString(artist, aliases=list(aliases))],
+                albums=[AliasedString(rng.choice(albums))],
+                length=length,
+                uris=[
+                    SpotifyTrackURI.from_uri(random_id(rng, 22)),
+                    YtmTrackURI.from_uri(random_id(rng, 11)),
+                ],
+            )
+        )
+    return tracks
+
+
+def remote_copy(tracks: List[Track], seed: int = 0, churn: float = 0.1) -> List[Track]:
+    """
+    A remote version of a playlist. A churn fraction of tracks get a new YTM uri and
+    lose their Spotify uri, half as many are missing, and half as many new tracks
+    are added.
+    """
+    rng = random.Random(seed)
+    remote = []
+    for track in tracks:
+        r = rng.random()
+        if r < churn / 2:
+            continue  # removed on the remote
+        track = track.copy(deep=True)
+        if r < churn * 1.5:
+            track.uris = [YtmTrackURI.from_uri(random_id(rng, 11))]
+        remote.append(track)
+    added = synthetic_tracks(int(len(tracks) * churn / 2) + 1, seed=seed + 1)
+    return remote + added
@@ -1,4 +1,5 @@
 from distutils.command.config import config
+import hashlib
 import json
 from pathlib import Path
 from typing import Any, List
@@ -178,3 +179,31 @@ def test_add_remove_tracks(Beatsaber: BeatsaberService):
 
 def test_protocols(Beatsaber: BeatsaberService):
     assert isinstance(Beatsaber, Pushable)
+
+
+def test_playlist_version_hashes_changed_files(
+    Beatsaber: BeatsaberService, monkeypatch: pytest.MonkeyPatch
+):
+    playlist = BeatsaberPlaylistURI.from_uri("bass_house_music_pack.bplist")
+    hashes = []
+    sha256 = hashlib.sha256
+    monkeypatch.setattr(
+        hashlib, "sha256", lambda data: hashes.append(1) or sha256(data)
+    )
+
+    version = Beatsaber.playlist_version(playlist)
+    assert Beatsaber.playlist_version(playlist) == version
+    assert len(hashes) == 1
+
+    Beatsaber.add_tracks(
+        playlist,
+        [
+            Track(
+                name=AliasedString("My Hero"),
+                uris=[BeatsaberTrackURI.from_uri("27b65")],
+            )
+        ],
+    )
+    assert Beatsaber.playlist_version(playlist) != version
+    assert len(hashes) == 2
+    assert Beatsaber.playlist_version(BeatsaberPlaylistURI.from_uri("x.bplist")) is None
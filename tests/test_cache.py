@@ -0,0 +1,297 @@
+from datetime import timedelta
+import inspect
+import json
+from pathlib import Path
+import sqlite3
+import threading
+import time
+
+import pytest
+from unitunes.services.cache import (
+    JsonCacheBackend,
+    MemoryCacheTier,
+    SingleFlight,
+    SqliteCacheBackend,
+    canonical_key,
+    legacy_key_migration,
+)
+from unitunes.services.services import ServiceWrapper, cache
+
+
+class CountingWrapper(ServiceWrapper):
+    calls: int = 0
+
+    @cache
+    def echo(self, value, use_cache=True):
+        self.calls += 1
+        return {"value": value}
+
+
+def test_sqlite_get_set(tmp_path: Path):
+    backend = SqliteCacheBackend(tmp_path / "cache.sqlite3")
+    with pytest.raises(KeyError):
+        backend.get("search", "a")
+
+    backend.set("search", "a", {"items": [1, 2]})
+    assert backend.get("search", "a") == {"items": [1, 2]}
+
+    backend.close()
+    reopened = SqliteCacheBackend(tmp_path / "cache.sqlite3")
+    assert reopened.get("search", "a") == {"items": [1, 2]}
+    reopened.close()
+
+
+def test_sqlite_imports_json_once(tmp_path: Path):
+    (tmp_path / "search.json").write_text(json.dumps({"a": 1, "b": 2}))
+
+    backend = SqliteCacheBackend(tmp_path / "cache.sqlite3")
+    assert backend.get("search", "a") == 1
+    backend.set("search", "a", 3)
+    backend.close()
+
+    reopened = SqliteCacheBackend(tmp_path / "cache.sqlite3")
+    assert reopened.get("search", "a") == 3
+    assert reopened.get("search", "b") == 2
+    reopened.close()
+
+
+def test_cache_decorator(tmp_path: Path):
+    wrapper = CountingWrapper(
+        "counting", tmp_path, cache_backend=JsonCacheBackend(tmp_path / "counting")
+    )
+    assert wrapper.echo("x") == {"value": "x"}
+    assert wrapper.echo("x") == {"value": "x"}
+    assert wrapper.calls == 1
+
+    wrapper.echo("x", use_cache=False)
+    assert wrapper.calls == 2
+
+
+def test_default_backend_is_shared(tmp_path: Path):
+    a = CountingWrapper("counting", tmp_path)
+    b = CountingWrapper("counting", tmp_path)
+    assert isinstance(a.cache_backend.backend, SqliteCacheBackend)
+    assert a.cache_backend.backend is b.cache_backend.backend
+
+    a.echo("x")
+    a.flush_cache()
+    b.echo("x")
+    assert a.calls == 1 and b.calls == 0
+
+
+def test_memory_tier_write_behind(tmp_path: Path):
+    disk = JsonCacheBackend(tmp_path)
+    tier = MemoryCacheTier(disk, flush_interval=3600)
+
+    tier.set("search", "a", [1])
+    tier.set("search", "a", [2])
+    assert tier.get("search", "a") == [2]
+    with pytest.raises(KeyError):
+        disk.get("search", "a")
+
+    tier.flush()
+    assert disk.get("search", "a") == [2]
+    assert tier.stats.memory_hits == 1
+    assert tier.stats.disk_writes_avoided() == 1
+
+
+def test_memory_tier_serves_hits_from_memory(tmp_path: Path):
+    disk = JsonCacheBackend(tmp_path)
+    disk.set("search", "a", {"items": []})
+    tier = MemoryCacheTier(disk)
+
+    first = tier.get("search", "a")
+    first["items"].append(1)  # callers can't mutate cached entries
+    (tmp_path / "search.json").unlink()
+
+    assert tier.get("search", "a") == {"items": []}
+    assert tier.stats.disk_hits == 1
+    assert tier.stats.disk_reads_avoided() == 1
+
+
+def test_memory_tier_budget(tmp_path: Path):
+    tier = MemoryCacheTier(JsonCacheBackend(tmp_path), max_entries=2, max_bytes=20)
+    tier.set("m", "a", "x" * 9)
+    tier.set("m", "b", "x" * 9)
+    assert tier.stats.evictions == 1  # 2 * 11 bytes serialized
+
+    tier.set("m", "c", "c")
+    tier.set("m", "d", "d")
+    assert tier.stats.evictions == 2  # max 2 entries
+    # evicted entries are still served until they are written back
+    assert tier.get("m", "a") == "x" * 9
+
+
+class BlockingWrapper(ServiceWrapper):
+    calls: int = 0
+    release: threading.Event
+
+    @cache
+    def slow(self, value, use_cache=True):
+        self.calls += 1
+        self.release.wait(5)
+        if value == "bad":
+            raise ValueError(value)
+        return {"value": value}
+
+
+def test_concurrent_misses_make_one_call(tmp_path: Path):
+    wrapper = BlockingWrapper("blocking", tmp_path)
+    wrapper.release = threading.Event()
+    results = []
+
+    def call():
+        results.append(wrapper.slow("x"))
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for t in threads:
+        t.start()
+    wrapper.release.set()
+    for t in threads:
+        t.join()
+
+    assert wrapper.calls == 1
+    assert results == [{"value": "x"}] * 8
+    # callers get independent copies
+    assert len({id(r) for r in results}) == 8
+
+
+def test_single_flight_shares_exceptions():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError("boom")
+
+    def call(fn):
+        try:
+            flight.do("key", fn)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call, args=(fail,))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call, args=(lambda: "not called",))
+    follower.start()
+    time.sleep(0.1)  # let the follower join the running call
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert len(errors) == 2
+    assert flight.do("key", lambda: 1) == (1, False)
+
+
+class ExpiringWrapper(ServiceWrapper):
+    calls: int = 0
+
+    @cache(ttl=timedelta(days=1), negative_ttl=timedelta(seconds=0))
+    def search(self, query, use_cache=True):
+        self.calls += 1
+        return [] if query == "nothing" else [query]
+
+
+def test_negative_results_expire_sooner(tmp_path: Path):
+    wrapper = ExpiringWrapper("expiring", tmp_path)
+    wrapper.search("x")
+    wrapper.search("x")
+    assert wrapper.calls == 1
+
+    wrapper.search("nothing")
+    wrapper.search("nothing")
+    assert wrapper.calls == 3
+
+
+def test_sqlite_expiry(tmp_path: Path):
+    backend = SqliteCacheBackend(tmp_path / "cache.sqlite3")
+    backend.set("search", "old", 1, expires_at=0)
+    backend.set("search", "new", 2, expires_at=None)
+    with pytest.raises(KeyError):
+        backend.get("search", "old")
+    assert backend.get("search", "new") == 2
+    backend.close()
+
+
+def test_sqlite_evicts_least_recently_used(tmp_path: Path):
+    backend = SqliteCacheBackend(tmp_path / "cache.sqlite3")
+    for key in ["a", "b", "c"]:
+        backend.set("search", key, "x" * 98)  # 100 bytes serialized
+    backend.set("track", "d", "x" * 98)
+    backend.set("track", "expired", "x" * 98, expires_at=0)
+    backend.touch("search", ["a"], accessed_at=2e9)
+
+    backend.evict(max_bytes=300)
+    assert backend.size() <= 300 * backend.evict_to
+    assert backend.get("search", "a")
+    with pytest.raises(KeyError):
+        backend.get("search", "b")
+    backend.close()
+
+
+def test_upgrades_tables_of_older_versions(tmp_path: Path):
+    conn = sqlite3.connect(str(tmp_path / "cache.sqlite3"))
+    conn.execute(
+        "CREATE TABLE search (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+    )
+    conn.execute("INSERT INTO search VALUES ('a', '[1]', 0)")
+    conn.commit()
+    conn.close()
+
+    backend = SqliteCacheBackend(tmp_path / "cache.sqlite3")
+    assert backend.get("search", "a") == [1]
+    assert backend.size() == 3
+    backend.close()
+
+
+class SearchWrapper(ServiceWrapper):
+    calls: int = 0
+
+    @cache
+    def search(self, query, limit=10, offset=0, use_cache=True, **fields):
+        self.calls += 1
+        return [query]
+
+
+def test_keys_ignore_argument_spelling(tmp_path: Path):
+    wrapper = SearchWrapper("search", tmp_path)
+    wrapper.search("x")
+    wrapper.search(query="x")
+    wrapper.search("x", 10)
+    wrapper.search("x", offset=0, limit=10)
+    assert wrapper.calls == 1
+
+    wrapper.search("x", artist="a", album="b")
+    wrapper.search("x", album="b", artist="a")
+    assert wrapper.calls == 2
+
+
+def test_migrates_legacy_keys(tmp_path: Path):
+    signature = inspect.signature(SearchWrapper.search.__wrapped__)
+    backend = SqliteCacheBackend(tmp_path / "cache.sqlite3")
+    backend.set("search", "('x',)_{}", ["x"])
+    backend.set("search", "('y', 10)_{'offset': 0}", ["y"])
+    backend.set("search", "not a key", ["z"])
+    backend.close()
+
+    reopened = SqliteCacheBackend(tmp_path / "cache.sqlite3")
+    reopened.register_key_migration("search", legacy_key_migration(signature))
+    assert reopened.get("search", canonical_key(signature, ("x",), {})) == ["x"]
+    assert reopened.get("search", canonical_key(signature, (), {"query": "y"})) == ["y"]
+    with pytest.raises(KeyError):  # unparseable keys are dropped
+        reopened.get("search", "not a key")
+    reopened.close()
+
+
+def test_wrapper_reads_legacy_json_cache(tmp_path: Path):
+    (tmp_path / "search").mkdir()
+    (tmp_path / "search" / "search.json").write_text(
+        json.dumps({"('x',)_{'limit': 10}": ["cached"]})
+    )
+    wrapper = SearchWrapper("search", tmp_path)
+    assert wrapper.search("x") == ["cached"]
+    assert wrapper.calls == 0
@@ -0,0 +1,160 @@
+import json
+from pathlib import Path
+from typing import List
+
+import pytest
+from unitunes.candidate_index import CandidateIndex
+from unitunes.matcher import DefaultMatcherStrategy
+from unitunes.pull_playlist import merge_new_tracks, tracks_to_add, tracks_to_remove
+from unitunes.services.musicbrainz import MusicBrainz
+from unitunes.track import AliasedString, Track
+from unitunes.types import ServiceType
+from unitunes.uri import BeatsaberTrackURI
+
+
+def fixture_tracks() -> List[Track]:
+    """Tracks from the beatsaver and musicbrainz test caches."""
+    docs = {}
+    bs_cache = Path("tests/cache/beatsaver/search.json")
+    for results in json.loads(bs_cache.read_text()).values():
+        for doc in results:
+            docs[doc["id"]] = doc
+    tracks = [
+        Track(
+            name=AliasedString(doc["metadata"]["songName"]),
+            artists=[AliasedString(doc["metadata"]["songAuthorName"])],
+            length=doc["metadata"]["duration"],
+            uris=[BeatsaberTrackURI.from_uri(doc["id"])],
+        )
+        for doc in docs.values()
+    ]
+
+    mb_cache = Path("tests/test_lib/cache/musicbrainz/search_recordings.json")
+    for results in json.loads(mb_cache.read_text()).values():
+        for recording in results["recording-list"]:
+            track = MusicBrainz.parse_track(recording)
+            # keep comparing all pairs fast
+            albums = {album.value: album for album in track.albums}
+            track.albums = list(albums.values())
+            for artist in track.artists:
+                artist.aliases = artist.aliases[:2]
+            tracks.append(track)
+    return tracks
+
+
+@pytest.fixture
+def tracks() -> List[Track]:
+    return fixture_tracks()
+
+
+def test_candidates_include_all_matches(tracks: List[Track]):
+    matcher = DefaultMatcherStrategy()
+    index = CandidateIndex(tracks)
+    for track in tracks:
+        candidates = {id(t) for t in index.candidates(track)}
+        assert len(candidates) < len(tracks)
+        for t in tracks:
+            if id(t) not in candidates:
+                assert not matcher.are_same(t, track)
+
+
+def test_helpers_match_brute_force(tracks: List[Track]):
+    matcher = DefaultMatcherStrategy()
+    service = ServiceType.BEATSABER
+    current, new = tracks[::2], tracks[1::3]
+
+    def brute_force_add() -> List[Track]:
+        return [
+            track
+            for track in new
+            if track.is_on_service(service)
+            and not any(
+                matcher.are_same(track, t) and t.is_on_service(service) for t in current
+            )
+        ]
+
+    assert tracks_to_add(service, current, new) == brute_force_add()
+    assert tracks_to_remove(service, new, current) == [
+        track
+        for track in new
+        if track.is_on_service(service)
+        and not any(
+            matcher.are_same(t, track) and t.is_on_service(service) for t in current
+        )
+    ]
+
+    expected = [t.copy(deep=True) for t in current]
+    for track in [t.copy(deep=True) for t in new]:
+        matches = [t for t in expected if matcher.are_same(t, track)]
+        for match in matches:
+            match.merge(track)
+        if not matches:
+            expected.append(track)
+
+    merged = [t.copy(deep=True) for t in current]
+    merge_new_tracks(merged, [t.copy(deep=True) for t in new], matcher)
+    assert merged == expected
+
+
+def test_tracks_without_keys_are_candidates_of_similar_length():
+    empty = Track(name=AliasedString(""))
+    named = Track(name=AliasedString("Fireflies"), length=228)
+    index = CandidateIndex([empty, named])
+    assert index.candidates(Track(name=AliasedString("Vanilla Twilight"))) == [empty]
+    assert index.candidates(empty) == [empty, named]
+
+    short = Track(name=AliasedString(""), length=120)
+    index = CandidateIndex([short, named])
+    assert index.candidates(Track(name=AliasedString("Fireflies"), length=230)) == [
+        named
+    ]
+    # empty names match each other, whatever the length
+    assert index.candidates(Track(name=AliasedString(""), length=226)) == [
+        short,
+        named,
+    ]
+
+
+def test_length_alone_makes_no_candidates():
+    index = CandidateIndex([Track(name=AliasedString("Fireflies"), length=228)])
+    assert (
+        index.candidates(Track(name=AliasedString("Hello Seattle"), length=228)) == []
+    )
+
+
+def test_punctuation_names_are_candidates():
+    index = CandidateIndex([Track(name=AliasedString("!!!"), length=100)])
+    assert len(index.candidates(Track(name=AliasedString("!!!"), length=200))) == 1
+
+
+def test_common_words_need_a_second_key():
+    def track(name: str, length: int, artist: str = "x") -> Track:
+        return Track(
+            name=AliasedString(name), artists=[AliasedString(artist)], length=length
+        )
+
+    library = [
+        track("Love Story", 200, "a"),
+        track("Love Song Feat", 300, "b"),
+        track("Love Me Feat", 400, "c"),
+        track("Love", 203, "d"),
+    ]
+    index = CandidateIndex(library)
+    index.max_block_size = 2  # "love" and "feat" are common
+
+    names = lambda tracks: [t.name.value for t in tracks]
+    # a similar length, or a second common word
+    assert names(index.candidates(track("Love You Feat", 201))) == [
+        "Love Story",
+        "Love Song Feat",
+        "Love Me Feat",
+        "Love",
+    ]
+    assert names(index.candidates(track("Love You", 250))) == []
+    assert names(index.candidates(track("Love Me", 250))) == ["Love Me Feat"]
+
+    # unlike comparing all pairs, a single shared common word with a different
+    # length misses a match
+    query = track("Love", 250, "dd")
+    assert DefaultMatcherStrategy().are_same(query, library[3])
+    assert names(index.candidates(query)) == []
@@ -1 +1,379 @@
+from pathlib import Path
+import threading
+import time
+from typing import Dict, List, Optional
+
 import pytest
+from unitunes.file_manager import FileManager
+from unitunes.index import Index
+from unitunes.main import PlaylistManager
+from unitunes.playlist import PlaylistDetails
+from unitunes.remote_snapshots import RemoteSnapshots
+from unitunes.services.services import ServiceConfig, StreamingService
+from unitunes.track import AliasedString, Track
+from unitunes.types import ServiceType
+from unitunes.uri import (
+    BeatsaberPlaylistURI,
+    BeatsaberTrackURI,
+    PlaylistURI,
+    SpotifyTrackURI,
+)
+
+
+class FakeService(StreamingService):
+    """Serves fixed playlists, waiting at a barrier so fetches must overlap."""
+
+    remote: Dict[str, List[str]]
+    barrier: threading.Barrier
+
+    def __init__(self, remote: Dict[str, List[str]], barrier: threading.Barrier):
+        super().__init__("fake", ServiceType.BEATSABER, Path())
+        self.remote = remote
+        self.barrier = barrier
+
+    def load_config(self, config: ServiceConfig) -> None:
+        pass
+
+    def pull_metadata(self, uri: PlaylistURI) -> PlaylistDetails:
+        return PlaylistDetails(name=uri.uri, description="")
+
+    def pull_tracks(self, uri: PlaylistURI) -> List[Track]:
+        self.barrier.wait(5)
+        # finish in reverse order of the playlist's uris
+        time.sleep(0.05 * (len(self.remote) - list(self.remote).index(uri.uri)))
+        return [
+            Track(name=AliasedString(name), uris=[BeatsaberTrackURI.from_uri(name)])
+            for name in self.remote[uri.uri]
+        ]
+
+
+@pytest.fixture
+def pm(tmp_path: Path) -> PlaylistManager:
+    return PlaylistManager(Index(), FileManager(tmp_path))
+
+
+def test_pull_fetches_concurrently_and_merges_in_order(pm: PlaylistManager):
+    remote = {"a.bplist": ["one", "two"], "b.bplist": ["two", "three"]}
+    pm.services["fake"] = FakeService(remote, threading.Barrier(len(remote)))
+    pm.add_playlist("pl")
+    for name in remote:
+        pm.add_uri_to_playlist("pl", "fake", BeatsaberPlaylistURI.from_uri(name))
+
+    progress = []
+    pm.pull_playlist("pl", progress_callback=lambda x, y: progress.append((x, y)))
+
+    tracks = pm.playlists["pl"].tracks
+    assert [t.name.value for t in tracks] == ["one", "two", "three"]
+    assert pm.playlists["pl"].name == "b.bplist"  # last merged metadata wins
+    assert progress == [(0, 2), (1, 2), (2, 2)]
+
+
+class VersionedService(FakeService):
+    pulls: int = 0
+
+    def __init__(self, remote: Dict[str, List[str]]):
+        super().__init__(remote, threading.Barrier(1))
+
+    def playlist_version(self, uri: PlaylistURI) -> Optional[str]:
+        return ",".join(self.remote[uri.uri])
+
+    def pull_tracks(self, uri: PlaylistURI) -> List[Track]:
+        self.pulls += 1
+        return super().pull_tracks(uri)
+
+
+def test_incremental_pull_skips_unchanged(tmp_path: Path, pm: PlaylistManager):
+    service = VersionedService({"a.bplist": ["one"]})
+    pm.services["fake"] = service
+    pm.add_playlist("pl")
+    pm.add_uri_to_playlist("pl", "fake", BeatsaberPlaylistURI.from_uri("a.bplist"))
+
+    pm.pull_playlist("pl", incremental=True)
+    pm.save_playlist("pl")
+    assert service.pulls == 1
+
+    # the ledger is persisted with the playlist
+    pm = PlaylistManager(Index(playlists=["pl"]), FileManager(tmp_path))
+    pm.services["fake"] = service
+    pm.pull_playlist("pl", incremental=True)
+    assert service.pulls == 1
+    pm.pull_playlist("pl")
+    assert service.pulls == 2
+
+    service.remote["a.bplist"].append("two")
+    pm.pull_playlist("pl", incremental=True)
+    assert service.pulls == 3
+    assert [t.name.value for t in pm.playlists["pl"].tracks] == ["one", "two"]
+
+
+def test_uri_index_follows_changes(tmp_path: Path, pm: PlaylistManager):
+    service = VersionedService({"a.bplist": ["one", "two"]})
+    pm.services["fake"] = service
+    pm.add_playlist("pl")
+    uri = BeatsaberPlaylistURI.from_uri("a.bplist")
+    assert not pm.is_tracking_playlist(uri)
+    pm.add_uri_to_playlist("pl", "fake", uri)
+    assert pm.playlists_with_uri(uri) == {"pl"}
+    with pytest.raises(ValueError):
+        pm.add_uri_to_playlist("pl", "fake", uri)
+
+    one, two = BeatsaberTrackURI.from_uri("one"), BeatsaberTrackURI.from_uri("two")
+    assert pm.tracks_with_uri(one) == []
+    pm.pull_playlist("pl")
+    [(playlist_id, track)] = pm.tracks_with_uri(one)
+    assert playlist_id == "pl" and track.name.value == "one"
+
+    # a uri the remote dropped is removed from the index with the track
+    service.remote["a.bplist"] = ["one"]
+    pm.pull_playlist("pl")
+    assert pm.tracks_with_uri(two) == []
+
+    # the index is rebuilt when loading
+    pm.save_playlist("pl")
+    pm = PlaylistManager(Index(playlists=["pl"]), FileManager(tmp_path))
+    assert pm.is_tracking_playlist(uri)
+    assert len(pm.tracks_with_uri(one)) == 1
+
+    pm.remove_uri_from_playlist("pl", "fake", uri)
+    assert not pm.is_tracking_playlist(uri)
+    pm.remove_playlist("pl")
+    assert pm.tracks_with_uri(one) == []
+
+
+class SearchableService(FakeService):
+    """Finds every track, waiting at a barrier so searches must overlap."""
+
+    search_concurrency = 2
+
+    def __init__(self, barrier: threading.Barrier):
+        super().__init__({}, barrier)
+
+    def query_generator(self, track: Track) -> List[str]:
+        return [track.name.value]
+
+    def search_query(self, query: str) -> List[Track]:
+        self.barrier.wait(5)
+        return [
+            Track(name=AliasedString(query), uris=[BeatsaberTrackURI.from_uri(query)])
+        ]
+
+
+def test_search_runs_concurrently(pm: PlaylistManager):
+    pm.services["fake"] = SearchableService(threading.Barrier(2))
+    pm.add_playlist("pl")
+    pm.add_uri_to_playlist("pl", "fake", BeatsaberPlaylistURI.from_uri("a.bplist"))
+    names = ["one", "two", "three", "four"]
+    pm.playlists["pl"].tracks = [Track(name=AliasedString(name)) for name in names]
+
+    progress = []
+    pm.search_playlist("pl", progress_callback=lambda x, y: progress.append((x, y)))
+
+    assert progress == [(i, 4) for i in range(5)]
+    for track in pm.playlists["pl"].tracks:
+        assert track.uris == [BeatsaberTrackURI.from_uri(track.name.value)]
+
+
+class CountingSearchService(SearchableService):
+    queries: List[str]
+
+    def __init__(self):
+        super().__init__(threading.Barrier(1))
+        self.queries = []
+
+    def search_query(self, query: str) -> List[Track]:
+        self.queries.append(query)
+        return super().search_query(query)
+
+
+class FailingSearchService(CountingSearchService):
+    def search_query(self, query: str) -> List[Track]:
+        if query == "two":
+            raise RuntimeError("search failed")
+        return super().search_query(query)
+
+
+def test_failed_searches_leave_their_track_unmatched(pm: PlaylistManager):
+    pm.services["fake"] = FailingSearchService()
+    tracks = [Track(name=AliasedString(name)) for name in ["one", "two", "three"]]
+
+    predictions = pm.search_tracks([("fake", track) for track in tracks])
+
+    assert [p and p.name.value for p in predictions] == ["one", None, "three"]
+
+
+def test_search_all_searches_each_song_once(pm: PlaylistManager):
+    service = CountingSearchService()
+    pm.services["fake"] = service
+    for playlist_id, names in [("a", ["one", "two"]), ("b", ["two", "three"])]:
+        pm.add_playlist(playlist_id)
+        pm.add_uri_to_playlist(
+            playlist_id, "fake", BeatsaberPlaylistURI.from_uri(f"{playlist_id}.bplist")
+        )
+        pm.playlists[playlist_id].tracks = [
+            Track(name=AliasedString(name), length=100) for name in names
+        ]
+
+    pm.search_all()
+
+    assert sorted(service.queries) == ["one", "three", "two"]
+    two = BeatsaberTrackURI.from_uri("two")
+    # the result is added to both copies
+    assert [
+        track.uris
+        for playlist in pm.playlists.values()
+        for track in playlist.tracks
+        if track.name.value == "two"
+    ] == [[two], [two]]
+
+
+def test_search_reuses_uris_of_library_copies(pm: PlaylistManager):
+    service = CountingSearchService()
+    pm.services["fake"] = service
+    spotify = SpotifyTrackURI.from_uri("123456")
+    one = BeatsaberTrackURI.from_uri("one")
+    for playlist_id, track in [
+        ("a", Track(name=AliasedString("One"), uris=[spotify, one])),
+        ("b", Track(name=AliasedString("One (Live)"), uris=[spotify])),
+    ]:
+        pm.add_playlist(playlist_id)
+        pm.add_uri_to_playlist(
+            playlist_id, "fake", BeatsaberPlaylistURI.from_uri(f"{playlist_id}.bplist")
+        )
+        pm.playlists[playlist_id].tracks = [track]
+        pm.uri_index.update_playlist(playlist_id, pm.playlists[playlist_id])
+
+    pm.search_playlist("b")
+    assert service.queries == []
+    assert pm.playlists["b"].tracks[0].uris == [spotify, one]
+    assert len(pm.tracks_with_uri(one)) == 2
+
+    # unless that uri is known to be bad for the track
+    track = pm.playlists["b"].tracks[0]
+    track.uris.remove(one)
+    track.bad_uris.append(one)
+    pm.search_playlist("b")
+    assert service.queries == ["One (Live)"]
+
+
+class PushableService(VersionedService):
+    """Versioned by its tracks, so pushes change the version."""
+
+    def add_tracks(self, playlist_uri: PlaylistURI, tracks: List[Track]) -> None:
+        self.remote[playlist_uri.uri] += [track.name.value for track in tracks]
+
+    def remove_tracks(self, playlist_uri: PlaylistURI, tracks: List[Track]) -> None:
+        removed = {track.name.value for track in tracks}
+        self.remote[playlist_uri.uri] = [
+            name for name in self.remote[playlist_uri.uri] if name not in removed
+        ]
+
+    def update_metadata(self, playlist_uri: PlaylistURI, metadata) -> None:
+        pass
+
+    def create_playlist(self, title: str, description: str = "") -> PlaylistURI:
+        raise NotImplementedError
+
+    def is_uri_alive(self, uri) -> bool:
+        return True
+
+
+def test_push_reuses_pulled_tracks(pm: PlaylistManager):
+    service = PushableService({"a.bplist": ["one"]})
+    pm.services["fake"] = service
+    pm.add_playlist("pl")
+    pm.add_uri_to_playlist("pl", "fake", BeatsaberPlaylistURI.from_uri("a.bplist"))
+
+    pm.pull_playlist("pl")
+    pm.playlists["pl"].tracks.append(
+        Track(name=AliasedString("two"), uris=[BeatsaberTrackURI.from_uri("two")])
+    )
+    pm.push_playlist("pl")
+    assert service.pulls == 1
+    assert service.remote["a.bplist"] == ["one", "two"]
+
+    # the push wrote to the playlist, so the next push pulls again
+    pm.push_playlist("pl")
+    assert service.pulls == 2
+
+    # so does a push after the remote changed since the pull
+    pm.pull_playlist("pl")
+    service.remote["a.bplist"].append("three")
+    pm.push_playlist("pl")
+    assert service.pulls == 4
+    assert service.remote["a.bplist"] == ["one", "two"]
+
+
+def test_remote_snapshots_expire():
+    now = [0.0]
+    snapshots = RemoteSnapshots(max_age=10, clock=lambda: now[0])
+    uri = BeatsaberPlaylistURI.from_uri("a.bplist")
+    metadata = PlaylistDetails(name="a", description="")
+    snapshots.put("fake", uri, [Track(name=AliasedString("one"))], metadata, "v1")
+
+    snapshot = snapshots.get("fake", uri)
+    assert snapshot is not None and snapshot.metadata == metadata
+    [track] = snapshot.tracks
+    assert track.name.value == "one"
+    assert snapshots.get("fake", uri, lambda: "v2") is None
+    now[0] = 11
+    assert snapshots.get("fake", uri) is None
+    # a matching version is enough, however old the snapshot
+    assert snapshots.get("fake", uri, lambda: "v1") is not None
+
+
+class ReplaceableService(PushableService):
+    """Pulls leave out the items in local, as Spotify does with local files."""
+
+    local: Dict[str, List[str]]
+    replaced: int = 0
+
+    def __init__(self, remote: Dict[str, List[str]], local: Dict[str, List[str]]):
+        super().__init__(remote)
+        self.local = local
+
+    def replace_tracks(self, playlist_uri: PlaylistURI, tracks: List[Track]) -> None:
+        self.replaced += 1
+        self.remote[playlist_uri.uri] = [track.name.value for track in tracks]
+
+    def replace_calls(self, playlist_uri: PlaylistURI, tracks: int) -> Optional[int]:
+        return 1
+
+    def skipped_items(self, playlist_uri: PlaylistURI) -> Optional[int]:
+        return len(self.local.get(playlist_uri.uri, []))
+
+
+@pytest.mark.parametrize("local", [[], ["my recording.mp3"]])
+def test_push_only_replaces_remotes_it_fully_pulled(
+    pm: PlaylistManager, local: List[str]
+):
+    service = ReplaceableService({"a.bplist": ["one", "two"]}, {"a.bplist": local})
+    pm.services["fake"] = service
+    pm.add_playlist("pl")
+    pm.add_uri_to_playlist("pl", "fake", BeatsaberPlaylistURI.from_uri("a.bplist"))
+
+    pm.pull_playlist("pl")
+    pm.playlists["pl"].tracks = [
+        Track(name=AliasedString(name), uris=[BeatsaberTrackURI.from_uri(name)])
+        for name in ["three", "four"]
+    ]
+    pm.push_playlist("pl")
+
+    # replacing costs one call instead of four, but would delete the local file
+    assert service.replaced == (0 if local else 1)
+    assert service.remote["a.bplist"] == ["three", "four"]
+
+
+def test_dry_run_push_only_prints_the_plan(pm: PlaylistManager, capsys):
+    service = PushableService({"a.bplist": ["one"]})
+    pm.services["fake"] = service
+    pm.add_playlist("pl")
+    pm.add_uri_to_playlist("pl", "fake", BeatsaberPlaylistURI.from_uri("a.bplist"))
+    pm.playlists["pl"].tracks = [
+        Track(name=AliasedString("two"), uris=[BeatsaberTrackURI.from_uri("two")])
+    ]
+
+    pm.push_playlist("pl", dry_run=True)
+    assert service.remote["a.bplist"] == ["one"]
+    out = capsys.readouterr().out
+    assert "add 1 tracks, remove 1 tracks (3 calls)" in out
+    assert "Push plan: 3 calls (dry run)" in out
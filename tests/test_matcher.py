@@ -0,0 +1,104 @@
+from hypothesis import given, strategies as st
+from typing import List
+import numpy as np
+from unitunes.matcher import (
+    DefaultMatcherStrategy,
+    MatcherStrategy,
+    normalized_value_similarity,
+    value_similarity_matrix,
+)
+from unitunes.normalize import NormalizedValue
+from unitunes.track import AliasedString, Track
+from unitunes.uri import SpotifyTrackURI
+
+from tests.test_candidate_index import fixture_tracks
+
+
+def test_similarity_matrix_matches_similarity():
+    tracks = fixture_tracks()
+    matcher = DefaultMatcherStrategy()
+    batched = matcher.similarity_matrix(tracks, tracks[::3])
+    pairwise = MatcherStrategy.similarity_matrix(matcher, tracks, tracks[::3])
+    assert batched.shape == (len(tracks), len(tracks[::3]))
+    assert np.array_equal(batched, pairwise)
+
+
+def test_similarity_matrix_edge_cases():
+    matcher = DefaultMatcherStrategy()
+    uri = SpotifyTrackURI.from_uri("123456")
+    a = Track(name=AliasedString("Fireflies"), uris=[uri])
+    b = Track(name=AliasedString("Vanilla Twilight"), artists=[], uris=[uri])
+    c = Track(name=AliasedString("Fireflies (Remix)"), length=228)
+
+    assert matcher.similarity_matrix([], [a]).shape == (0, 1)
+    scores = matcher.similarity_matrix([a, c], [b, c])
+    assert scores[0, 0] == 1  # shared uri
+    assert scores[0, 1] == matcher.similarity(a, c) == 0  # remix
+    assert scores[1, 1] == 1
+
+
+def test_string_pairs_are_memoized():
+    matcher = DefaultMatcherStrategy(memo_size=2)
+    various = AliasedString("Various Artists")
+    track1 = Track(name=AliasedString("Fireflies"), artists=[various])
+    track2 = Track(name=AliasedString("Firefly"), artists=[various])
+
+    score = matcher.similarity(track1, track2)
+    assert matcher.similarity(track1, track2) == score
+    info = matcher.similarity_cache_info()
+    assert (info.hits, info.misses, info.currsize) == (2, 2, 2)
+
+
+def test_similarity_matrix_uses_the_weights():
+    tracks = fixture_tracks()[:40]
+    matcher = DefaultMatcherStrategy()
+    matcher.weights = {"name": 10, "album": 40, "artists": 5, "length": 45}
+    batched = matcher.similarity_matrix(tracks, tracks)
+    pairwise = MatcherStrategy.similarity_matrix(matcher, tracks, tracks)
+    assert np.array_equal(batched, pairwise)
+
+
+@given(
+    st.lists(st.tuples(st.text(max_size=12), st.integers(0, 1)), max_size=8),
+    st.lists(st.tuples(st.text(max_size=12), st.integers(0, 1)), max_size=8),
+    st.integers(1, 10),
+)
+def test_value_similarity_matrix_is_jaro_winkler(
+    values1: List[NormalizedValue], values2: List[NormalizedValue], chunk_size: int
+):
+    scores = value_similarity_matrix(values1 + values2, values2, chunk_size)
+    for i, v1 in enumerate(values1 + values2):
+        for j, v2 in enumerate(values2):
+            assert scores[i, j] == normalized_value_similarity(v1, v2)
+
+
+words = st.sampled_from(["fire", "flies", "firefly", "live", "remix", "owl", "city"])
+aliased_strings = st.builds(
+    AliasedString,
+    value=st.lists(words, max_size=3).map(" ".join),
+    aliases=st.lists(st.lists(words, min_size=1, max_size=2).map(" ".join), max_size=2),
+)
+tracks = st.builds(
+    Track,
+    name=aliased_strings,
+    artists=st.lists(aliased_strings, max_size=2),
+    albums=st.lists(aliased_strings, max_size=2),
+    length=st.one_of(st.none(), st.integers(200, 210)),
+    uris=st.lists(
+        st.sampled_from(["1", "2"]).map(SpotifyTrackURI.from_uri), max_size=1
+    ),
+)
+
+
+@given(tracks, tracks, st.floats(0, 1))
+def test_similarity_at_least_agrees_with_similarity(
+    track1: Track, track2: Track, threshold: float
+):
+    matcher = DefaultMatcherStrategy()
+    score = matcher.similarity(track1, track2)
+    assert matcher.similarity_at_least(track1, track2, threshold) == (
+        score >= threshold
+    )
+    # borderline thresholds
+    assert matcher.similarity_at_least(track1, track2, score)
+    assert not matcher.similarity_at_least(track1, track2, np.nextafter(score, 2))
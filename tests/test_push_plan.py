@@ -0,0 +1,122 @@
+from pathlib import Path
+from typing import List, Optional
+
+from unitunes.matcher import DefaultMatcherStrategy
+from unitunes.playlist import Playlist, PlaylistDetails
+from unitunes.push_plan import plan_push
+from unitunes.services.services import ServiceConfig, StreamingService
+from unitunes.track import AliasedString, Track
+from unitunes.types import ServiceType
+from unitunes.uri import BeatsaberPlaylistURI, BeatsaberTrackURI, PlaylistURI
+
+NAMES = ["Yesterday", "Bohemian Rhapsody", "Smells Like Teen Spirit", "Hey Jude"]
+NEW_NAMES = ["Africa", "Wonderwall", "Billie Jean", "Hotel California"]
+URI = BeatsaberPlaylistURI.from_uri("a.bplist")
+
+
+class ChunkedService(StreamingService):
+    """Writes two tracks per call, and replaces like Spotify."""
+
+    def __init__(self):
+        super().__init__("fake", ServiceType.BEATSABER, Path())
+
+    def load_config(self, config: ServiceConfig) -> None:
+        pass
+
+    def add_calls(self, playlist_uri: PlaylistURI, tracks: int) -> int:
+        return (tracks + 1) // 2
+
+    def remove_calls(self, playlist_uri: PlaylistURI, tracks: int) -> int:
+        return (tracks + 1) // 2
+
+    def replace_tracks(self, playlist_uri: PlaylistURI, tracks: List[Track]) -> None:
+        pass
+
+    def replace_calls(self, playlist_uri: PlaylistURI, tracks: int) -> Optional[int]:
+        return max(1, (tracks + 1) // 2)
+
+    def skipped_items(self, playlist_uri: PlaylistURI) -> Optional[int]:
+        return 0
+
+
+def tracks(*names: str) -> List[Track]:
+    return [
+        Track(name=AliasedString(name), uris=[BeatsaberTrackURI.from_uri(name)])
+        for name in names
+    ]
+
+
+def plan(current: List[str], new: List[str], metadata=None, complete=True):
+    playlist = Playlist(name="a", tracks=tracks(*new))
+    return plan_push(
+        ChunkedService(),
+        URI,
+        playlist,
+        tracks(*current),
+        metadata if metadata is not None else playlist.metadata(),
+        DefaultMatcherStrategy(),
+        complete=complete,
+    )
+
+
+def test_unchanged_playlist_costs_nothing():
+    p = plan(NAMES, NAMES)
+    assert p.calls == 0 and p.metadata is None and not p.add and not p.remove
+
+    p = plan(NAMES, NAMES, PlaylistDetails(name="old", description=""))
+    assert p.calls == 1 and p.metadata == PlaylistDetails(name="a", description="")
+
+
+class LikedSongsService(ChunkedService):
+    """Like Spotify's Liked Songs, which has no name or description to change."""
+
+    def metadata_editable(self, playlist_uri: PlaylistURI) -> bool:
+        return False
+
+
+def test_uneditable_metadata_is_not_pushed():
+    playlist = Playlist(name="a", tracks=tracks(*NAMES))
+    p = plan_push(
+        LikedSongsService(),
+        URI,
+        playlist,
+        tracks(*NAMES),
+        PlaylistDetails(name="Liked Songs", description=""),
+        DefaultMatcherStrategy(),
+    )
+    assert p.metadata is None and p.calls == 0
+    assert p.describe().endswith("up to date (0 calls)")
+
+
+def test_small_changes_are_diffed():
+    p = plan(NAMES[:2], NAMES[:3])
+    assert p.replace is None
+    assert [t.name.value for t in p.add] == [NAMES[2]]
+    assert p.calls == 1
+
+
+def test_heavy_changes_replace():
+    p = plan(NAMES, NEW_NAMES)
+    assert p.replace is not None
+    assert [t.name.value for t in p.replace] == NEW_NAMES
+    assert p.calls == 2  # instead of 4 for removing and adding
+
+
+def test_never_replaces_remotes_with_items_that_arent_tracks():
+    # e.g. a local file the pull left out, which a replace would delete
+    p = plan(NAMES, NEW_NAMES, complete=False)
+    assert p.replace is None
+    assert len(p.add) == 4 and len(p.remove) == 4 and p.calls == 4
+
+    p = plan(NAMES[:1], NEW_NAMES[:1] + NAMES[:1], complete=False)
+    assert p.replace is None
+
+
+def test_equal_cost_replaces_to_fix_order():
+    # adding a track in front costs one call either way, but only a replace puts it
+    # first
+    p = plan(NAMES[:1], NEW_NAMES[:1] + NAMES[:1])
+    assert p.replace is not None and p.calls == 1
+
+    p = plan(NAMES[:1], NAMES[:1] + NEW_NAMES[:1])
+    assert p.replace is None and p.calls == 1
@@ -0,0 +1,148 @@
+from pathlib import Path
+from typing import List, Optional
+
+import pytest
+from unitunes.services.beatsaber import BeatsaberConfig
+from unitunes.services.musicbrainz import MusicBrainz, MusicBrainzConfig
+from unitunes.services.rate_limit import AdaptiveRateLimiter, RateLimiter, rate_limiter
+from unitunes.services.services import ServiceConfig, ServiceWrapper, StreamingService
+from unitunes.types import ServiceType
+
+
+class FakeClock:
+    now: float = 0.0
+    sleeps: List[float]
+
+    def __init__(self) -> None:
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+
+
+def test_rate_limiter_spaces_calls():
+    clock = FakeClock()
+    limiter = RateLimiter(rate=2, burst=2, clock=clock, sleep=clock.sleep)
+    for _ in range(4):
+        limiter.acquire()
+    # the burst is free, then each call waits for the slot after the previous one
+    assert clock.sleeps == [0.5, 1.0]
+
+    clock.now = 10
+    limiter.acquire()
+    assert clock.sleeps == [0.5, 1.0]
+
+
+def test_unlimited_rate_never_waits():
+    clock = FakeClock()
+    limiter = RateLimiter(clock=clock, sleep=clock.sleep)
+    for _ in range(100):
+        limiter.acquire()
+    assert clock.sleeps == []
+
+
+class Throttled(Exception):
+    pass
+
+
+def throttle_delay(error: Exception):
+    return 3.0 if isinstance(error, Throttled) else None
+
+
+def test_call_retries_throttled_requests():
+    clock = FakeClock()
+    limiter = RateLimiter(clock=clock, sleep=clock.sleep, jitter=lambda: 0.0)
+    responses = [Throttled(), Throttled(), "ok"]
+
+    def request():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert limiter.call(request, throttle_delay) == "ok"
+    # the service's delay, which is longer than the backoff
+    assert clock.sleeps == [3.0, 3.0]
+
+    with pytest.raises(ValueError):
+        limiter.call(lambda: int("x"), throttle_delay)
+
+
+def test_adaptive_rate_grows_until_throttled():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(
+        rate=1, max_rate=4, clock=clock, sleep=clock.sleep, jitter=lambda: 0.0
+    )
+    for _ in range(20):
+        limiter.call(lambda: None, throttle_delay)
+    assert limiter.rate == 4
+
+    def throttled():
+        raise Throttled()
+
+    with pytest.raises(Throttled):
+        limiter.call(throttled, throttle_delay, retries=1)
+    assert limiter.rate == 2
+    # held for the delay, so a call right after waits for it
+    clock.sleeps.clear()
+    limiter.acquire()
+    assert clock.sleeps[0] == 3.0
+
+
+def test_throttled_callers_resume_apart():
+    clock = FakeClock()
+    jitters = [0.0, 0.5, 1.0]
+    limiter = RateLimiter(clock=clock, sleep=clock.sleep, jitter=jitters.pop)
+    limiter.throttled(2.0)
+    for _ in range(3):
+        limiter.acquire()
+    assert clock.sleeps == [3.0, 2.5, 2.0]
+
+
+def test_rate_limiter_from_config():
+    assert rate_limiter(None, None).rate is None
+    assert not isinstance(rate_limiter(2, None), AdaptiveRateLimiter)
+    adaptive = rate_limiter(None, 5)
+    assert isinstance(adaptive, AdaptiveRateLimiter) and adaptive.rate == 5
+
+
+class LimitedService(StreamingService):
+    def __init__(self, cache_root: Path, max_rate: Optional[float]) -> None:
+        super().__init__("fake", ServiceType.BEATSABER, cache_root)
+        self.wrapper = ServiceWrapper("fake", cache_root)
+        self.wrapper.max_requests_per_second = max_rate
+
+    def load_config(self, config: ServiceConfig) -> None:
+        pass
+
+
+def test_slow_services_search_one_query_at_a_time(tmp_path: Path):
+    config = BeatsaberConfig()
+    one_per_second = LimitedService(tmp_path, 1.0)
+    one_per_second.apply_limits(config)
+    assert one_per_second.parallel_queries == 1
+
+    fast = LimitedService(tmp_path, 20.0)
+    fast.apply_limits(config)
+    assert fast.parallel_queries == 2
+
+    one_per_second.apply_limits(BeatsaberConfig(parallel_queries=3))
+    assert one_per_second.parallel_queries == 3
+
+
+def test_musicbrainz_applies_its_config(tmp_path: Path):
+    default = MusicBrainz(tmp_path)
+    assert default.parallel_queries == 1
+    assert default.search_concurrency == MusicBrainzConfig().search_concurrency
+
+    service = MusicBrainz(
+        tmp_path,
+        MusicBrainzConfig(
+            search_concurrency=2, parallel_queries=3, requests_per_second=0.5
+        ),
+    )
+    assert (service.search_concurrency, service.parallel_queries) == (2, 3)
+    assert service.wrapper.rate_limiter.rate == 0.5
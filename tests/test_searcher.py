@@ -0,0 +1,132 @@
+import threading
+from typing import Dict, List, Sequence
+
+import numpy as np
+from unitunes.matcher import DefaultMatcherStrategy
+from unitunes.query_stats import QueryStats
+from unitunes.searcher import DefaultSearcherStrategy
+from unitunes.track import AliasedString, Track
+
+
+def named(*names: str) -> List[Track]:
+    return [Track(name=AliasedString(name)) for name in names]
+
+
+class FakeSearch:
+    results: Dict[str, List[Track]]
+    started: List[str]
+    # set once the third query starts, which the second query waits for
+    third_started: threading.Event
+
+    def __init__(self, results: Dict[str, List[Track]]):
+        self.results = results
+        self.started = []
+        self.lock = threading.Lock()
+        self.third_started = threading.Event()
+
+    def query_generator(self, track: Track) -> List[str]:
+        return list(self.results)
+
+    def search_query(self, query: str) -> List[Track]:
+        with self.lock:
+            self.started.append(query)
+        if query == "third":
+            self.third_started.set()
+        if query == "second":
+            # answer after the first query, once the third is in flight
+            self.third_started.wait(5)
+        return self.results[query]
+
+
+class CountingMatcher(DefaultMatcherStrategy):
+    scored: int = 0
+
+    def similarity_matrix(
+        self, tracks1: Sequence[Track], tracks2: Sequence[Track]
+    ) -> np.ndarray:
+        self.scored += len(tracks1) * len(tracks2)
+        return super().similarity_matrix(tracks1, tracks2)
+
+
+def test_parallel_queries_give_sequential_results():
+    track = Track(name=AliasedString("Fireflies"))
+    results = {
+        "first": named("Hello Seattle", "Vanilla Twilight"),
+        "second": named("Vanilla Twilight", "Fireflies"),
+        "third": named("Fireflies (Remix)"),
+        "fourth": named("Fireflies"),
+    }
+
+    sequential = DefaultSearcherStrategy(CountingMatcher())
+    ungated = FakeSearch(results)
+    ungated.third_started.set()
+    expected = sequential.search(ungated, track)  # type: ignore
+    assert expected[0].name.value == "Fireflies" and len(expected) == 3
+
+    matcher = CountingMatcher()
+    service = FakeSearch(results)
+    parallel = DefaultSearcherStrategy(matcher, parallel_queries=2)
+    assert parallel.search(service, track) == expected  # type: ignore
+    # the second query matched, so only one query was started speculatively
+    assert sorted(service.started) == ["first", "second", "third"]
+    # each unique candidate is scored once
+    assert matcher.scored == 3
+
+
+class TemplatedSearch:
+    """Only the query without the artist finds the track."""
+
+    queries: List[str]
+
+    def __init__(self):
+        self.queries = []
+
+    def query_generator(self, track: Track) -> List[dict]:
+        return [{"artist": "x"}, {}]
+
+    def query_template(self, query: dict) -> str:
+        return "full" if query else "drop artist"
+
+    def search_query(self, query: dict) -> List[Track]:
+        self.queries.append(self.query_template(query))
+        return [] if query else named("Fireflies")
+
+
+def test_query_stats_reorder_templates():
+    stats = QueryStats()
+    service = TemplatedSearch()
+    searcher = DefaultSearcherStrategy(DefaultMatcherStrategy(), stats=stats)
+    track = Track(name=AliasedString("Fireflies"))
+
+    searcher.search(service, track)  # type: ignore
+    assert service.queries == ["full", "drop artist"]
+    searcher.search(service, track)  # type: ignore
+    assert service.queries[2:] == ["drop artist"]
+
+    # the stats survive a save and load
+    searcher.stats = stats = QueryStats.parse_raw(stats.json())
+    templates = stats.services["TemplatedSearch"].templates
+    assert (templates["full"].won, templates["full"].tried) == (0, 1)
+    assert (templates["drop artist"].won, templates["drop artist"].tried) == (2, 2)
+    assert stats.services["TemplatedSearch"].calls == 3
+    assert stats.services["TemplatedSearch"].default_calls == 4
+    assert "1 saved" in stats.report()
+
+    # a template that never wins is skipped, but never the only one
+    assert stats.order("s", ["full"]) == [0]
+    for _ in range(QueryStats.skip_after):
+        stats.record("s", ["full", "drop"], ["full", "drop"], 2, "drop")
+    assert stats.order("s", ["full", "drop"]) == [1]
+    # except in some searches, to notice if it starts winning
+    for _ in range(QueryStats.explore_every - 1):
+        stats.record("s", ["full", "drop"], ["drop"], 1, "drop")
+    assert stats.order("s", ["full", "drop"]) == [1, 0]
+
+
+def test_query_stats_ignore_tracks_that_are_not_found():
+    stats = QueryStats()
+    for _ in range(QueryStats.skip_after * 2):
+        stats.record("s", ["full", "drop"], ["full", "drop"], 2, None)
+    assert stats.order("s", ["full", "drop"]) == [0, 1]
+    assert stats.services["s"].templates == {}
+    assert stats.services["s"].searches == QueryStats.skip_after * 2
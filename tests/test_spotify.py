@@ -3,6 +3,7 @@ from unitunes.services.services import Pushable
 from unitunes.services.spotify import (
     SpotifyConfig,
     SpotifyService,
+    fetch_all_pages,
 )
 from unitunes.uri import SpotifyPlaylistURI, SpotifyTrackURI
 
@@ -38,6 +39,23 @@ def test_spotify_can_pull_playlist(spotify_service):
     assert len(tracks) > 5
 
 
+def test_fetch_all_pages_in_order():
+    items = list(range(230))
+    offsets = []
+
+    def get_page(limit: int, offset: int) -> dict:
+        offsets.append(offset)
+        return {"total": len(items), "items": items[offset : offset + limit]}
+
+    assert fetch_all_pages(get_page, 50, max_workers=4) == items
+    assert sorted(offsets) == [0, 50, 100, 150, 200]  # no trailing empty page
+
+    offsets.clear()
+    items = []
+    assert fetch_all_pages(get_page, 50, max_workers=4) == []
+    assert offsets == [0]
+
+
 def test_liked_songs_uri():
     uri = SpotifyPlaylistURI.from_url("spotify:liked_songs")
     assert uri.uri == "Liked Songs"
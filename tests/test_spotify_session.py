@@ -0,0 +1,82 @@
+from typing import List
+
+import requests
+from requests.adapters import BaseAdapter
+from unitunes.services.spotify_session import SpotifySession, endpoint_name
+
+
+class CannedAdapter(BaseAdapter):
+    """Answers requests with the given statuses in turn."""
+
+    statuses: List[int]
+
+    def __init__(self, statuses: List[int], retry_after: str = "2") -> None:
+        super().__init__()
+        self.statuses = statuses
+        self.retry_after = retry_after
+
+    def send(self, request, **kwargs) -> requests.Response:
+        response = requests.Response()
+        response.status_code = self.statuses.pop(0)
+        response.url = request.url
+        response.request = request
+        if response.status_code == 429:
+            response.headers["Retry-After"] = self.retry_after
+        response._content = b"{}"
+        return response
+
+    def close(self) -> None:
+        pass
+
+
+def session_with(adapter: CannedAdapter, sleeps: List[float]):
+    session = SpotifySession(retries=2, sleep=sleeps.append, jitter=lambda: 0.5)
+    session.mount("https://", adapter)
+    return session
+
+
+def test_endpoint_names_hide_ids():
+    assert (
+        endpoint_name("get", "https://api.spotify.com/v1/playlists/37i9dQ/tracks?x=1")
+        == "GET /v1/playlists/{id}/tracks"
+    )
+    assert endpoint_name("get", "https://api.spotify.com/v1/me") == "GET /v1/me"
+    assert (
+        endpoint_name("get", "https://api.spotify.com/v1/me/tracks/contains")
+        == "GET /v1/me/tracks/contains"
+    )
+
+
+def test_server_errors_are_retried_with_backoff():
+    sleeps: List[float] = []
+    session = session_with(CannedAdapter([503, 502, 200]), sleeps)
+
+    response = session.get("https://api.spotify.com/v1/tracks/abc")
+    assert response.status_code == 200
+    # exponential backoff, each with a quarter of jitter
+    assert sleeps == [0.625, 1.25]
+    assert "GET /v1/tracks/{id}: 3 calls, 0 throttled" in session.report()
+
+
+def test_throttled_requests_are_left_to_the_rate_limiter():
+    sleeps: List[float] = []
+    session = session_with(CannedAdapter([429, 200]), sleeps)
+    assert session.get("https://api.spotify.com/v1/me").status_code == 429
+    assert sleeps == []
+    assert session.stats["GET /v1/me"].throttled == 1
+
+
+def test_server_errors_of_posts_are_not_retried():
+    # the tracks may have been added before the error
+    sleeps: List[float] = []
+    session = session_with(CannedAdapter([504, 200]), sleeps)
+    response = session.post("https://api.spotify.com/v1/playlists/abc/tracks")
+    assert response.status_code == 504
+    assert sleeps == []
+
+
+def test_gives_up_after_retries():
+    sleeps: List[float] = []
+    session = session_with(CannedAdapter([500, 500, 500]), sleeps)
+    assert session.get("https://api.spotify.com/v1/me").status_code == 500
+    assert len(sleeps) == 2
@@ -28,3 +28,30 @@ def test_track_merge():
     assert track1.uris == [uri1, uri2]
     assert track1.artists == [artist1]
     assert track1.albums == [album2]
+
+
+def test_normalized_forms_follow_changes():
+    s = AliasedString("Fireflies", aliases=["Fireflies (Live)"])
+    assert s.normalized_values() == [("fireflies", 0), ("fireflies (live)", 8)]
+    assert s.tokens() == {"fireflies", "live"}
+
+    s.add_alias("Luciole")
+    assert ("luciole", 0) in s.normalized_values()
+    s.value = "Vanilla Twilight"
+    assert s.normalized_values()[0] == ("vanilla twilight", 0)
+    assert "normalized" not in s.json()
+
+
+def test_track_normalized_values_follow_merge():
+    track1 = Track(name=AliasedString("Fireflies"), artists=[AliasedString("Owl City")])
+    track2 = Track(
+        name=AliasedString("Fireflies"),
+        artists=[AliasedString("Owl City", aliases=["Adam Young"])],
+        albums=[AliasedString("Ocean Eyes")],
+    )
+    assert track1.artist_values() == [("owl city", 0)]
+
+    track1.merge(track2)
+    assert track1.album_values() == [("ocean eyes", 0)]
+    track1.artists[0].add_alias("オウル・シティー")
+    assert ("オウル・シティー", 0) in track1.artist_values()
@@ -0,0 +1,43 @@
+import copy
+
+import pytest
+from pydantic import parse_obj_as
+from unitunes.track import AliasedString, Track
+from unitunes.uri import (
+    URI_from_url,
+    BeatsaberPlaylistURI,
+    SpotifyPlaylistURI,
+    TrackURIs,
+    YtmTrackURI,
+    all_uri_types,
+    playlistURI_from_url,
+    trackURI_from_url,
+)
+
+
+def test_uris_are_interned():
+    uri = YtmTrackURI.from_uri("dQw4w9WgXcQ")
+    assert YtmTrackURI.from_uri("dQw4w9WgXcQ") is uri
+    assert parse_obj_as(TrackURIs, uri.dict()) is uri
+    assert parse_obj_as(TrackURIs, {**uri.dict(), "service": "ytm"}) is uri
+    assert copy.deepcopy(uri) is uri
+
+    track = Track(name=AliasedString("Never Gonna Give You Up"), uris=[uri])
+    assert Track.parse_raw(track.json()).uris[0] is uri
+    assert track.copy(deep=True).uris[0] is uri
+
+
+def test_urls_round_trip():
+    for cls in all_uri_types:
+        uri = cls.from_uri("abc.bplist" if cls is BeatsaberPlaylistURI else "abc")
+        assert URI_from_url(uri.url) is uri
+
+    liked_songs = SpotifyPlaylistURI.from_uri("Liked Songs")
+    assert playlistURI_from_url("spotify:liked_songs") is liked_songs
+    # parameters after the id fall back to checking each type
+    assert (
+        playlistURI_from_url("https://open.spotify.com/playlist/abc?si=123").uri
+        == "abc"
+    )
+    with pytest.raises(ValueError):
+        trackURI_from_url("https://open.spotify.com/playlist/abc")
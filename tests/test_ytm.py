@@ -1,6 +1,9 @@
+from pathlib import Path
+from typing import List
+
 import pytest
-from unitunes.services.services import Pushable
-from unitunes.services.ytm import YTM, YtmConfig
+from unitunes.services.services import Pushable, ServiceWrapper
+from unitunes.services.ytm import YTM, PlaylistItems, YtmAPIWrapper, YtmConfig
 from unitunes.uri import YtmPlaylistURI, YtmTrackURI
 
 from tests.conftest import cache_path
@@ -47,3 +50,71 @@ def test_pull_metadata(ytm_service: YTM):
     metadata = ytm_service.pull_metadata(imagine_dragons_playlist_uri)
     assert metadata.name == "Presenting Imagine Dragons"
     assert metadata.description == "The most played hits and essential tracks."
+
+
+class FakeYTMusic:
+    """Serves one playlist with an item per video, counting fetches."""
+
+    items: List[dict]
+    fetches: int = 0
+
+    def __init__(self, video_ids: List[str]) -> None:
+        self.items = [
+            {"videoId": video_id, "setVideoId": f"set-{video_id}"}
+            for video_id in video_ids
+        ]
+
+    def get_playlist(self, playlist_id: str, limit: int) -> dict:
+        self.fetches += 1
+        return {"id": playlist_id, "tracks": list(self.items)}
+
+    def add_playlist_items(self, playlist_id: str, video_ids: List[str]) -> dict:
+        added = [{"videoId": v, "setVideoId": f"set-{v}"} for v in video_ids]
+        self.items += added
+        return {"status": "STATUS_SUCCEEDED", "playlistEditResults": added}
+
+    def remove_playlist_items(self, playlist_id: str, videos: List[dict]) -> str:
+        assert videos and all(video in self.items for video in videos)
+        self.items = [item for item in self.items if item not in videos]
+        return "STATUS_SUCCEEDED"
+
+
+def fake_wrapper(tmp_path: Path, video_ids: List[str]) -> YtmAPIWrapper:
+    wrapper = YtmAPIWrapper.__new__(YtmAPIWrapper)
+    ServiceWrapper.__init__(wrapper, "ytm", tmp_path)
+    wrapper.ytm = FakeYTMusic(video_ids)
+    wrapper.playlist_items = PlaylistItems()
+    return wrapper
+
+
+def test_removals_use_pulled_items(tmp_path: Path):
+    wrapper = fake_wrapper(tmp_path, ["a", "b", "c"])
+    wrapper.get_playlist("PL")
+    wrapper.remove_tracks("PL", ["b"])
+    wrapper.add_tracks("PL", ["d"])
+    wrapper.remove_tracks("PL", ["d"])
+    assert wrapper.ytm.fetches == 1
+    assert [item["videoId"] for item in wrapper.ytm.items] == ["a", "c"]
+
+
+def test_removals_refetch_unknown_items(tmp_path: Path):
+    wrapper = fake_wrapper(tmp_path, ["a", "b"])
+    wrapper.remove_tracks("PL", ["a"])  # never pulled
+    assert wrapper.ytm.fetches == 1
+
+    wrapper.ytm.items.append({"videoId": "c", "setVideoId": "set-c"})
+    wrapper.remove_tracks("PL", ["c"])  # added elsewhere since
+    assert wrapper.ytm.fetches == 2
+    assert [item["videoId"] for item in wrapper.ytm.items] == ["b"]
+
+
+def test_removals_skip_videos_not_in_the_playlist(tmp_path: Path):
+    wrapper = fake_wrapper(tmp_path, ["a", "b"])
+    wrapper.get_playlist("PL")
+    wrapper.remove_tracks("PL", ["a", "zzz"])
+    assert wrapper.ytm.fetches == 2
+    assert [item["videoId"] for item in wrapper.ytm.items] == ["b"]
+
+    # nothing left to remove, so no removal is sent
+    wrapper.remove_tracks("PL", ["zzz"])
+    assert [item["videoId"] for item in wrapper.ytm.items] == ["b"]
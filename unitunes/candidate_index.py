@@ -0,0 +1,131 @@
+from collections import defaultdict
+from typing import DefaultDict, Dict, List, Optional, Set, Tuple
+
+from unitunes.track import AliasedString, Track
+
+BlockKey = Tuple[str, str]
+
+# tracks whose lengths differ by more than this never get a length score
+LENGTH_TOLERANCE_SECONDS = 5
+
+
+def value_keys(kind: str, s: AliasedString) -> Set[BlockKey]:
+    """The words of a string, or its whole values if they have no words."""
+    if s.tokens():
+        return {(kind, token) for token in s.tokens()}
+    # e.g. "!!!", which still scores as a name
+    return {(kind, lowered) for lowered, _ in s.normalized_values() if lowered}
+
+
+def block_keys(track: Track) -> Set[BlockKey]:
+    keys: Set[BlockKey] = {("uri", uri.url) for uri in track.uris}
+    keys |= value_keys("name", track.name)
+    for artist in track.artists:
+        keys |= value_keys("artist", artist)
+    return keys
+
+
+def length_bucket(track: Track) -> Optional[int]:
+    """Tracks whose lengths are within the tolerance are at most one bucket apart."""
+    return track.length // LENGTH_TOLERANCE_SECONDS if track.length else None
+
+
+def similar_length(track1: Track, track2: Track) -> bool:
+    """False if both lengths are known and too far apart for a length score."""
+    if not track1.length or not track2.length:
+        return True
+    return abs(track1.length - track2.length) <= LENGTH_TOLERANCE_SECONDS
+
+
+class CandidateIndex:
+    """
+    Blocking index over a list of tracks, so a track is only compared with tracks that
+    could plausibly match it instead of all of them.
+
+    Candidates share a uri or a word of the name or artists. Words in more than
+    max_block_size tracks, like "the" or "feat", only make candidates of tracks
+    that also have a similar length, or share a second such word.
+
+    A track without a uri, name or artists can only match through its album and
+    length, so it is paired with every track of a similar length, and with the
+    other such tracks.
+
+    Candidates are a superset of the matches found by comparing all pairs, except
+    for pairs that
+    - only match through misspellings in every word, or
+    - only share common words, no more than one of them, and differ in length by
+      more than LENGTH_TOLERANCE_SECONDS or have no length.
+    """
+
+    # tracks sharing a word above which it needs a second key
+    max_block_size: int = 50
+
+    _tracks: List[Track]
+    _positions: Dict[int, int]  # id(track) -> position in _tracks
+    _blocks: DefaultDict[BlockKey, Set[int]]
+    # (word key, length bucket) -> positions, the second key of common words
+    _length_blocks: DefaultDict[Tuple[BlockKey, int], Set[int]]
+    _unblocked: Set[int]  # tracks without block keys
+
+    def __init__(self, tracks: List[Track] = []) -> None:
+        self._tracks = []
+        self._positions = {}
+        self._blocks = defaultdict(set)
+        self._length_blocks = defaultdict(set)
+        self._unblocked = set()
+        for track in tracks:
+            self.add(track)
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+    def add(self, track: Track) -> None:
+        """Adds a track after the indexed tracks."""
+        self._positions[id(track)] = len(self._tracks)
+        self._tracks.append(track)
+        self.update(track)
+
+    def update(self, track: Track) -> None:
+        """Reindexes a track after its uris, name, artists or length changed."""
+        position = self._positions[id(track)]
+        keys = block_keys(track)
+        if not keys:
+            self._unblocked.add(position)
+        bucket = length_bucket(track)
+        for key in keys:
+            self._blocks[key].add(position)
+            if bucket is not None and key[0] != "uri":
+                self._length_blocks[(key, bucket)].add(position)
+
+    def candidates(self, track: Track) -> List[Track]:
+        """Returns the indexed tracks that may match the track, in index order."""
+        keys = block_keys(track)
+        if not keys:
+            # nothing to block on, compare with everything of a similar length
+            return [
+                t
+                for i, t in enumerate(self._tracks)
+                if i in self._unblocked or similar_length(track, t)
+            ]
+
+        positions = {
+            i for i in self._unblocked if similar_length(track, self._tracks[i])
+        }
+        common: List[BlockKey] = []
+        for key in keys:
+            block = self._blocks.get(key)
+            if not block:
+                continue
+            if key[0] == "uri" or len(block) <= self.max_block_size:
+                positions |= block
+            else:
+                common.append(key)
+
+        bucket = length_bucket(track)
+        for i, key in enumerate(common):
+            if bucket is not None:
+                for neighbour in (bucket - 1, bucket, bucket + 1):
+                    positions |= self._length_blocks.get((key, neighbour), set())
+            for other in common[i + 1 :]:
+                positions |= self._blocks[key] & self._blocks[other]
+        return [self._tracks[i] for i in sorted(positions)]
@@ -4,7 +4,9 @@ import string
 
 from unitunes.index import Index
 from unitunes.playlist import Playlist
+from unitunes.query_stats import QueryStats
 from unitunes.services.services import ServiceConfig
+from unitunes.sync_ledger import SyncLedger
 
 
 def format_filename(s):
@@ -25,6 +27,8 @@ class FileManager:
     playlist_folder: Path
     cache_path: Path
     service_configs_path: Path
+    sync_ledger_path: Path
+    query_stats_path: Path
 
     def __init__(self, dir: Path) -> None:
         self.dir = dir
@@ -32,6 +36,8 @@ class FileManager:
         self.playlist_folder = dir / "playlists"
         self.cache_path = dir / "cache"
         self.service_configs_path = dir / "service_configs"
+        self.sync_ledger_path = dir / "sync_ledger.json"
+        self.query_stats_path = dir / "query_stats.json"
 
     def get_playlist_path(self, playlist_id: str) -> Path:
         return self.playlist_folder / f"{format_filename(playlist_id)}.json"
@@ -45,6 +51,24 @@ class FileManager:
             raise FileNotFoundError(f"index file not found: {self.index_path}")
         return Index.parse_file(self.index_path)
 
+    def save_sync_ledger(self, ledger: SyncLedger) -> None:
+        with open(self.sync_ledger_path, "w") as f:
+            f.write(ledger.json(indent=4))
+
+    def load_sync_ledger(self) -> SyncLedger:
+        if not self.sync_ledger_path.exists():
+            return SyncLedger()
+        return SyncLedger.parse_file(self.sync_ledger_path)
+
+    def save_query_stats(self, stats: QueryStats) -> None:
+        with open(self.query_stats_path, "w") as f:
+            f.write(stats.json(indent=4))
+
+    def load_query_stats(self) -> QueryStats:
+        if not self.query_stats_path.exists():
+            return QueryStats()
+        return QueryStats.parse_file(self.query_stats_path)
+
     def save_playlist(self, playlist: Playlist, playlist_id: str) -> None:
         self.playlist_folder.mkdir(exist_ok=True)
         with open(self.get_playlist_path(playlist_id), "w") as f:
@@ -2,7 +2,7 @@ from enum import Enum
 from queue import Queue
 from threading import Thread
 import traceback
-from typing import Callable
+from typing import Callable, Optional
 from unitunes import PlaylistManager
 
 GuiCallback = Callable[[], None]
@@ -20,30 +20,34 @@ class JobType(Enum):
     PULL = 0
     PUSH = 1
     SEARCH = 2
+    SEARCH_ALL = 3
 
 
 class Job:
     type: JobType
     description: str
-    playlist_id: str  # playlist the job operates on
+    playlist_id: Optional[str]  # playlist the job operates on, None for all
     size: int = 0
     progress: int = 0
     gui_callback: GuiCallback
     status: JobStatus = JobStatus.PENDING
     pm: PlaylistManager
+    incremental: bool = False  # pull only remote playlists that changed
 
     def __init__(
         self,
         type: JobType,
-        playlist_id: str,
+        playlist_id: Optional[str],
         gui_callback: GuiCallback,
         pm: PlaylistManager,
+        incremental: bool = False,
     ):
         self.playlist_id = playlist_id
         self.gui_callback = gui_callback
         self.pm = pm
         self.type = type
-        name = self.pm.playlists[playlist_id].name
+        self.incremental = incremental
+        name = self.pm.playlists[playlist_id].name if playlist_id else ""
 
         if type == JobType.PULL:
             self.description = f"Pull {name}"
@@ -51,6 +55,8 @@ class Job:
             self.description = f"Push {name}"
         elif type == JobType.SEARCH:
             self.description = f"Search {name}"
+        elif type == JobType.SEARCH_ALL:
+            self.description = "Search all playlists"
 
     def execute(self):
         def progress_callback(progress: int, size: int):
@@ -66,6 +72,7 @@ class Job:
             self.pm.pull_playlist(
                 self.playlist_id,
                 progress_callback=progress_callback,
+                incremental=self.incremental,
             )
         elif self.type == JobType.PUSH:
             self.pm.push_playlist(
@@ -77,6 +84,8 @@ class Job:
                 self.playlist_id,
                 progress_callback=progress_callback,
             )
+        elif self.type == JobType.SEARCH_ALL:
+            self.pm.search_all(progress_callback=progress_callback)
 
         self.status = JobStatus.SUCCESS
         self.gui_callback()
@@ -111,9 +120,15 @@ class Engine:
                 print(f"Job {job_id} failed: {e}")
                 traceback.print_exc()
                 job.status = JobStatus.FAILED
+            finally:
+                self._pm.flush_caches()
 
             assert job.status != JobStatus.RUNNING
             print(f"Finished job {job_id}: {job.description}")
+            for name, stats in self._pm.cache_stats().items():
+                print(f"{name} cache: {stats}")
+            for name, report in self._pm.request_reports().items():
+                print(f"{name} requests:\n{report}")
 
             job.gui_callback()
 
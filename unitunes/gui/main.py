@@ -1,5 +1,6 @@
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
 import webbrowser
 import dearpygui.dearpygui as dpg
 from appdirs import user_data_dir
@@ -164,7 +165,15 @@ class GUI:
             dpg.set_value(f"job_progress_{job_id}", 0)
             dpg.set_value(f"job_progress_text_{job_id}", "")
 
-        self.touch_playlist(job.playlist_id)
+        if job.playlist_id is not None:
+            playlist_ids = [job.playlist_id]
+        elif job.status in (JobStatus.SUCCESS, JobStatus.FAILED):
+            # saving every playlist on each progress update would be too slow
+            playlist_ids = list(self.pm.playlists)
+        else:
+            playlist_ids = []
+        for playlist_id in playlist_ids:
+            self.touch_playlist(playlist_id)
 
         # update job count in tab label
         active_jobs = [
@@ -174,15 +183,17 @@ class GUI:
         ]
         dpg.set_item_label("jobs_tab", f"Jobs ({len(active_jobs)})")
 
-        self.sync_playlist_row(job.playlist_id)
+        for playlist_id in playlist_ids:
+            self.sync_playlist_row(playlist_id)
 
-    def add_job(self, job_type: JobType, playlist_id: str):
+    def add_job(self, job_type: JobType, playlist_id: Optional[str], incremental=False):
         job_id = self.engine.push_job(
             Job(
                 job_type,
                 playlist_id,
                 lambda: self.sync_job_row(job_id),
                 self.pm,
+                incremental=incremental,
             )
         )
         self.add_job_row_placeholder(job_id)
@@ -256,8 +267,9 @@ class GUI:
             with dpg.group(horizontal=True):
 
                 def pull_all_callback():
+                    # skip remote playlists that haven't changed since the last sync
                     for playlist in self.pm.playlists:
-                        self.add_job(JobType.PULL, playlist)
+                        self.add_job(JobType.PULL, playlist, incremental=True)
 
                 dpg.add_button(
                     label="Pull All",
@@ -266,8 +278,8 @@ class GUI:
                 )
 
                 def search_all_callback():
-                    for playlist in self.pm.playlists:
-                        self.add_job(JobType.SEARCH, playlist)
+                    # one job, so songs in several playlists are searched once
+                    self.add_job(JobType.SEARCH_ALL, None)
 
                 dpg.add_button(
                     label="Search All",
@@ -406,7 +418,7 @@ class GUI:
         def delete_uri_callback(sender, app_data, user_data):
             (service_name, uri) = user_data
             print(f"Deleted {service_name} {uri}")
-            self.pm.playlists[playlist_id].remove_uri(service_name, uri)
+            self.pm.remove_uri_from_playlist(playlist_id, service_name, uri)
             self.touch_playlist(playlist_id)
             self.edit_playlist_row(playlist_id)
 
@@ -437,9 +449,15 @@ class GUI:
             service_name = dpg.get_value("service_combo")
             url = dpg.get_value("playlist_url_input")
             if service_name and url:
-                self.pm.playlists[playlist_id].add_uri(
-                    service_name, playlistURI_from_url(url)
-                )
+                uri = playlistURI_from_url(url)
+                others = self.pm.playlists_with_uri(uri) - {playlist_id}
+                if others:
+                    print(f"{url} is also tracked by {', '.join(sorted(others))}")
+                try:
+                    self.pm.add_uri_to_playlist(playlist_id, service_name, uri)
+                except ValueError as e:
+                    print(e)
+                    return
                 self.touch_playlist(playlist_id)
                 self.edit_playlist_row(playlist_id)
 
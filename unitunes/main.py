@@ -1,9 +1,11 @@
-from typing import Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Hashable, List, Optional, Set, Tuple
 from pathlib import Path
+from unitunes.candidate_index import CandidateIndex
 from unitunes.file_manager import FileManager
 from unitunes.index import Index
 from unitunes.matcher import DefaultMatcherStrategy, MatcherStrategy
-from unitunes.playlist import Playlist
+from unitunes.playlist import Playlist, PlaylistDetails
 from unitunes.pull_playlist import (
     add_changed_uris,
     get_invalid_uris,
@@ -12,17 +14,22 @@ from unitunes.pull_playlist import (
     remove_tracks,
     remove_uris,
     tracks_to_add,
-    tracks_to_remove,
 )
+from unitunes.push_plan import plan_push
+from unitunes.query_stats import QueryStats
+from unitunes.remote_snapshots import RemoteSnapshots
 from unitunes.searcher import DefaultSearcherStrategy, SearcherStrategy
 from unitunes.services.beatsaber import (
     BeatsaberConfig,
     BeatsaberService,
 )
-from unitunes.services.musicbrainz import MusicBrainz
+from unitunes.services.cache import CacheStats
+from unitunes.services.musicbrainz import MusicBrainz, MusicBrainzConfig
 from unitunes.services.services import (
     PlaylistPullable,
+    PlaylistVersioned,
     Pushable,
+    Replaceable,
     Searchable,
     StreamingService,
     TrackPullable,
@@ -34,9 +41,11 @@ from unitunes.services.spotify import (
     SpotifyService,
 )
 from unitunes.services.ytm import YTM, YtmConfig
+from unitunes.sync_ledger import SyncLedger
 from unitunes.track import Track
 from unitunes.types import ServiceType
 from unitunes.uri import PlaylistURIs, TrackURI, TrackURIs
+from unitunes.uri_index import UriIndex
 
 
 def service_factory(
@@ -55,7 +64,10 @@ def service_factory(
         config = YtmConfig.parse_file(config_path)
         return YTM(name, config, cache_path)
     elif service_type == ServiceType.MB:
-        return MusicBrainz(cache_path)
+        # needs no account, so the config file is optional
+        if config_path is None:
+            return MusicBrainz(cache_path)
+        return MusicBrainz(cache_path, MusicBrainzConfig.parse_file(config_path))
     elif service_type == ServiceType.BEATSABER:
         assert config_path is not None
         config = BeatsaberConfig.parse_file(config_path)
@@ -69,18 +81,32 @@ class PlaylistManager:
     file_manager: FileManager
     playlists: Dict[str, Playlist]
     services: Dict[str, StreamingService]
+    sync_ledger: SyncLedger
+    uri_index: UriIndex
+    query_stats: QueryStats
+    # remote tracks seen by pulls, so pushes in the same session don't pull again
+    remote_snapshots: RemoteSnapshots
+
+    # remote playlists fetched concurrently while pulling
+    max_pull_workers: int = 8
+    # seconds a pull's snapshot of an unversioned remote playlist is reused by pushes
+    snapshot_max_age: float = 3600
 
     def __init__(self, index: Index, file_manager: FileManager) -> None:
         self.index = index
         self.file_manager = file_manager
         self.playlists = {}
         self.services = {}
+        self.sync_ledger = self.file_manager.load_sync_ledger()
+        self.query_stats = self.file_manager.load_query_stats()
+        self.remote_snapshots = RemoteSnapshots(self.snapshot_max_age)
 
         self.load_services()
 
         # create playlist objects
         for name in self.index.playlists:
             self.playlists[name] = self.file_manager.load_playlist(name)
+        self.uri_index = UriIndex(self.playlists)
 
     def load_services(self) -> None:
         self.services[ServiceType.MB.value] = service_factory(
@@ -113,8 +139,10 @@ class PlaylistManager:
         self.index.remove_service(name)
         self.file_manager.delete_service_config(name)
 
-        for playlist in self.playlists.values():
+        for playlist_id, playlist in self.playlists.items():
             playlist.remove_service(name)
+            self.uri_index.update_playlist(playlist_id, playlist)
+        self.sync_ledger.remove_service(name)
 
         self.save_index()
 
@@ -122,6 +150,7 @@ class PlaylistManager:
         """Initialize a UP. Raise ValueError if the playlist already exists."""
         self.index.add_playlist(playlist_id)
         self.playlists[playlist_id] = Playlist(name=playlist_id)
+        self.uri_index.add_playlist(playlist_id, self.playlists[playlist_id])
         self.save_index()
         self.save_playlist(playlist_id)
 
@@ -131,19 +160,36 @@ class PlaylistManager:
             raise ValueError(f"Playlist {name} not found")
         self.file_manager.delete_playlist(name)
         del self.playlists[name]
+        self.uri_index.remove_playlist(name)
         self.index.remove_playlist(name)
+        self.sync_ledger.remove_playlist(name)
         self.save_index()
 
     def add_uri_to_playlist(
         self, playlist_id: str, service_name: str, uri: PlaylistURIs
     ) -> None:
-        """Link a playlist URI to a UP. UP must exist."""
+        """Link a playlist URI to a UP. UP must exist. Raise ValueError if the UP
+        already links the URI."""
+        if playlist_id in self.uri_index.playlists_with_uri(uri):
+            raise ValueError(f"{uri.url} is already linked to {playlist_id}")
         pl = self.playlists[playlist_id]
         pl.add_uri(service_name, uri)
+        self.uri_index.update_playlist(playlist_id, pl)
+        self.save_playlist(playlist_id)
+
+    def remove_uri_from_playlist(
+        self, playlist_id: str, service_name: str, uri: PlaylistURIs
+    ) -> None:
+        """Unlink a playlist URI from a UP."""
+        pl = self.playlists[playlist_id]
+        pl.remove_uri(service_name, uri)
+        self.uri_index.update_playlist(playlist_id, pl)
+        self.sync_ledger.remove_uri(playlist_id, service_name, uri)
         self.save_playlist(playlist_id)
 
     def save_playlist(self, playlist_id: str) -> None:
         self.file_manager.save_playlist(self.playlists[playlist_id], playlist_id)
+        self.file_manager.save_sync_ledger(self.sync_ledger)
 
     def save_index(self) -> None:
         self.file_manager.save_index(self.index)
@@ -156,20 +202,44 @@ class PlaylistManager:
         while new_id in self.index.playlists:
             new_id += "_"
 
+        self.sync_ledger.rename_playlist(old_id, new_id)
         self.remove_playlist(old_id)
         self.index.add_playlist(new_id)
         self.playlists[new_id] = pl
+        self.uri_index.add_playlist(new_id, pl)
 
         self.save_playlist(new_id)
         self.save_index()
         return new_id
 
+    def flush_caches(self) -> None:
+        """Writes pending service cache entries to disk. Call at the end of a job."""
+        for service in self.services.values():
+            service.wrapper.flush_cache()
+
+    def cache_stats(self) -> Dict[str, CacheStats]:
+        return {
+            name: service.wrapper.cache_stats()
+            for name, service in self.services.items()
+        }
+
+    def request_reports(self) -> Dict[str, str]:
+        return {
+            name: report
+            for name, service in self.services.items()
+            if (report := service.wrapper.request_report())
+        }
+
     def is_tracking_playlist(self, uri: PlaylistURIs) -> bool:
-        for playlist in self.playlists.values():
-            for uris in playlist.uris.values():
-                if uri in uris:
-                    return True
-        return False
+        return self.uri_index.is_tracking(uri)
+
+    def playlists_with_uri(self, uri: PlaylistURIs) -> Set[str]:
+        """Ids of the playlists linking the uri."""
+        return self.uri_index.playlists_with_uri(uri)
+
+    def tracks_with_uri(self, uri: TrackURIs) -> List[Tuple[str, Track]]:
+        """Returns (playlist id, track) for each track in the library with the uri."""
+        return self.uri_index.tracks_with_uri(uri)
 
     ###########################################################################
     # Pulling and pushing
@@ -179,8 +249,11 @@ class PlaylistManager:
         self,
         playlist_id: str,
         progress_callback: Callable[[int, int], None] = lambda x, y: None,
+        incremental: bool = False,
     ) -> None:
-        """Pull all tracks from a playlist from its services."""
+        """Pull all tracks from a playlist from its services.
+        If incremental, remote playlists whose version hasn't changed since the last
+        sync are skipped."""
         playlist = self.playlists[playlist_id]
 
         new_tracks: List[Track] = []
@@ -193,60 +266,115 @@ class PlaylistManager:
             if isinstance(self.services[service_name], PlaylistPullable)
         ]
 
+        remotes = [
+            (service_name, uri)
+            for service_name in pullable_services
+            for uri in playlist.uris[service_name]
+        ]
+
         progress = 0
-        progress_callback(progress, len(pullable_services))
+        progress_callback(progress, len(remotes))
 
-        for service_name in pullable_services:
+        def fetch(
+            service_name: str, uri: PlaylistURIs
+        ) -> Tuple[Optional[str], Optional[Tuple[PlaylistDetails, List[Track]]]]:
             service = self.services[service_name]
             assert isinstance(service, PlaylistPullable)
+            # Check the version first, so changes made during the pull are not missed
+            version = (
+                service.playlist_version(uri)
+                if isinstance(service, PlaylistVersioned)
+                else None
+            )
+            if (
+                incremental
+                and version is not None
+                and version
+                == self.sync_ledger.get_version(playlist_id, service_name, uri)
+            ):
+                return version, None
+            return version, (service.pull_metadata(uri), service.pull_tracks(uri))
+
+        # Fetch all remote playlists concurrently
+        with ThreadPoolExecutor(max_workers=self.max_pull_workers) as executor:
+            futures = [
+                executor.submit(fetch, service_name, uri)
+                for service_name, uri in remotes
+            ]
+            for _ in as_completed(futures):
+                progress += 1
+                progress_callback(progress, len(remotes))
+
+        versions: List[Tuple[str, PlaylistURIs, str]] = []
+
+        # Built once, so each remote track is only matched against similar tracks
+        index = CandidateIndex(playlist.tracks)
+        matcher = DefaultMatcherStrategy()
 
-            for uri in playlist.uris[service_name]:
-                # Pull metadata
-                remote_metadata = service.pull_metadata(uri)
-                playlist.merge_metadata(remote_metadata)
+        # Merge in playlist order, so the result does not depend on fetch timing
+        for (service_name, uri), future in zip(remotes, futures):
+            service = self.services[service_name]
+            version, remote = future.result()
+            if version is not None:
+                versions.append((service_name, uri, version))
+            if remote is None:
+                print(f"{uri.url} is unchanged, skipping")
+                continue
+            remote_metadata, remote_tracks = remote
+            self.remote_snapshots.put(
+                service_name,
+                uri,
+                remote_tracks,
+                remote_metadata,
+                version,
+                skipped_items(service, uri),
+            )
 
-                # Get remote tracks
-                remote_tracks = service.pull_tracks(uri)
+            playlist.merge_metadata(remote_metadata)
 
-                # Record new tracks not already in the playlist
-                new_tracks.extend(
-                    tracks_to_add(service.type, playlist.tracks, remote_tracks)
+            # Record new tracks not already in the playlist
+            new_tracks.extend(
+                tracks_to_add(
+                    service.type, playlist.tracks, remote_tracks, index, matcher
                 )
+            )
 
-                # Update URIs if they do not match the remote URIs (YTM URIs are not stable)
-                add_changed_uris(playlist.tracks, remote_tracks)
-
-                # Record URIs that are no longer in the remote
-                new_missing = get_missing_uris(
-                    service.type, playlist.tracks, remote_tracks
-                )
+            # Update URIs if they do not match the remote URIs (YTM URIs are not stable)
+            add_changed_uris(playlist.tracks, remote_tracks, matcher=matcher)
+            for track in playlist.tracks:
+                index.update(track)
 
-                # Record URIs that are invalid (e.g. not found on the service. Usually YTM)
-                invalid_uris.extend(get_invalid_uris(service, new_missing))
+            # Record URIs that are no longer in the remote
+            new_missing = get_missing_uris(service.type, playlist.tracks, remote_tracks)
 
-                # Remove invalid URIs from the missing list
-                new_missing = [uri for uri in new_missing if uri not in invalid_uris]
+            # Record URIs that are invalid (e.g. not found on the service. Usually YTM)
+            invalid_uris.extend(get_invalid_uris(service, new_missing))
 
-                missing_uris.extend(new_missing)
+            # Remove invalid URIs from the missing list
+            new_missing = [uri for uri in new_missing if uri not in invalid_uris]
 
-            # Update progress
-            progress += 1
-            progress_callback(progress, len(pullable_services))
+            missing_uris.extend(new_missing)
 
         remove_uris(playlist.tracks, invalid_uris)
 
         print(f"{len(new_tracks)} new tracks")
         print(f"{len(missing_uris)} missing tracks")
 
-        merge_new_tracks(playlist.tracks, new_tracks, DefaultMatcherStrategy())
+        merge_new_tracks(playlist.tracks, new_tracks, matcher, index)
         remove_tracks(playlist.tracks, missing_uris)
+        self.uri_index.update_playlist(playlist_id, playlist)
+
+        for service_name, uri, version in versions:
+            self.sync_ledger.set_version(playlist_id, service_name, uri, version)
 
     def push_playlist(
         self,
         playlist_id: str,
         progress_callback: Callable[[int, int], None] = lambda x, y: None,
+        dry_run: bool = False,
     ) -> None:
-        """Push all tracks from a playlist to its services."""
+        """Push all tracks from a playlist to its services.
+        If dry_run, only prints what would be pushed."""
         playlist = self.playlists[playlist_id]
 
         pushable_services = [
@@ -255,47 +383,78 @@ class PlaylistManager:
             if isinstance(self.services[service_name], Pushable)
         ]
 
+        # Built once, so each remote track is only matched against similar tracks
+        index = CandidateIndex(playlist.tracks)
+        matcher = DefaultMatcherStrategy()
+
         progress = 0
         progress_callback(progress, len(pushable_services))
 
+        total_calls = 0
         for service_name in pushable_services:
             service = self.services[service_name]
             assert isinstance(service, Pushable)
 
             for uri in playlist.uris[service_name]:
-                # Update remote metadata
-                service.update_metadata(uri, playlist.metadata())
-
-                # Update remote tracks
-                current_tracks = service.pull_tracks(uri)
-                new_tracks = tracks_to_add(
-                    service.type, current_tracks, playlist.tracks
+                current_tracks, current_metadata, complete = self.remote_state(
+                    service_name, uri
                 )
-                removed_tracks = tracks_to_remove(
-                    service.type, current_tracks, playlist.tracks
+                plan = plan_push(
+                    service,
+                    uri,
+                    playlist,
+                    current_tracks,
+                    current_metadata,
+                    matcher,
+                    index,
+                    complete,
                 )
-
-                if new_tracks:
-                    service.add_tracks(uri, new_tracks)
-                if removed_tracks:
-                    service.remove_tracks(uri, removed_tracks)
+                print(f"{service_name} {plan.describe()}")
+                total_calls += plan.calls
+                if dry_run or plan.calls == 0:
+                    continue
+
+                plan.execute(service)
+                self.remote_snapshots.invalidate(service_name, uri)
+
+                # The remote now matches the playlist, so the next pull can skip it
+                if isinstance(service, PlaylistVersioned):
+                    version = service.playlist_version(uri)
+                    if version is not None:
+                        self.sync_ledger.set_version(
+                            playlist_id, service_name, uri, version
+                        )
 
             # Update progress
             progress += 1
             progress_callback(progress, len(pushable_services))
 
-    def search_playlist(
-        self,
-        playlist_name: str,
-        progress_callback: Callable[[int, int], None] = lambda x, y: None,
-    ) -> None:
-
-        """
-        Search for tracks on a service. Adds found URI's to tracks.
-        """
-
-        playlist = self.playlists[playlist_name]
-
+        print(f"Push plan: {total_calls} calls" + (" (dry run)" if dry_run else ""))
+
+    def remote_state(
+        self, service_name: str, uri: PlaylistURIs
+    ) -> Tuple[List[Track], Optional[PlaylistDetails], bool]:
+        """Tracks and, if known, metadata of a remote playlist, from the last pull's
+        snapshot if it is still current. Also whether the tracks are all of the
+        remote's items."""
+        service = self.services[service_name]
+        assert isinstance(service, PlaylistPullable)
+        snapshot = self.remote_snapshots.get(
+            service_name,
+            uri,
+            lambda: service.playlist_version(uri)
+            if isinstance(service, PlaylistVersioned)
+            else None,
+        )
+        if snapshot is None:
+            # Fetching the metadata would cost as much as updating it
+            tracks = service.pull_tracks(uri)
+            return tracks, None, skipped_items(service, uri) == 0
+        return snapshot.tracks, snapshot.metadata, snapshot.skipped == 0
+
+    def tracks_to_search(self, playlist: Playlist) -> List[Tuple[str, Track]]:
+        """(service name, track) for each track missing from a searchable service
+        linked to the playlist."""
         searchable_services = [
             service_name
             for service_name in playlist.uris
@@ -315,25 +474,202 @@ class PlaylistManager:
                     if not track.find_uri(service.type)
                 ]
             )
-        print(f"{len(tracks_to_search)} tracks to search")
+        return tracks_to_search
 
+    def use_known_uris(
+        self, tracks_to_search: List[Tuple[str, Track]]
+    ) -> List[Tuple[str, Track]]:
+        """
+        Adds the uri a track needs from a copy of it elsewhere in the library, i.e. a
+        track sharing one of its uris. Returns the pairs still to search.
+        """
+        remaining = []
+        for service_name, track in tracks_to_search:
+            known = self.known_uri(self.services[service_name].type, track)
+            if known is None:
+                remaining.append((service_name, track))
+            else:
+                track.uris.append(known)
+        if len(remaining) < len(tracks_to_search):
+            print(f"{len(tracks_to_search) - len(remaining)} tracks found in library")
+        return remaining
+
+    def known_uri(self, service: ServiceType, track: Track) -> Optional[TrackURIs]:
+        for uri in track.uris:
+            for _, other in self.uri_index.tracks_with_uri(uri):
+                found = other.find_uri(service)
+                if found is not None and found not in track.bad_uris:
+                    return found
+        return None
+
+    def search_tracks(
+        self,
+        tracks_to_search: List[Tuple[str, Track]],
+        progress_callback: Callable[[int, int], None] = lambda x, y: None,
+    ) -> List[Optional[Track]]:
+        """Searches each (service name, track) pair. Returns the predicted tracks."""
         matcher = DefaultMatcherStrategy()
-        searcher = DefaultSearcherStrategy(matcher)
+        # each service runs as many queries of a search at once as it allows
+        searchers = {
+            service_name: DefaultSearcherStrategy(
+                matcher, self.services[service_name].parallel_queries, self.query_stats
+            )
+            for service_name in {service_name for service_name, _ in tracks_to_search}
+        }
 
         progress = 0
         progress_callback(progress, len(tracks_to_search))
 
-        for service_name, track in tracks_to_search:
-            service = self.services[service_name]
-            predicted = get_prediction_track(
-                service, track, matcher, searcher, threshold=0.7
+        def predict(service_name: str, track: Track) -> Optional[Track]:
+            return get_prediction_track(
+                self.services[service_name],
+                track,
+                matcher,
+                searchers[service_name],
+                threshold=0.7,
             )
+
+        # Search each service with its own pool, sized by its search_concurrency
+        executors = {
+            service_name: ThreadPoolExecutor(
+                max_workers=self.services[service_name].search_concurrency
+            )
+            for service_name in {service_name for service_name, _ in tracks_to_search}
+        }
+        try:
+            futures = [
+                executors[service_name].submit(predict, service_name, track)
+                for service_name, track in tracks_to_search
+            ]
+            for _ in as_completed(futures):
+                progress += 1
+                progress_callback(progress, len(tracks_to_search))
+        finally:
+            for executor in executors.values():
+                executor.shutdown(cancel_futures=True)
+
+        print(f"Query stats:\n{self.query_stats.report()}")
+        self.file_manager.save_query_stats(self.query_stats)
+
+        # a failed search leaves its track unmatched instead of losing the others
+        predictions: List[Optional[Track]] = []
+        for (service_name, track), future in zip(tracks_to_search, futures):
+            try:
+                predictions.append(future.result())
+            except Exception as e:
+                print(f"Failed to search {service_name} for {track.name.value}: {e}")
+                predictions.append(None)
+        return predictions
+
+    def search_playlist(
+        self,
+        playlist_name: str,
+        progress_callback: Callable[[int, int], None] = lambda x, y: None,
+    ) -> None:
+
+        """
+        Search for tracks on a service. Adds found URI's to tracks.
+        """
+
+        playlist = self.playlists[playlist_name]
+        tracks_to_search = self.use_known_uris(self.tracks_to_search(playlist))
+        print(f"{len(tracks_to_search)} tracks to search")
+
+        predictions = self.search_tracks(tracks_to_search, progress_callback)
+
+        # Merge on this thread in playlist order, so the result does not depend on
+        # search timing
+        for (service_name, track), predicted in zip(tracks_to_search, predictions):
             if predicted:
                 track.merge(predicted)
 
-            # Update progress
-            progress += 1
-            progress_callback(progress, len(tracks_to_search))
+        self.uri_index.update_playlist(playlist_name, playlist)
+
+    def search_all(
+        self,
+        progress_callback: Callable[[int, int], None] = lambda x, y: None,
+    ) -> None:
+        """
+        Search for the tracks of all playlists. A song in several playlists is
+        searched once per service, and the result is added to each copy.
+        """
+        pending: Dict[str, List[Track]] = {}
+        for playlist in self.playlists.values():
+            for service_name, track in self.use_known_uris(
+                self.tracks_to_search(playlist)
+            ):
+                pending.setdefault(service_name, []).append(track)
+
+        searches = [
+            (service_name, group)
+            for service_name, tracks in pending.items()
+            for group in group_same_tracks(tracks)
+        ]
+        print(
+            f"{sum(len(tracks) for tracks in pending.values())} tracks to search, "
+            f"{len(searches)} unique"
+        )
+
+        predictions = self.search_tracks(
+            [(service_name, representative(group)) for service_name, group in searches],
+            progress_callback,
+        )
+        for (service_name, group), predicted in zip(searches, predictions):
+            if predicted:
+                for track in group:
+                    track.merge(predicted.copy(deep=True))
+
+        for playlist_id, playlist in self.playlists.items():
+            self.uri_index.update_playlist(playlist_id, playlist)
+
+
+def skipped_items(service: StreamingService, uri: PlaylistURIs) -> Optional[int]:
+    """Remote items the last pull of a playlist left out, None if unknown."""
+    return service.skipped_items(uri) if isinstance(service, Replaceable) else None
+
+
+def track_identity(track: Track) -> Hashable:
+    """Tracks with the same name, artists and length are the same song."""
+    return (
+        track.name.value.lower(),
+        tuple(sorted(artist.value.lower() for artist in track.artists)),
+        track.length,
+    )
+
+
+def group_same_tracks(tracks: List[Track]) -> List[List[Track]]:
+    """
+    Groups copies of the same song, in order of first appearance. Tracks are the same
+    if they share a uri or have the same track_identity, directly or through other
+    tracks.
+    """
+    parents = list(range(len(tracks)))
+
+    def find(i: int) -> int:
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    first_with_key: Dict[Hashable, int] = {}
+    for i, track in enumerate(tracks):
+        for key in [track_identity(track), *track.uris]:
+            if key in first_with_key:
+                parents[find(i)] = find(first_with_key[key])
+            else:
+                first_with_key[key] = i
+
+    groups: Dict[int, List[Track]] = {}
+    for i, track in enumerate(tracks):
+        groups.setdefault(find(i), []).append(track)
+    return list(groups.values())
+
+
+def representative(group: List[Track]) -> Track:
+    """The first track of a group, avoiding the bad uris of all tracks."""
+    track = group[0].copy()
+    track.bad_uris = [uri for t in group for uri in t.bad_uris]
+    return track
 
 
 def get_predicted_tracks(
@@ -360,7 +696,7 @@ def get_prediction_track(
         return None
     best_match = matches[0]
 
-    if matcher.similarity(track, best_match) >= threshold:
+    if matcher.similarity_at_least(track, best_match, threshold):
         return best_match
     return None
 
@@ -1,9 +1,20 @@
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Callable
+from functools import lru_cache
+from typing import Any, Dict, Hashable, List, Callable, Sequence, Tuple
+import numpy as np
 from strsimpy.jaro_winkler import JaroWinkler
 
+from unitunes.normalize import NormalizedValue, normalize
 from unitunes.track import AliasedString, Track
 
+JARO_WINKLER = JaroWinkler()
+
+# seconds apart at which lengths stop scoring
+MAX_LENGTH_DISTANCE = 5
+
+# margin for float rounding when a partial score decides a threshold check
+BOUND_EPSILON = 1e-9
+
 
 def pairwise_max(a: List[Any], b: List[Any], f: Callable[[Any, Any], float]) -> float:
     mx = 0
@@ -13,26 +24,198 @@ def pairwise_max(a: List[Any], b: List[Any], f: Callable[[Any, Any], float]) ->
     return mx
 
 
+def normalized_value_similarity(v1: NormalizedValue, v2: NormalizedValue) -> float:
+    """normalized_string_similarity of normalized values."""
+    if v1[1] != v2[1]:  # special terms differ
+        return 0
+    return JARO_WINKLER.similarity(v1[0], v2[0])
+
+
+def special_terms_overlap(
+    values1: List[NormalizedValue], values2: List[NormalizedValue]
+) -> bool:
+    """Whether any pair of values has the same special terms, so may score above 0."""
+    return not {mask for _, mask in values1}.isdisjoint(mask for _, mask in values2)
+
+
+def length_similarity(length_sec_1: int, length_sec_2: int) -> float:
+    d = abs(length_sec_1 - length_sec_2)
+    if d > MAX_LENGTH_DISTANCE:
+        return 0
+    return 1 - d / MAX_LENGTH_DISTANCE
+
+
 def normalized_string_similarity(s1: str, s2: str) -> float:
     """Returns a similarity score between 0 and 1. Penalizes differences in keywords like 'instrumental'"""
-    special_terms = [
-        "instrumental",
-        "remix",
-        "cover",
-        "live",
-        "version",
-        "edit",
-        "nightcore",
-    ]
-
-    for term in special_terms:
-        in_s1 = term in s1.lower()
-        in_s2 = term in s2.lower()
-
-        if in_s1 ^ in_s2:
-            return 0
+    return normalized_value_similarity(normalize(s1), normalize(s2))
+
+
+class StringTable:
+    """Unique normalized values, with the values of each track as groups of indices."""
+
+    values: List[NormalizedValue]
+    groups: List[List[int]]
+    _indices: Dict[NormalizedValue, int]
+
+    def __init__(self) -> None:
+        self.values = []
+        self.groups = []
+        self._indices = {}
+
+    def add_group(self, values: List[NormalizedValue]) -> None:
+        group = []
+        for value in values:
+            if value not in self._indices:
+                self._indices[value] = len(self.values)
+                self.values.append(value)
+            group.append(self._indices[value])
+        self.groups.append(group)
+
+
+def code_points(strings: List[str], pad: int) -> Tuple[np.ndarray, np.ndarray]:
+    """The code points of each string in a row, padded with pad, and the lengths."""
+    lengths = np.array([len(s) for s in strings], dtype=np.int64)
+    chars = np.full((len(strings), max(lengths.max(initial=0), 1)), pad, np.int64)
+    for i, s in enumerate(strings):
+        chars[i, : len(s)] = np.frombuffer(
+            s.encode("utf-32-le", "surrogatepass"), dtype=np.uint32
+        )
+    return chars, lengths
+
+
+def jaro_winkler_pairs(
+    chars1: np.ndarray, lengths1: np.ndarray, chars2: np.ndarray, lengths2: np.ndarray
+) -> np.ndarray:
+    """
+    JARO_WINKLER.similarity of the strings in each pair of rows, from code_points
+    padded differently. Follows strsimpy step by step over all pairs at once, so
+    the scores are equal.
+    """
+    n = len(lengths1)
+    width = max(chars1.shape[1], chars2.shape[1])
+    chars1 = np.pad(chars1, ((0, 0), (0, width - chars1.shape[1])), constant_values=-1)
+    chars2 = np.pad(chars2, ((0, 0), (0, width - chars2.shape[1])), constant_values=-2)
+
+    # the characters of the shorter string, or of the first on ties, are matched
+    # in the longer one
+    swap = lengths1 > lengths2
+    min_len = np.where(swap, lengths2, lengths1)
+    max_len = np.where(swap, lengths1, lengths2)
+    min_chars = np.where(swap[:, None], chars2, chars1)
+    max_chars = np.where(swap[:, None], chars1, chars2)
+
+    window = np.maximum(max_len / 2 - 1, 0).astype(np.int64)
+    positions = np.arange(width)
+    rows = np.arange(n)
+    matched_min = np.zeros((n, width), dtype=bool)
+    matched_max = np.zeros((n, width), dtype=bool)
+    for mi in range(int(min_len.max(initial=0))):
+        # the first unmatched equal character in the window
+        candidates = (
+            (max_chars == min_chars[:, mi : mi + 1])
+            & ~matched_max
+            & (positions >= (mi - window)[:, None])
+            & (positions < np.minimum(mi + window + 1, max_len)[:, None])
+            & (mi < min_len)[:, None]
+        )
+        found = candidates.any(axis=1)
+        matched_max[rows[found], candidates.argmax(axis=1)[found]] = True
+        matched_min[found, mi] = True
+    matches = matched_min.sum(axis=1)
 
-    return JaroWinkler().similarity(s1.lower(), s2.lower())
+    # the matched characters of both strings in order, compared position by position
+    in_order_min = np.take_along_axis(
+        min_chars, np.argsort(~matched_min, axis=1, kind="stable"), axis=1
+    )
+    in_order_max = np.take_along_axis(
+        max_chars, np.argsort(~matched_max, axis=1, kind="stable"), axis=1
+    )
+    differ = (in_order_min != in_order_max) & (positions < matches[:, None])
+    transpositions = differ.sum(axis=1) // 2
+
+    # the padding differs, so the common prefix ends with the shorter string
+    prefix = np.cumprod(chars1 == chars2, axis=1).sum(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        jaro = (
+            matches / lengths1
+            + matches / lengths2
+            + (matches - transpositions) / matches
+        ) / 3
+        winkler = jaro + np.minimum(0.1, 1.0 / max_len) * prefix * (1 - jaro)
+    similarity = np.where(jaro > JARO_WINKLER.get_threshold(), winkler, jaro)
+    similarity = np.where(matches == 0, 0.0, similarity)
+    equal = (lengths1 == lengths2) & (prefix == lengths1)
+    return np.where(equal, 1.0, similarity)
+
+
+def value_similarity_matrix(
+    values1: List[NormalizedValue],
+    values2: List[NormalizedValue],
+    chunk_size: int = 4096,
+) -> np.ndarray:
+    """normalized_value_similarity of all pairs of values."""
+    masks1 = np.array([mask for _, mask in values1], dtype=np.int64)
+    masks2 = np.array([mask for _, mask in values2], dtype=np.int64)
+    result = np.zeros((len(values1), len(values2)))
+    if not values1 or not values2:
+        return result
+
+    chars1, lengths1 = code_points([value for value, _ in values1], -1)
+    chars2, lengths2 = code_points([value for value, _ in values2], -2)
+    # pairs that differ in special terms score 0
+    rows, cols = np.nonzero(masks1[:, None] == masks2[None, :])
+    # pairs of similar lengths are scored together, so little padding is compared
+    order = np.argsort(np.maximum(lengths1[rows], lengths2[cols]), kind="stable")
+    for start in range(0, len(order), chunk_size):
+        i = rows[order[start : start + chunk_size]]
+        j = cols[order[start : start + chunk_size]]
+        width1, width2 = lengths1[i].max(initial=1), lengths2[j].max(initial=1)
+        result[i, j] = jaro_winkler_pairs(
+            chars1[i, : max(width1, 1)],
+            lengths1[i],
+            chars2[j, : max(width2, 1)],
+            lengths2[j],
+        )
+    return result
+
+
+def grouped_max(
+    values: np.ndarray, table1: StringTable, table2: StringTable
+) -> np.ndarray:
+    """result[i, j] is the max of values over the strings of group i and group j,
+    or 0 if either group is empty."""
+    # empty groups point at an appended row and column of zeros
+    values = np.pad(values, ((0, 1), (0, 1)))
+
+    def flatten(groups: List[List[int]], empty: int) -> Tuple[np.ndarray, np.ndarray]:
+        groups = [group or [empty] for group in groups]
+        offsets = np.cumsum([0] + [len(group) for group in groups[:-1]])
+        return np.array([i for group in groups for i in group]), offsets
+
+    rows, row_offsets = flatten(table1.groups, len(table1.values))
+    cols, col_offsets = flatten(table2.groups, len(table2.values))
+    by_row = np.maximum.reduceat(values[rows], row_offsets, axis=0)
+    return np.maximum.reduceat(by_row[:, cols], col_offsets, axis=1)
+
+
+def aliased_strings_similarity_matrix(
+    values1: List[List[NormalizedValue]],
+    values2: List[List[NormalizedValue]],
+) -> np.ndarray:
+    """Max normalized_value_similarity between the values of each pair of lists.
+    Each unique pair of values is compared once."""
+    table1, table2 = StringTable(), StringTable()
+    for values in values1:
+        table1.add_group(values)
+    for values in values2:
+        table2.add_group(values)
+    similarities = value_similarity_matrix(table1.values, table2.values)
+    return grouped_max(similarities, table1, table2)
+
+
+def uri_key(uri) -> Hashable:
+    return (uri.service, uri.type, uri.uri, uri.url)
 
 
 class MatcherStrategy(ABC):
@@ -42,77 +225,236 @@ class MatcherStrategy(ABC):
         Returns a similarity score between 0 and 1.
         """
 
+    def similarity_matrix(
+        self, tracks1: Sequence[Track], tracks2: Sequence[Track]
+    ) -> np.ndarray:
+        """
+        Returns the similarity of each pair of tracks, as a len(tracks1) x len(tracks2) array.
+        """
+        return np.array(
+            [[self.similarity(t1, t2) for t2 in tracks2] for t1 in tracks1],
+            dtype=float,
+        ).reshape(len(tracks1), len(tracks2))
+
+    def similarity_at_least(
+        self, track1: Track, track2: Track, threshold: float
+    ) -> bool:
+        return self.similarity(track1, track2) >= threshold
+
     def are_same(self, track1: Track, track2: Track, theshold=0.7) -> bool:
-        return self.similarity(track1, track2) >= theshold
+        return self.similarity_at_least(track1, track2, theshold)
 
 
 class DefaultMatcherStrategy(MatcherStrategy):
+    # Jaro-Winkler scores of recent string pairs. The same artist and album names are
+    # compared over and over, so use one matcher for a whole job.
+    _jaro_winkler: Callable[[str, str], float]
+
+    def __init__(self, memo_size: int = 100_000) -> None:
+        self._jaro_winkler = lru_cache(maxsize=memo_size)(JARO_WINKLER.similarity)
+
+    def similarity_cache_info(self):
+        """Hits, misses and size of the string pair memo."""
+        return self._jaro_winkler.cache_info()  # type: ignore
+
+    def value_similarity(self, v1: NormalizedValue, v2: NormalizedValue) -> float:
+        if v1[1] != v2[1]:  # special terms differ
+            return 0
+        return self._jaro_winkler(v1[0], v2[0])
+
     def aliased_string_similarity(self, s1: AliasedString, s2: AliasedString) -> float:
         return pairwise_max(
-            s1.all_values(), s2.all_values(), normalized_string_similarity
+            s1.normalized_values(), s2.normalized_values(), self.value_similarity
         )
 
-    def similarity(self, track1: Track, track2: Track) -> float:
-        # check if any uris match
-        if any(uri1 in track2.uris for uri1 in track1.uris):
-            return 1
-
-        def artists_similarity(
-            artists1: List[AliasedString], artists2: List[AliasedString]
-        ) -> float:
-            if len(artists1) == 0 or len(artists2) == 0:
-                return 0.5
-
-            sim = pairwise_max(artists1, artists2, self.aliased_string_similarity)
-            return sim
-
-        def album_similarity(
-            album1: List[AliasedString], album2: List[AliasedString]
-        ) -> float:
-            sim = pairwise_max(album1, album2, self.aliased_string_similarity)
-            return sim
-
-        def length_similarity(length_sec_1: int, length_sec_2: int) -> float:
-            d = abs(length_sec_1 - length_sec_2)
-            max_dist = 5
-            if d > max_dist:
-                return 0
-            return 1 - d / max_dist
-
-        weights = {
-            "name": 50,
-            "album": 20,
-            "artists": 30,
-            "length": 20,
-        }
+    weights = {
+        "name": 50,
+        "album": 20,
+        "artists": 30,
+        "length": 20,
+    }
 
-        feature_scores: Dict[str, float] = {}
+    def feature_scorers(
+        self, track1: Track, track2: Track
+    ) -> Dict[str, Tuple[Callable[[], float], bool]]:
+        """
+        The features both tracks have, in the order their scores are summed. Each maps
+        to a function computing its score, and whether any pair of values has the same
+        special terms. Features without such a pair score 0.
+        """
+        scorers: Dict[str, Tuple[Callable[[], float], bool]] = {}
 
         if track1.name and track2.name:
-            feature_scores["name"] = self.aliased_string_similarity(
-                track1.name, track2.name
+            scorers["name"] = (
+                lambda: self.aliased_string_similarity(track1.name, track2.name),
+                special_terms_overlap(
+                    track1.name.normalized_values(), track2.name.normalized_values()
+                ),
             )
 
+        # the max over all artists' values is the max over each pair of artists
         if track1.artists and track2.artists:
-            feature_scores["artists"] = artists_similarity(
-                track1.artists, track2.artists
+            scorers["artists"] = (
+                lambda: pairwise_max(
+                    track1.artist_values(),
+                    track2.artist_values(),
+                    self.value_similarity,
+                ),
+                special_terms_overlap(track1.artist_values(), track2.artist_values()),
             )
 
         if track1.albums and track2.albums:
-            feature_scores["album"] = album_similarity(track1.albums, track2.albums)
+            scorers["album"] = (
+                lambda: pairwise_max(
+                    track1.album_values(),
+                    track2.album_values(),
+                    self.value_similarity,
+                ),
+                special_terms_overlap(track1.album_values(), track2.album_values()),
+            )
 
         if track1.length and track2.length:
-            feature_scores["length"] = length_similarity(track1.length, track2.length)
+            scorers["length"] = (
+                lambda: length_similarity(track1.length, track2.length),
+                True,
+            )
+
+        return scorers
 
-        used_features = feature_scores.keys()
-        if not used_features:
+    def combine(self, feature_scores: Dict[str, float]) -> float:
+        if not feature_scores:
             return 0
 
         weighted_sum = sum(
-            feature_scores[feature] * weights[feature] for feature in used_features
+            score * self.weights[feature] for feature, score in feature_scores.items()
         )
-        total_weight = sum(weights[feature] for feature in used_features)
+        total_weight = sum(self.weights[feature] for feature in feature_scores)
 
         similarity = weighted_sum / total_weight
         assert 0 <= similarity <= 1
         return similarity
+
+    def similarity(self, track1: Track, track2: Track) -> float:
+        # check if any uris match
+        if track1.shares_uri(track2):
+            return 1
+
+        return self.combine(
+            {
+                feature: score()
+                for feature, (score, _) in self.feature_scorers(track1, track2).items()
+            }
+        )
+
+    def similarity_at_least(
+        self, track1: Track, track2: Track, threshold: float
+    ) -> bool:
+        """
+        Same as similarity(track1, track2) >= threshold. Scores the length and the
+        features ruled out by special terms first, then the rest by weight, and stops
+        once the remaining features can't change the outcome.
+        """
+        if track1.shares_uri(track2):
+            return 1 >= threshold
+
+        scorers = self.feature_scorers(track1, track2)
+        total_weight = sum(self.weights[feature] for feature in scorers)
+        if not total_weight:
+            return 0 >= threshold
+
+        feature_scores: Dict[str, float] = {}
+        if "length" in scorers:
+            feature_scores["length"] = scorers["length"][0]()
+        for feature, (_, overlap) in scorers.items():
+            if not overlap:
+                feature_scores[feature] = 0
+        remaining = sorted(
+            (feature for feature in scorers if feature not in feature_scores),
+            key=lambda feature: self.weights[feature],
+            reverse=True,
+        )
+
+        weighted_sum = sum(
+            score * self.weights[feature] for feature, score in feature_scores.items()
+        )
+        remaining_weight = sum(self.weights[feature] for feature in remaining)
+        for feature in remaining:
+            # bounds are rounded away from the threshold, so borderline pairs fall
+            # through to the exact computation
+            if weighted_sum / total_weight - BOUND_EPSILON >= threshold:
+                return True
+            if (
+                weighted_sum + remaining_weight
+            ) / total_weight + BOUND_EPSILON < threshold:
+                return False
+            feature_scores[feature] = scorers[feature][0]()
+            weighted_sum += feature_scores[feature] * self.weights[feature]
+            remaining_weight -= self.weights[feature]
+
+        return self.combine({f: feature_scores[f] for f in scorers}) >= threshold
+
+    def similarity_matrix(
+        self, tracks1: Sequence[Track], tracks2: Sequence[Track]
+    ) -> np.ndarray:
+        """Batched similarity. Gives the same scores as similarity, but scores each
+        unique pair of strings once, all pairs at once, and combines the features as
+        arrays."""
+        shape = (len(tracks1), len(tracks2))
+        if not tracks1 or not tracks2:
+            return np.zeros(shape)
+
+        # Features are added in the same order as in similarity, so the sums are equal
+        weighted_sum = (
+            aliased_strings_similarity_matrix(
+                [t.name.normalized_values() for t in tracks1],
+                [t.name.normalized_values() for t in tracks2],
+            )
+            * self.weights["name"]
+        )
+        total_weight = np.full(shape, self.weights["name"])
+
+        has_artists = np.outer(
+            [bool(t.artists) for t in tracks1], [bool(t.artists) for t in tracks2]
+        )
+        if has_artists.any():
+            artists = aliased_strings_similarity_matrix(
+                [t.artist_values() for t in tracks1],
+                [t.artist_values() for t in tracks2],
+            )
+            weighted_sum += np.where(
+                has_artists, artists * self.weights["artists"], 0.0
+            )
+            total_weight += np.where(has_artists, self.weights["artists"], 0)
+
+        has_albums = np.outer(
+            [bool(t.albums) for t in tracks1], [bool(t.albums) for t in tracks2]
+        )
+        if has_albums.any():
+            albums = aliased_strings_similarity_matrix(
+                [t.album_values() for t in tracks1],
+                [t.album_values() for t in tracks2],
+            )
+            weighted_sum += np.where(has_albums, albums * self.weights["album"], 0.0)
+            total_weight += np.where(has_albums, self.weights["album"], 0)
+
+        lengths1 = np.array([t.length or 0 for t in tracks1])
+        lengths2 = np.array([t.length or 0 for t in tracks2])
+        has_length = np.outer(lengths1 != 0, lengths2 != 0)
+        if has_length.any():
+            d = np.abs(lengths1[:, None] - lengths2[None, :])
+            length = np.where(d > MAX_LENGTH_DISTANCE, 0.0, 1 - d / MAX_LENGTH_DISTANCE)
+            weighted_sum += np.where(has_length, length * self.weights["length"], 0.0)
+            total_weight += np.where(has_length, self.weights["length"], 0)
+
+        similarity = weighted_sum / total_weight
+
+        # matching uris override the features
+        uris2: Dict[Hashable, List[int]] = {}
+        for j, track in enumerate(tracks2):
+            for uri in track.uris:
+                uris2.setdefault(uri_key(uri), []).append(j)
+        for i, track in enumerate(tracks1):
+            for uri in track.uris:
+                similarity[i, uris2.get(uri_key(uri), [])] = 1
+
+        return similarity
@@ -0,0 +1,31 @@
+import re
+from typing import FrozenSet, Tuple
+
+# Terms that distinguish versions of a song. Strings differing in them don't match.
+SPECIAL_TERMS = [
+    "instrumental",
+    "remix",
+    "cover",
+    "live",
+    "version",
+    "edit",
+    "nightcore",
+]
+
+# A lowercased string and the bitmask of the special terms in it
+NormalizedValue = Tuple[str, int]
+
+
+def special_terms_mask(lowered: str) -> int:
+    """Bitmask of the special terms in a lowercased string."""
+    return sum(1 << i for i, term in enumerate(SPECIAL_TERMS) if term in lowered)
+
+
+def normalize(s: str) -> NormalizedValue:
+    lowered = s.lower()
+    return lowered, special_terms_mask(lowered)
+
+
+def tokenize(lowered: str) -> FrozenSet[str]:
+    """Returns the words of a lowercased string."""
+    return frozenset(re.findall(r"\w+", lowered))
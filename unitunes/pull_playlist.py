@@ -1,5 +1,6 @@
-from typing import List
+from typing import List, Optional
 
+from unitunes.candidate_index import CandidateIndex
 from unitunes.services.services import StreamingService
 
 from unitunes.track import Track
@@ -25,7 +26,8 @@ def get_missing_uris(
         return flat_uris
 
     uris_on_service = [uri for uri in tracks_to_uris(current) if uri.service == service]
-    remote = tracks_to_uris(new)
+    # uris are frozen, so they hash instead of comparing as dicts
+    remote = set(tracks_to_uris(new))
     missing = [uri for uri in uris_on_service if uri not in remote]
     return missing
 
@@ -41,21 +43,33 @@ def get_invalid_uris(
 
 
 def merge_new_tracks(
-    tracks: List[Track], new_tracks: List[Track], matcher: MatcherStrategy
+    tracks: List[Track],
+    new_tracks: List[Track],
+    matcher: MatcherStrategy,
+    index: Optional[CandidateIndex] = None,
 ) -> None:
+    """Merges new tracks into matching tracks, or appends them.
+    index must index tracks, and is kept up to date."""
+    if index is None:
+        index = CandidateIndex(tracks)
+
     for track in new_tracks:
-        matches = [t for t in tracks if matcher.are_same(t, track)]
+        candidates = index.candidates(track)
+        scores = matcher.similarity_matrix(candidates, [track])[:, 0]
+        matches = [t for t, score in zip(candidates, scores) if score >= 0.7]
         if matches:
             for match in matches:
                 match.merge(track)
+                index.update(match)
         else:
             tracks.append(track)
+            index.add(track)
 
 
 def remove_tracks(current_tracks: List[Track], missing: List[TrackURIs]) -> None:
-    for missing_uri in missing:
-        matches = [t for t in current_tracks if missing_uri in t.uris]
-        for t in matches:
+    missing_set = set(missing)
+    for t in current_tracks:
+        for missing_uri in [uri for uri in t.uris if uri in missing_set]:
             print(f"Track {t.name.value} not found in playlist")
             # remove uri
             t.uris.remove(missing_uri)
@@ -63,12 +77,22 @@ def remove_tracks(current_tracks: List[Track], missing: List[TrackURIs]) -> None
             print(f"Removed {missing_uri.url} from {t.name.value} and marked it as bad")
 
 
-def add_changed_uris(current_tracks: List[Track], remote_tracks: List[Track]) -> None:
-    """Finds matching tracks with different uris and adds them"""
-    matcher = DefaultMatcherStrategy()
+def add_changed_uris(
+    current_tracks: List[Track],
+    remote_tracks: List[Track],
+    index: Optional[CandidateIndex] = None,
+    matcher: Optional[MatcherStrategy] = None,
+) -> None:
+    """Finds matching tracks with different uris and adds them.
+    index must index remote_tracks."""
+    if matcher is None:
+        matcher = DefaultMatcherStrategy()
+    remote_index = index if index is not None else CandidateIndex(remote_tracks)
 
     def fix_track_uri(track: Track) -> None:
-        matches = [t for t in remote_tracks if matcher.are_same(t, track)]
+        matches = [
+            t for t in remote_index.candidates(track) if matcher.are_same(t, track)
+        ]
         if not matches:
             return
         new_uri = matches[0].uris[0]
@@ -84,12 +108,12 @@ def add_changed_uris(current_tracks: List[Track], remote_tracks: List[Track]) ->
 
 
 def remove_uris(current_tracks: List[Track], uris: List[TrackURIs]) -> None:
+    removed = set(uris)
     for track in current_tracks:
-        for uri in uris:
-            if uri in track.uris:
-                track.uris.remove(uri)
-                track.bad_uris.append(uri)
-                print(f"Removed invalid URL {uri.url} from {track.name.value}")
+        for uri in [uri for uri in track.uris if uri in removed]:
+            track.uris.remove(uri)
+            track.bad_uris.append(uri)
+            print(f"Removed invalid URL {uri.url} from {track.name.value}")
 
 
 def tracks_match_and_on_service(
@@ -106,22 +130,47 @@ def tracks_match_and_on_service(
 
 
 def tracks_to_add(
-    service: ServiceType, current: List[Track], new: List[Track]
+    service: ServiceType,
+    current: List[Track],
+    new: List[Track],
+    index: Optional[CandidateIndex] = None,
+    matcher: Optional[MatcherStrategy] = None,
 ) -> List[Track]:
+    """index must index current."""
+    current_index = index if index is not None else CandidateIndex(current)
+    if matcher is None:
+        matcher = DefaultMatcherStrategy()
+
+    def has_match(track: Track) -> bool:
+        candidates = [
+            t for t in current_index.candidates(track) if t.is_on_service(service)
+        ]
+        scores = matcher.similarity_matrix([track], candidates)
+        return bool((scores >= 0.7).any())
+
     new_on_service = [track for track in new if track.is_on_service(service)]
-    return [
-        track
-        for track in new_on_service
-        if not any(tracks_match_and_on_service(service, track, t) for t in current)
-    ]
+    return [track for track in new_on_service if not has_match(track)]
 
 
 def tracks_to_remove(
-    service: ServiceType, current: List[Track], new: List[Track]
+    service: ServiceType,
+    current: List[Track],
+    new: List[Track],
+    index: Optional[CandidateIndex] = None,
+    matcher: Optional[MatcherStrategy] = None,
 ) -> List[Track]:
+    """index must index new."""
+    if index is None:
+        index = CandidateIndex(new)
+    if matcher is None:
+        matcher = DefaultMatcherStrategy()
+
     current_on_service = [track for track in current if track.is_on_service(service)]
     return [
         track
         for track in current_on_service
-        if not any(tracks_match_and_on_service(service, t, track) for t in new)
+        if not any(
+            tracks_match_and_on_service(service, t, track, matcher)
+            for t in index.candidates(track)
+        )
     ]
@@ -0,0 +1,122 @@
+from typing import List, Optional
+
+from unitunes.candidate_index import CandidateIndex
+from unitunes.matcher import MatcherStrategy
+from unitunes.playlist import Playlist, PlaylistDetails
+from unitunes.pull_playlist import tracks_to_add, tracks_to_remove
+from unitunes.services.services import Pushable, Replaceable, StreamingService
+from unitunes.track import Track
+from unitunes.uri import PlaylistURIs
+
+
+class PushPlan:
+    """The writes that make a remote playlist match a playlist."""
+
+    uri: PlaylistURIs
+    # None if the remote metadata is already up to date
+    metadata: Optional[PlaylistDetails]
+    add: List[Track]
+    remove: List[Track]
+    # all tracks in order, if the remote's tracks are replaced instead
+    replace: Optional[List[Track]]
+    # estimated API calls
+    calls: int
+
+    def __init__(
+        self,
+        uri: PlaylistURIs,
+        metadata: Optional[PlaylistDetails],
+        add: List[Track],
+        remove: List[Track],
+        replace: Optional[List[Track]],
+        calls: int,
+    ) -> None:
+        self.uri = uri
+        self.metadata = metadata
+        self.add = add
+        self.remove = remove
+        self.replace = replace
+        self.calls = calls
+
+    def describe(self) -> str:
+        changes = []
+        if self.metadata is not None:
+            changes.append("update metadata")
+        if self.replace is not None:
+            changes.append(f"replace with {len(self.replace)} tracks")
+        else:
+            if self.add:
+                changes.append(f"add {len(self.add)} tracks")
+            if self.remove:
+                changes.append(f"remove {len(self.remove)} tracks")
+        summary = ", ".join(changes) if changes else "up to date"
+        return f"{self.uri.url}: {summary} ({self.calls} calls)"
+
+    def execute(self, service: Pushable) -> None:
+        if self.metadata is not None:
+            service.update_metadata(self.uri, self.metadata)
+        if self.replace is not None:
+            assert isinstance(service, Replaceable)
+            service.replace_tracks(self.uri, self.replace)
+            return
+        if self.add:
+            service.add_tracks(self.uri, self.add)
+        if self.remove:
+            service.remove_tracks(self.uri, self.remove)
+
+
+def plan_push(
+    service: StreamingService,
+    uri: PlaylistURIs,
+    playlist: Playlist,
+    current_tracks: List[Track],
+    current_metadata: Optional[PlaylistDetails],
+    matcher: MatcherStrategy,
+    index: Optional[CandidateIndex] = None,
+    complete: bool = False,
+) -> PushPlan:
+    """
+    Plans the cheapest push of a playlist to a remote playlist with current_tracks.
+    index must index playlist.tracks. The metadata is only skipped if
+    current_metadata is known and matches, or the service can't edit it.
+
+    Replacing is only considered if complete, i.e. current_tracks are all of the
+    remote's items. Otherwise it would delete the items pulls leave out.
+
+    Removing and adding tracks keeps the remote's order and appends new tracks, so
+    replacing all tracks is also chosen when it costs the same and fixes the order.
+    """
+    metadata = (
+        None
+        if current_metadata == playlist.metadata() or not service.metadata_editable(uri)
+        else playlist.metadata()
+    )
+    calls = 0 if metadata is None else 1
+
+    add = tracks_to_add(service.type, current_tracks, playlist.tracks, matcher=matcher)
+    remove = tracks_to_remove(
+        service.type, current_tracks, playlist.tracks, index, matcher
+    )
+    diff_calls = service.add_calls(uri, len(add)) + service.remove_calls(
+        uri, len(remove)
+    )
+
+    replace = [track for track in playlist.tracks if track.is_on_service(service.type)]
+    replace_calls = (
+        service.replace_calls(uri, len(replace))
+        if complete and isinstance(service, Replaceable)
+        else None
+    )
+
+    if replace_calls is not None and replace_calls <= diff_calls:
+        removed = {id(track) for track in remove}
+        after_diff = [
+            track for track in current_tracks if id(track) not in removed
+        ] + add
+        in_order = [track.find_uri(service.type) for track in after_diff] == [
+            track.find_uri(service.type) for track in replace
+        ]
+        if replace_calls < diff_calls or not in_order:
+            return PushPlan(uri, metadata, [], [], replace, calls + replace_calls)
+
+    return PushPlan(uri, metadata, add, remove, None, calls + diff_calls)
@@ -0,0 +1,103 @@
+import threading
+from typing import ClassVar, Dict, List, Optional
+
+from pydantic import BaseModel, PrivateAttr
+
+
+class TemplateStats(BaseModel):
+    tried: int = 0  # successful searches that got the template's results
+    won: int = 0  # searches whose accepted match the template found first
+
+    def win_rate(self) -> float:
+        # starts at 1/2 and moves towards the observed rate as trials add up
+        return (self.won + 1) / (self.tried + 2)
+
+
+class ServiceQueryStats(BaseModel):
+    templates: Dict[str, TemplateStats] = {}
+    searches: int = 0
+    calls: int = 0
+    # calls the searches would have made in the query generator's order. Estimated,
+    # assuming templates before the winning one would still have missed.
+    default_calls: int = 0
+
+
+class QueryStats(BaseModel):
+    """
+    Per service hit statistics of query templates, so searches can try the templates
+    that usually find the track first, and skip the ones that never do.
+    """
+
+    # service name -> stats
+    services: Dict[str, ServiceQueryStats] = {}
+
+    # templates tried this often without ever winning are skipped, except in every
+    # explore_every-th search, so they are tried again if the catalog changes
+    skip_after: ClassVar[int] = 20
+    explore_every: ClassVar[int] = 10
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def order(self, service_name: str, templates: List[str]) -> List[int]:
+        """
+        Indices of the templates to try, most likely to win first. Ties keep the
+        generator's order. At least one template is kept.
+        """
+        with self._lock:
+            service_stats = self.services.get(service_name, ServiceQueryStats())
+            rates = {
+                template: service_stats.templates.get(template, TemplateStats())
+                for template in templates
+            }
+            explore = (service_stats.searches + 1) % self.explore_every == 0
+        order = sorted(
+            range(len(templates)), key=lambda i: -rates[templates[i]].win_rate()
+        )
+        if explore:
+            return order
+        kept = [
+            i
+            for i in order
+            if not (
+                rates[templates[i]].tried >= self.skip_after
+                and rates[templates[i]].won == 0
+            )
+        ]
+        return kept or order[:1]
+
+    def record(
+        self,
+        service_name: str,
+        templates: List[str],
+        tried: List[str],
+        calls: int,
+        winner: Optional[str],
+    ) -> None:
+        """Records a search. templates are all templates in the generator's order,
+        tried the ones whose results were handled. Tries only count if a template
+        won, as no template can find a track missing from the catalog."""
+        with self._lock:
+            stats = self.services.setdefault(service_name, ServiceQueryStats())
+            if winner is not None:
+                for template in tried:
+                    stats.templates.setdefault(template, TemplateStats()).tried += 1
+                stats.templates[winner].won += 1
+            stats.searches += 1
+            stats.calls += calls
+            stats.default_calls += (
+                templates.index(winner) + 1 if winner is not None else len(templates)
+            )
+
+    def report(self) -> str:
+        lines = []
+        with self._lock:
+            for service_name, stats in self.services.items():
+                rates = ", ".join(
+                    f"{template} {s.won}/{s.tried}"
+                    for template, s in stats.templates.items()
+                )
+                lines.append(
+                    f"{service_name}: {stats.calls} queries for {stats.searches} "
+                    f"searches, {stats.default_calls - stats.calls} saved ({rates})"
+                )
+        return "\n".join(lines)
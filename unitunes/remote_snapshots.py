@@ -0,0 +1,101 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from unitunes.playlist import PlaylistDetails
+from unitunes.track import Track
+from unitunes.uri import PlaylistURIs
+
+
+class Snapshot:
+    tracks: List[Track]
+    metadata: PlaylistDetails
+    version: Optional[str]
+    # remote items left out of tracks, None if unknown
+    skipped: Optional[int]
+    taken_at: float
+
+    def __init__(
+        self,
+        tracks: List[Track],
+        metadata: PlaylistDetails,
+        version: Optional[str],
+        skipped: Optional[int],
+        taken_at: float,
+    ):
+        self.tracks = tracks
+        self.metadata = metadata
+        self.version = version
+        self.skipped = skipped
+        self.taken_at = taken_at
+
+
+class RemoteSnapshots:
+    """
+    Tracks of remote playlists as last pulled in this session, so a push right after
+    a pull can diff against them instead of pulling again.
+
+    A snapshot is dropped when we write to its playlist, and is stale once the
+    playlist's version changed. For playlists without versions, it is stale once it
+    is older than max_age seconds.
+    """
+
+    max_age: float
+    _snapshots: Dict[Tuple[str, PlaylistURIs], Snapshot]
+    _lock: threading.Lock
+    _clock: Callable[[], float]
+
+    def __init__(
+        self, max_age: float = 3600, clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.max_age = max_age
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self._clock = clock
+
+    def put(
+        self,
+        service_name: str,
+        uri: PlaylistURIs,
+        tracks: List[Track],
+        metadata: PlaylistDetails,
+        version: Optional[str],
+        skipped: Optional[int] = None,
+    ) -> None:
+        """Stores a copy of a remote playlist's tracks and metadata."""
+        snapshot = Snapshot(
+            [track.copy(deep=True) for track in tracks],
+            metadata.copy(),
+            version,
+            skipped,
+            self._clock(),
+        )
+        with self._lock:
+            self._snapshots[(service_name, uri)] = snapshot
+
+    def get(
+        self,
+        service_name: str,
+        uri: PlaylistURIs,
+        current_version: Callable[[], Optional[str]] = lambda: None,
+    ) -> Optional[Snapshot]:
+        """
+        Returns the snapshot, or None if there is none or it is stale.
+        current_version is only called if there is a snapshot. A version it returns
+        must match the snapshot's, and if it returns None the snapshot's age is
+        checked instead.
+        """
+        with self._lock:
+            snapshot = self._snapshots.get((service_name, uri))
+        if snapshot is None:
+            return None
+        version = current_version()
+        if version is not None:
+            return snapshot if version == snapshot.version else None
+        if self._clock() - snapshot.taken_at > self.max_age:
+            return None
+        return snapshot
+
+    def invalidate(self, service_name: str, uri: PlaylistURIs) -> None:
+        with self._lock:
+            self._snapshots.pop((service_name, uri), None)
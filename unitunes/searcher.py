@@ -1,7 +1,10 @@
 from abc import ABC, abstractmethod
-from typing import List
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Deque, List, Optional
 from unitunes.matcher import MatcherStrategy
-from unitunes.services.services import Searchable
+from unitunes.query_stats import QueryStats
+from unitunes.services.services import QueryTemplated, Searchable, StreamingService
 
 from unitunes.track import Track
 
@@ -13,27 +16,101 @@ class SearcherStrategy(ABC):
         Returns a sorted list of potential matches."""
 
 
+def stats_name(service: Searchable) -> str:
+    return (
+        service.name
+        if isinstance(service, StreamingService)
+        else type(service).__name__
+    )
+
+
+def query_template(service: Searchable, index: int, query: Any) -> str:
+    if isinstance(service, QueryTemplated):
+        return service.query_template(query)
+    return f"query {index + 1}"
+
+
 class DefaultSearcherStrategy(SearcherStrategy):
     matcher: MatcherStrategy
+    # Queries in flight at once. Queries after the first confident match are wasted,
+    # so more than one trades extra requests for less waiting.
+    parallel_queries: int
+    # If set, queries are ordered by how often their template found the track, and
+    # searches are recorded in it
+    stats: Optional[QueryStats]
+    # score above which the best match counts as found, for the stats
+    accept_threshold: float
 
-    def __init__(self, matcher: MatcherStrategy) -> None:
+    def __init__(
+        self,
+        matcher: MatcherStrategy,
+        parallel_queries: int = 1,
+        stats: Optional[QueryStats] = None,
+        accept_threshold: float = 0.7,
+    ) -> None:
         self.matcher = matcher
+        self.parallel_queries = parallel_queries
+        self.stats = stats
+        self.accept_threshold = accept_threshold
 
     def search(self, service: Searchable, track: Track, limit=3) -> List[Track]:
-        queries = service.query_generator(track)
+        generated = list(service.query_generator(track))
+        templates = [query_template(service, i, q) for i, q in enumerate(generated)]
+        order = (
+            self.stats.order(stats_name(service), templates)
+            if self.stats is not None
+            else range(len(generated))
+        )
+        queries = [(templates[i], generated[i]) for i in order]
+
         stop_threshold = 0.8
-        matches = []
-
-        for query in queries:
-            new_matches = service.search_query(query)
-            for new_match in new_matches:
-                if new_match not in matches:
-                    matches.append(new_match)
-            if any(
-                self.matcher.similarity(track, match) >= stop_threshold
-                for match in new_matches
-            ):
-                break
-
-        matches.sort(key=lambda t: self.matcher.similarity(track, t), reverse=True)
-        return matches[:limit]
+        matches: List[Track] = []
+        scores: List[float] = []  # score of each match, computed once
+        sources: List[str] = []  # template of the query that found each match
+        tried: List[str] = []
+
+        executor = ThreadPoolExecutor(max_workers=self.parallel_queries)
+        pending: Deque[Future] = deque()
+        try:
+            # results are handled in query order, so they don't depend on timing
+            for _, query in queries[: self.parallel_queries]:
+                pending.append(executor.submit(service.search_query, query))
+            next_query = len(pending)
+            while pending:
+                new_matches = pending.popleft().result()
+                template = queries[len(tried)][0]
+                tried.append(template)
+                added = []
+                for new_match in new_matches:
+                    if new_match not in matches and new_match not in added:
+                        added.append(new_match)
+                new_scores = list(self.matcher.similarity_matrix([track], added)[0])
+                matches.extend(added)
+                scores.extend(new_scores)
+                sources.extend(template for _ in added)
+                # earlier matches were below the threshold, or we would have stopped
+                if any(score >= stop_threshold for score in new_scores):
+                    break
+
+                if next_query < len(queries):
+                    pending.append(
+                        executor.submit(service.search_query, queries[next_query][1])
+                    )
+                    next_query += 1
+        finally:
+            cancelled = sum(future.cancel() for future in pending)
+            executor.shutdown(wait=False)
+
+        order = sorted(range(len(matches)), key=lambda i: scores[i], reverse=True)
+
+        if self.stats is not None:
+            found = bool(order) and scores[order[0]] >= self.accept_threshold
+            self.stats.record(
+                stats_name(service),
+                templates,
+                tried,
+                calls=next_query - cancelled,
+                winner=sources[order[0]] if found else None,
+            )
+
+        return [matches[i] for i in order[:limit]]
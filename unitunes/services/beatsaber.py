@@ -1,5 +1,7 @@
+from datetime import timedelta
+import hashlib
 from pathlib import Path
-from typing import Any, List
+from typing import Any, Dict, List, Optional, Tuple
 from platformdirs import user_documents_dir
 
 from pydantic import BaseModel
@@ -34,15 +36,19 @@ class BeatsaberConfig(ServiceConfig):
     search_config: BeatsaberSearchConfig = BeatsaberSearchConfig()
 
 
+def is_not_found(response: Any) -> bool:
+    return "error" in response
+
+
 class BeatsaverAPIWrapper(ServiceWrapper):
     def __init__(self, cache_root) -> None:
         super().__init__("beatsaver", cache_root=cache_root)
 
-    @cache
+    @cache(negative_ttl=timedelta(days=1), is_negative=is_not_found)
     def map(self, id: str, use_cache=True) -> Any:
         return requests.get(f"https://api.beatsaver.com/maps/id/{id}").json()
 
-    @cache
+    @cache(ttl=timedelta(days=7), negative_ttl=timedelta(days=1))
     def search(
         self, query: str, page: int, search_config={}, use_cache=True, **kwargs
     ) -> Any:
@@ -72,14 +78,18 @@ class BeatsaberService(StreamingService):
     # Tracks are online at beatsaver.com, playlists are local .bplist files
     wrapper: BeatsaverAPIWrapper
     config: BeatsaberConfig
+    # path -> (mtime, size, sha256) of the playlist files last versioned
+    _versions: Dict[Path, Tuple[int, int, str]]
 
     def __init__(self, name: str, config: BeatsaberConfig, cache_root: Path) -> None:
         super().__init__(name, ServiceType.BEATSABER, cache_root)
         self.wrapper = BeatsaverAPIWrapper(cache_root)
+        self._versions = {}
         self.load_config(config)
 
     def load_config(self, config: BeatsaberConfig) -> None:
         self.config = config
+        self.apply_limits(config)
 
     def pull_track(self, uri: BeatsaberTrackURI) -> Track:
         res = self.wrapper.map(uri.uri)
@@ -187,6 +197,20 @@ class BeatsaberService(StreamingService):
         ]
         self.write_bplist(playlist_uri, bp)
 
+    def playlist_version(self, uri: BeatsaberPlaylistURI) -> Optional[str]:
+        path = self.config.dir / uri.uri
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        # only hash files that were written since the last check
+        known = self._versions.get(path)
+        if known and known[:2] == (stat.st_mtime_ns, stat.st_size):
+            return known[2]
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()
+        self._versions[path] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
     def pull_metadata(self, uri: BeatsaberPlaylistURI) -> PlaylistDetails:
         bp = self.read_playlist(uri)
         return PlaylistDetails(
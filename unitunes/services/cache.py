@@ -0,0 +1,703 @@
+from abc import ABC, abstractmethod
+import ast
+import atexit
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import timedelta
+import hashlib
+import inspect
+import json
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+import weakref
+
+# A cached value and the unix time it expires at, None if it never expires
+CacheEntry = Tuple[Any, Optional[float]]
+
+# Version of the cache key format. Version 1 keys were f"{args}_{kwargs}".
+KEY_VERSION = 2
+
+# Maps a key in an older format to the current one, None if it can't be converted
+KeyMigration = Callable[[str], Optional[str]]
+
+
+def canonical_key(
+    signature: inspect.Signature, args: Tuple[Any, ...], kwargs: Dict[str, Any]
+) -> str:
+    """Returns a hash of the arguments of a call to a cached method, bound to its
+    signature, so positional or keyword spelling, keyword order and omitted defaults
+    all give the same key. Args exclude self."""
+    parameters = list(signature.parameters.values())
+    bound = signature.bind(None, *args, **kwargs)
+    bound.apply_defaults()
+
+    arguments: Dict[str, Any] = {}
+    for parameter in parameters[1:]:
+        if parameter.name == "use_cache" or parameter.name not in bound.arguments:
+            continue
+        value = bound.arguments[parameter.name]
+        if parameter.kind == inspect.Parameter.VAR_KEYWORD:
+            arguments.update(value)
+        else:
+            arguments[parameter.name] = value
+
+    serialized = json.dumps(
+        arguments, sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.blake2b(serialized.encode(), digest_size=16).hexdigest()
+
+
+def parse_legacy_key(key: str) -> Optional[Tuple[Tuple[Any, ...], Dict[str, Any]]]:
+    """Parses a version 1 key back into the call's args and kwargs."""
+    start = 0
+    while True:
+        i = key.find(")_{", start)
+        if i == -1:
+            return None
+        try:
+            args = ast.literal_eval(key[: i + 1])
+            kwargs = ast.literal_eval(key[i + 2 :])
+        except (ValueError, SyntaxError):
+            start = i + 1
+            continue
+        if isinstance(args, tuple) and isinstance(kwargs, dict):
+            return args, kwargs
+        start = i + 1
+
+
+def legacy_key_migration(signature: inspect.Signature) -> KeyMigration:
+    def migrate(key: str) -> Optional[str]:
+        call = parse_legacy_key(key)
+        if call is None:
+            return None
+        try:
+            return canonical_key(signature, *call)
+        except TypeError:  # arguments don't fit the signature anymore
+            return None
+
+    return migrate
+
+
+def is_empty(result: Any) -> bool:
+    return not result
+
+
+class CachePolicy:
+    """How long results of a cached method stay valid.
+    Negative results (empty searches, not found lookups) use negative_ttl.
+    A ttl of None keeps the entry until it is evicted."""
+
+    ttl: Optional[timedelta]
+    negative_ttl: Optional[timedelta]
+    is_negative: Callable[[Any], bool]
+
+    def __init__(
+        self,
+        ttl: Optional[timedelta] = None,
+        negative_ttl: Optional[timedelta] = None,
+        is_negative: Callable[[Any], bool] = is_empty,
+    ) -> None:
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.is_negative = is_negative
+
+    def expires_at(self, result: Any, now: float) -> Optional[float]:
+        ttl = self.negative_ttl if self.is_negative(result) else self.ttl
+        if ttl is None:
+            return None
+        return now + ttl.total_seconds()
+
+
+def is_expired(expires_at: Optional[float], now: float) -> bool:
+    return expires_at is not None and expires_at <= now
+
+
+class CacheBackend(ABC):
+    """Stores the responses of `cache` decorated ServiceWrapper methods.
+    Entries are grouped by method name and looked up by key."""
+
+    @abstractmethod
+    def get_entry(self, method: str, key: str) -> CacheEntry:
+        """Returns the cached value and its expiry time.
+        Raises KeyError if the key is not cached or has expired."""
+
+    @abstractmethod
+    def set(
+        self, method: str, key: str, value: Any, expires_at: Optional[float] = None
+    ) -> None:
+        """Caches a JSON serializable value."""
+
+    def get(self, method: str, key: str) -> Any:
+        return self.get_entry(method, key)[0]
+
+    def register_key_migration(self, method: str, migrate: KeyMigration) -> None:
+        """Registers how to convert stored keys of a method to the current KEY_VERSION."""
+
+    def touch(self, method: str, keys: Iterable[str], accessed_at: float) -> None:
+        """Records that entries were used, for least recently used eviction."""
+
+    def evict(self, max_bytes: int) -> None:
+        """Removes expired entries, then least recently used ones until the cache
+        fits in max_bytes."""
+
+    def flush(self) -> None:
+        """Persists pending writes."""
+
+    def close(self) -> None:
+        self.flush()
+
+
+class JsonCacheBackend(CacheBackend):
+    """Legacy backend, one `<method>.json` file per method.
+    Every lookup parses the whole file and every write rewrites it.
+    Entries never expire and are never evicted."""
+
+    cache_path: Path
+
+    def __init__(self, cache_path: Path) -> None:
+        self.cache_path = cache_path
+
+    def _load(self, method: str) -> Dict[str, Any]:
+        file_path = self.cache_path / f"{method}.json"
+        if not file_path.exists():
+            return {}
+        with file_path.open("r") as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                return {}
+
+    def get_entry(self, method: str, key: str) -> CacheEntry:
+        return self._load(method)[key], None
+
+    def set(
+        self, method: str, key: str, value: Any, expires_at: Optional[float] = None
+    ) -> None:
+        d = self._load(method)
+        d[key] = value
+        with (self.cache_path / f"{method}.json").open("w") as f:
+            json.dump(d, f, indent=4)
+
+
+class SqliteCacheBackend(CacheBackend):
+    """Stores each method in its own table of a SQLite database, keyed by the cache key.
+    Writes are committed in batches of `commit_every`, on `flush` and at exit.
+
+    Legacy `<method>.json` caches next to the database are imported the first time
+    their table is opened, and again only if the file changes afterwards.
+    Use `open` to share one connection between wrappers using the same database."""
+
+    commit_every = 100
+    # fraction of max_bytes to shrink to when evicting, so evictions are batched
+    evict_to = 0.9
+
+    db_path: Path
+    json_dir: Path
+
+    _instances: Dict[Path, "SqliteCacheBackend"] = {}
+    _instances_lock = threading.Lock()
+
+    _columns = {
+        "key": "TEXT PRIMARY KEY",
+        "value": "TEXT NOT NULL",
+        "created_at": "REAL NOT NULL",
+        "expires_at": "REAL",
+        "accessed_at": "REAL",
+        "size": "INTEGER",
+    }
+
+    def __init__(self, db_path: Path, json_dir: Optional[Path] = None) -> None:
+        self.db_path = db_path
+        self.json_dir = json_dir if json_dir is not None else db_path.parent
+        self._lock = threading.RLock()
+        self._tables: Set[str] = set()
+        self._pending = 0
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._migrations: Dict[str, KeyMigration] = {}
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS _imports (file TEXT PRIMARY KEY, mtime REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS _key_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+        atexit.register(self.flush)
+
+    @classmethod
+    def open(cls, db_path: Path) -> "SqliteCacheBackend":
+        """Returns the shared backend for a database, creating it if needed."""
+        key = db_path.resolve()
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(db_path)
+            return cls._instances[key]
+
+    def _table(self, method: str) -> str:
+        if method not in self._tables:
+            columns = ", ".join(f"{c} {t}" for c, t in self._columns.items())
+            self._conn.execute(f'CREATE TABLE IF NOT EXISTS "{method}" ({columns})')
+            self._upgrade_table(method)
+            self._import_json(method)
+            self._migrate_keys(method)
+            self._tables.add(method)
+        return method
+
+    def register_key_migration(self, method: str, migrate: KeyMigration) -> None:
+        with self._lock:
+            self._migrations[method] = migrate
+            if method in self._tables:
+                self._migrate_keys(method)
+
+    def _key_version(self, method: str) -> int:
+        row = self._conn.execute(
+            "SELECT version FROM _key_versions WHERE name = ?", (method,)
+        ).fetchone()
+        return row[0] if row is not None else 1
+
+    def _migrate_keys(self, method: str) -> None:
+        """Converts the keys of a table to KEY_VERSION, once.
+        Entries whose key can't be converted can never be hit again and are dropped."""
+        migrate = self._migrations.get(method)
+        if migrate is None or self._key_version(method) >= KEY_VERSION:
+            return
+
+        rows = self._conn.execute(f'SELECT key FROM "{method}"').fetchall()
+        renamed = []
+        dropped = []
+        for (key,) in rows:
+            new_key = migrate(key)
+            if new_key is None:
+                dropped.append((key,))
+            elif new_key != key:
+                renamed.append((new_key, key))
+        self._conn.executemany(f'DELETE FROM "{method}" WHERE key = ?', dropped)
+        # different spellings of the same call now share a key, keep one of them
+        self._conn.executemany(
+            f'UPDATE OR REPLACE "{method}" SET key = ? WHERE key = ?', renamed
+        )
+        self._conn.execute(
+            "INSERT OR REPLACE INTO _key_versions (name, version) VALUES (?, ?)",
+            (method, KEY_VERSION),
+        )
+        self._commit()
+        if rows:
+            print(
+                f"Migrated {len(renamed)} {method} cache keys, dropped {len(dropped)}"
+            )
+
+    def _upgrade_table(self, method: str) -> None:
+        """Adds columns missing from tables created by older versions."""
+        existing = {
+            row[1] for row in self._conn.execute(f'PRAGMA table_info("{method}")')
+        }
+        missing = [c for c in self._columns if c not in existing]
+        for column in missing:
+            self._conn.execute(
+                f'ALTER TABLE "{method}" ADD COLUMN {column} {self._columns[column]}'
+            )
+        if missing:
+            self._conn.execute(
+                f'UPDATE "{method}" SET accessed_at = created_at, size = length(value) '
+                "WHERE size IS NULL"
+            )
+            self._commit()
+
+    def _stored_tables(self) -> List[str]:
+        rows = self._conn.execute(
+            "SELECT name FROM sqlite_master "
+            "WHERE type = 'table' AND name NOT LIKE '\\_%' ESCAPE '\\'"
+        ).fetchall()
+        return [self._table(row[0]) for row in rows]
+
+    def _import_json(self, method: str) -> None:
+        file_path = self.json_dir / f"{method}.json"
+        if not file_path.exists():
+            return
+        mtime = file_path.stat().st_mtime
+        row = self._conn.execute(
+            "SELECT mtime FROM _imports WHERE file = ?", (file_path.name,)
+        ).fetchone()
+        if row is not None and row[0] == mtime:
+            return
+
+        try:
+            d = json.loads(file_path.read_text())
+        except json.JSONDecodeError:
+            d = {}
+        # the JSON files use version 1 keys
+        migrate = self._migrations.get(method)
+        if migrate is not None and self._key_version(method) >= KEY_VERSION:
+            migrated = ((migrate(key), value) for key, value in d.items())
+            d = {key: value for key, value in migrated if key is not None}
+        now = time.time()
+        rows = []
+        for key, value in d.items():
+            serialized = json.dumps(value)
+            rows.append((key, serialized, now, now, len(serialized)))
+        self._conn.executemany(
+            f'INSERT OR IGNORE INTO "{method}" (key, value, created_at, accessed_at, size) '
+            "VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        self._conn.execute(
+            "INSERT OR REPLACE INTO _imports (file, mtime) VALUES (?, ?)",
+            (file_path.name, mtime),
+        )
+        self._commit()
+        print(f"Imported {len(d)} cache entries from {file_path}")
+
+    def get_entry(self, method: str, key: str) -> CacheEntry:
+        with self._lock:
+            row = self._conn.execute(
+                f'SELECT value, expires_at FROM "{self._table(method)}" WHERE key = ?',
+                (key,),
+            ).fetchone()
+        if row is None or is_expired(row[1], time.time()):
+            raise KeyError(key)
+        return json.loads(row[0]), row[1]
+
+    def set(
+        self, method: str, key: str, value: Any, expires_at: Optional[float] = None
+    ) -> None:
+        serialized = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                f'INSERT OR REPLACE INTO "{self._table(method)}" '
+                "(key, value, created_at, expires_at, accessed_at, size) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, serialized, now, expires_at, now, len(serialized)),
+            )
+            self._pending += 1
+            if self._pending >= self.commit_every:
+                self._commit()
+
+    def touch(self, method: str, keys: Iterable[str], accessed_at: float) -> None:
+        with self._lock:
+            self._conn.executemany(
+                f'UPDATE "{self._table(method)}" SET accessed_at = ? WHERE key = ?',
+                [(accessed_at, key) for key in keys],
+            )
+            self._pending += 1
+
+    def size(self) -> int:
+        """Returns the total size of the cached values in bytes."""
+        with self._lock:
+            return sum(
+                self._conn.execute(
+                    f'SELECT COALESCE(SUM(size), 0) FROM "{table}"'
+                ).fetchone()[0]
+                for table in self._stored_tables()
+            )
+
+    def evict(self, max_bytes: int) -> None:
+        with self._lock:
+            tables = self._stored_tables()
+            now = time.time()
+            for table in tables:
+                self._conn.execute(
+                    f'DELETE FROM "{table}" WHERE expires_at <= ?', (now,)
+                )
+            self._pending += 1
+
+            total = self.size()
+            if total <= max_bytes:
+                self._commit()
+                return
+
+            # least recently used first
+            entries = self._conn.execute(
+                " UNION ALL ".join(
+                    f"SELECT '{table}', key, size, accessed_at FROM \"{table}\""
+                    for table in tables
+                )
+                + " ORDER BY accessed_at"
+            )
+            excess = total - int(max_bytes * self.evict_to)
+            to_delete: Dict[str, List[str]] = {}
+            for table, key, size, _ in entries:
+                if excess <= 0:
+                    break
+                to_delete.setdefault(table, []).append(key)
+                excess -= size
+            for table, keys in to_delete.items():
+                self._conn.executemany(
+                    f'DELETE FROM "{table}" WHERE key = ?', [(key,) for key in keys]
+                )
+            self._commit()
+            evicted = sum(len(keys) for keys in to_delete.values())
+            print(f"Evicted {evicted} entries from {self.db_path}")
+
+    def _commit(self) -> None:
+        self._conn.commit()
+        self._pending = 0
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._pending:
+                self._commit()
+
+    def close(self) -> None:
+        with SqliteCacheBackend._instances_lock:
+            key = self.db_path.resolve()
+            if SqliteCacheBackend._instances.get(key) is self:
+                del SqliteCacheBackend._instances[key]
+        with self._lock:
+            try:
+                self._commit()
+                self._conn.close()
+            except sqlite3.ProgrammingError:
+                pass  # already closed
+
+
+class CacheStats:
+    """Counters of a MemoryCacheTier, used to measure the disk I/O it saves."""
+
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    writes: int = 0  # entries stored by wrapper calls
+    disk_writes: int = 0  # entries written back to the disk backend
+    evictions: int = 0
+
+    def disk_reads_avoided(self) -> int:
+        return self.memory_hits
+
+    def disk_writes_avoided(self) -> int:
+        """Writes that were coalesced, or are still pending."""
+        return self.writes - self.disk_writes
+
+    def __str__(self) -> str:
+        return (
+            f"{self.memory_hits} memory hits, {self.disk_hits} disk hits, "
+            f"{self.misses} misses, {self.disk_reads_avoided()} disk reads and "
+            f"{self.disk_writes_avoided()} disk writes avoided"
+        )
+
+
+CacheEntryKey = Tuple[str, str]
+
+
+def _write_back(
+    backend: CacheBackend,
+    dirty: Dict[CacheEntryKey, CacheEntry],
+    touched: Dict[CacheEntryKey, float],
+    lock: threading.RLock,
+    max_disk_bytes: Optional[int],
+) -> int:
+    with lock:
+        entries = list(dirty.items())
+        dirty.clear()
+        for (method, key), (value, expires_at) in entries:
+            backend.set(method, key, value, expires_at)
+
+        touched_by_method: Dict[str, List[str]] = {}
+        for method, key in touched:
+            touched_by_method.setdefault(method, []).append(key)
+        accessed_at = max(touched.values(), default=0.0)
+        touched.clear()
+        for method, keys in touched_by_method.items():
+            backend.touch(method, keys, accessed_at)
+
+        if max_disk_bytes is not None and entries:
+            backend.evict(max_disk_bytes)
+        backend.flush()
+        return len(entries)
+
+
+class MemoryCacheTier(CacheBackend):
+    """Bounded LRU cache in front of a disk backend.
+
+    Hits are served from memory. New entries and access times are kept in memory and
+    written back to the disk backend every `flush_interval` seconds, on `flush` and at
+    exit, instead of on every call. Entries are stored serialized, so callers can't
+    mutate them. After new entries are written back, the disk backend is evicted down
+    to `max_disk_bytes`."""
+
+    backend: CacheBackend
+    max_entries: int
+    max_bytes: int
+    max_disk_bytes: Optional[int]
+    flush_interval: float
+    stats: CacheStats
+
+    def __init__(
+        self,
+        backend: CacheBackend,
+        max_entries: int = 10_000,
+        max_bytes: int = 64 * 1024 * 1024,
+        flush_interval: float = 30.0,
+        max_disk_bytes: Optional[int] = None,
+    ) -> None:
+        self.backend = backend
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.flush_interval = flush_interval
+        self.stats = CacheStats()
+        self._lock = threading.RLock()
+        self._entries: "OrderedDict[CacheEntryKey, Tuple[str, Optional[float]]]" = (
+            OrderedDict()
+        )
+        self._size = 0
+        self._dirty: Dict[CacheEntryKey, CacheEntry] = {}
+        self._touched: Dict[CacheEntryKey, float] = {}
+        self._timer: Optional[threading.Timer] = None
+        # write back pending entries when the tier is collected or at exit
+        weakref.finalize(
+            self,
+            _write_back,
+            backend,
+            self._dirty,
+            self._touched,
+            self._lock,
+            max_disk_bytes,
+        )
+
+    def register_key_migration(self, method: str, migrate: KeyMigration) -> None:
+        self.backend.register_key_migration(method, migrate)
+
+    def _forget(self, entry_key: CacheEntryKey) -> None:
+        if entry_key in self._entries:
+            self._size -= len(self._entries.pop(entry_key)[0])
+
+    def _remember(
+        self, entry_key: CacheEntryKey, serialized: str, expires_at: Optional[float]
+    ) -> None:
+        self._forget(entry_key)
+        if len(serialized) > self.max_bytes:
+            return
+        self._entries[entry_key] = (serialized, expires_at)
+        self._size += len(serialized)
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.stats.evictions += 1
+
+    def _memory_entry(
+        self, entry_key: CacheEntryKey, now: float
+    ) -> Optional[CacheEntry]:
+        cached = self._entries.get(entry_key)
+        if cached is not None:
+            serialized, expires_at = cached
+            if is_expired(expires_at, now):
+                self._forget(entry_key)
+                return None
+            self._entries.move_to_end(entry_key)
+            return json.loads(serialized), expires_at
+
+        if entry_key in self._dirty:
+            # evicted before being written back
+            value, expires_at = self._dirty[entry_key]
+            if is_expired(expires_at, now):
+                return None
+            serialized = json.dumps(value)
+            self._remember(entry_key, serialized, expires_at)
+            return json.loads(serialized), expires_at
+        return None
+
+    def get_entry(self, method: str, key: str) -> CacheEntry:
+        entry_key = (method, key)
+        now = time.time()
+        with self._lock:
+            entry = self._memory_entry(entry_key, now)
+            if entry is not None:
+                self.stats.memory_hits += 1
+                self._touched[entry_key] = now
+                return entry
+
+        try:
+            value, expires_at = self.backend.get_entry(method, key)
+        except KeyError:
+            with self._lock:
+                self.stats.misses += 1
+            raise
+
+        with self._lock:
+            self.stats.disk_hits += 1
+            self._touched[entry_key] = now
+            self._remember(entry_key, json.dumps(value), expires_at)
+        return value, expires_at
+
+    def set(
+        self, method: str, key: str, value: Any, expires_at: Optional[float] = None
+    ) -> None:
+        serialized = json.dumps(value)
+        entry_key = (method, key)
+        with self._lock:
+            self._remember(entry_key, serialized, expires_at)
+            self._dirty[entry_key] = (json.loads(serialized), expires_at)
+            self._touched.pop(entry_key, None)
+            self.stats.writes += 1
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self.stats.disk_writes += _write_back(
+                self.backend,
+                self._dirty,
+                self._touched,
+                self._lock,
+                self.max_disk_bytes,
+            )
+
+    def close(self) -> None:
+        self.flush()
+        self.backend.close()
+
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time.
+    Callers arriving while a call is running wait for it and share its outcome."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, "Future[Any]"] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> Tuple[T, bool]:
+        """Returns the result of fn, and whether it was shared with another caller.
+        Exceptions raised by fn are raised in every waiting caller."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if future is None:
+                future = Future()
+                self._calls[key] = future
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
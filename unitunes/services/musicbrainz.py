@@ -1,11 +1,13 @@
+from datetime import timedelta
 from pathlib import Path
 from typing import Any, List, Optional
 import musicbrainzngs as mb
-from ratelimit import sleep_and_retry, limits
 
 
 import requests
+from unitunes.services.rate_limit import retry_after_seconds
 from unitunes.services.services import (
+    ServiceConfig,
     ServiceWrapper,
     StreamingService,
     cache,
@@ -15,16 +17,33 @@ from unitunes.types import ServiceType
 from unitunes.uri import MB_RECORDING_URI
 
 
+def no_recordings_found(results: dict) -> bool:
+    return not results["recording-list"]
+
+
 class MusicBrainzWrapper(ServiceWrapper):
+    # MusicBrainz allows one request per second, and answers 503 when exceeded
+    requests_per_second = 1.0
+    max_requests_per_second = 1.0
+
     def __init__(self, cache_root: Path) -> None:
         super().__init__("musicbrainz", cache_root)
         mb.set_useragent("unitunes", "0.1")
 
-    @sleep_and_retry
-    @limits(calls=1, period=1)
+    def throttle_delay(self, error: Exception) -> Optional[float]:
+        if isinstance(error, requests.HTTPError) and error.response is not None:
+            if error.response.status_code == 503:
+                return retry_after_seconds(error.response.headers.get("Retry-After"))
+        if isinstance(error, mb.ResponseError):
+            if getattr(error.cause, "code", None) == 503:
+                return 0
+        return None
+
     def query_mb_api(self, query: str, params):
         headers = {"User-Agent": "unitunes"}
         r = requests.get(query, params=params, headers=headers)
+        if r.status_code == 503:
+            r.raise_for_status()
         if r.status_code != 200:
             raise Exception(f"MusicBrainz API returned {r.status_code}")
         if "error" in r.json():
@@ -42,24 +61,46 @@ class MusicBrainzWrapper(ServiceWrapper):
             f"http://musicbrainz.org/ws/2/recording/{id}", params=params
         )
 
-    @cache
-    def search_recordings(self, *args, use_cache=True, **kwargs):
-        return mb.search_recordings(*args, **kwargs)
+    @cache(
+        ttl=timedelta(days=7),
+        negative_ttl=timedelta(days=1),
+        is_negative=no_recordings_found,
+    )
+    def search_recordings(
+        self, query="", limit=None, offset=None, strict=False, use_cache=True, **fields
+    ):
+        return mb.search_recordings(
+            query, limit=limit, offset=offset, strict=strict, **fields
+        )
 
     @cache
-    def get_release_by_id(self, *args, use_cache=True, **kwargs):
-        return mb.get_release_by_id(*args, **kwargs)
+    def get_release_by_id(
+        self, id: str, includes=[], release_status=[], release_type=[], use_cache=True
+    ):
+        return mb.get_release_by_id(
+            id,
+            includes=includes,
+            release_status=release_status,
+            release_type=release_type,
+        )
+
+
+class MusicBrainzConfig(ServiceConfig):
+    pass
 
 
 class MusicBrainz(StreamingService):
     wrapper: MusicBrainzWrapper
 
-    def __init__(self, cache_root: Path) -> None:
+    def __init__(
+        self, cache_root: Path, config: Optional[MusicBrainzConfig] = None
+    ) -> None:
         super().__init__("MusicBrainz", ServiceType.MB, cache_root)
         self.wrapper = MusicBrainzWrapper(cache_root)
+        self.load_config(config or MusicBrainzConfig())
 
-    def load_config(self, config) -> None:
-        pass
+    def load_config(self, config: MusicBrainzConfig) -> None:
+        self.apply_limits(config)
 
     @staticmethod
     def parse_track(recording):
@@ -136,6 +177,12 @@ class MusicBrainz(StreamingService):
 
         return list(map(self.parse_track, results["recording-list"]))
 
+    def query_template(self, query: Any) -> str:
+        dropped = [
+            field for field in ["recording", "artist", "release"] if field not in query
+        ]
+        return f"drop {' and '.join(dropped)}" if dropped else "full"
+
     def query_generator(self, track: Track) -> List[Any]:
         def escape_special_chars(s: str) -> str:
             # + - && || ! ( ) { } [ ] ^ " ~ * ? : \
@@ -0,0 +1,157 @@
+import random
+import threading
+import time
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class RateLimiter:
+    """
+    Token bucket allowing rate calls per second on average, in bursts of up to burst
+    calls. A rate of None doesn't limit. Thread safe: concurrent callers reserve
+    consecutive slots and wait for them outside the lock.
+    """
+
+    rate: Optional[float]
+    burst: float
+    _tokens: float
+    _last: float
+    _paused_until: float
+    _lock: threading.Lock
+    _clock: Callable[[], float]
+    _sleep: Callable[[float], None]
+    _jitter: Callable[[], float]
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        burst: float = 1,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        jitter: Callable[[], float] = random.random,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._jitter = jitter
+        self._last = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Waits until a call is allowed."""
+        with self._lock:
+            pause = self._paused_until - self._clock()
+        if pause > 0:
+            # callers held by the same pause resume spread over a quarter of it on
+            # average, so they don't all hit the service at once
+            self._sleep(pause * (1 + self._jitter() / 2))
+        if self.rate is None:
+            return
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            # a negative balance reserves the slots of earlier waiting callers
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            self._sleep(wait)
+
+    def succeeded(self) -> None:
+        """Called after a call went through."""
+
+    def throttled(self, delay: float) -> None:
+        """Called when the service throttled a call. Holds all calls for delay
+        seconds, plus jitter."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + delay)
+
+    def call(
+        self,
+        request: Callable[[], T],
+        throttle_delay: Callable[[Exception], Optional[float]],
+        retries: int = 5,
+    ) -> T:
+        """
+        Makes a request once allowed. If it fails with an error throttle_delay
+        returns a delay for, the request is retried after the longer of that delay
+        and an exponential backoff.
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                result = request()
+            except Exception as e:
+                delay = throttle_delay(e)
+                if delay is None or attempt == retries:
+                    raise
+                self.throttled(max(delay, 2**attempt))
+                attempt += 1
+                continue
+            self.succeeded()
+            return result
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    Rate limiter that finds the rate a service allows. The rate grows additively,
+    by increase calls per second for each second of calls, up to max_rate, and is
+    multiplied by decrease when the service throttles a call, down to min_rate.
+    """
+
+    min_rate: float
+    max_rate: float
+    increase: float
+    decrease: float
+    rate: float
+
+    def __init__(
+        self,
+        rate: float,
+        max_rate: float,
+        min_rate: float = 0.1,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        burst: float = 1,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        jitter: Callable[[], float] = random.random,
+    ) -> None:
+        super().__init__(rate, burst, clock, sleep, jitter)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+
+    def succeeded(self) -> None:
+        with self._lock:
+            # each call takes 1 / rate seconds at full speed
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def throttled(self, delay: float) -> None:
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+        super().throttled(delay)
+
+
+def rate_limiter(rate: Optional[float], max_rate: Optional[float]) -> RateLimiter:
+    """A limiter adapting between rate and max_rate, or fixed at rate if there is no
+    max_rate. No rate starts at max_rate."""
+    if max_rate is None:
+        return RateLimiter(rate)
+    return AdaptiveRateLimiter(rate if rate is not None else max_rate, max_rate)
+
+
+def retry_after_seconds(value: Optional[str]) -> float:
+    """Parses a Retry-After header in seconds, 0 if missing or a date."""
+    try:
+        return max(0.0, float(value)) if value is not None else 0.0
+    except ValueError:
+        return 0.0
@@ -1,63 +1,196 @@
 from abc import ABC, abstractmethod
+from datetime import timedelta
+from functools import wraps
+import inspect
 import json
 from pathlib import Path
+import time
 from typing import (
     Any,
+    Callable,
     List,
     NewType,
+    Optional,
     Protocol,
+    TypeVar,
     runtime_checkable,
 )
 
 from pydantic import BaseModel
 from unitunes.playlist import PlaylistDetails, PlaylistMetadata
+from unitunes.services.cache import (
+    CacheBackend,
+    CachePolicy,
+    CacheStats,
+    MemoryCacheTier,
+    SingleFlight,
+    SqliteCacheBackend,
+    canonical_key,
+    is_empty,
+    legacy_key_migration,
+)
+from unitunes.services.rate_limit import RateLimiter, rate_limiter
 from unitunes.track import Track
 
 from unitunes.types import ServiceType
 from unitunes.uri import PlaylistURI, PlaylistURIs, TrackURI, TrackURIs
 
-
-class ServiceConfig(ABC, BaseModel):
-    pass
+T = TypeVar("T")
 
 
-def cache(method):
-    def wrapper(self, *args, use_cache=True, **kwargs):
-        file_path = self.cache_path / f"{method.__name__}.json"
-        if use_cache and file_path.exists():
-            with file_path.open("r") as f:
+class ServiceConfig(ABC, BaseModel):
+    # tracks searched at once by search_playlist
+    search_concurrency: int = 4
+    # queries of one track's search in flight at once. None for 2, or 1 if the
+    # service allows at most one request per second
+    parallel_queries: Optional[int] = None
+    # requests per second made to the service. With a max, the rate starts here and
+    # adapts to the service's throttling. None for the service's defaults
+    requests_per_second: Optional[float] = None
+    max_requests_per_second: Optional[float] = None
+
+
+def cache(
+    method=None,
+    *,
+    ttl: Optional[timedelta] = None,
+    negative_ttl: Optional[timedelta] = None,
+    is_negative: Callable[[Any], bool] = is_empty,
+):
+    """Caches the JSON serializable result of a ServiceWrapper method in its cache backend.
+    Pass use_cache=False to bypass the lookup and refresh the entry.
+
+    Use as @cache or @cache(ttl=..., negative_ttl=..., is_negative=...).
+    Results expire after ttl, or negative_ttl if is_negative(result) (by default,
+    falsy results). Entries without a ttl are kept until evicted.
+
+    Keys are a hash of the call's arguments bound to the method's signature, so declare
+    the parameters explicitly rather than forwarding *args, **kwargs.
+
+    Misses are single-flight: concurrent calls with the same arguments make one
+    request and share its result. They go through the wrapper's rate limiter."""
+
+    policy = CachePolicy(ttl, negative_ttl, is_negative)
+
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @wraps(method)
+        def wrapper(self, *args, use_cache=True, **kwargs):
+            method_name = method.__name__
+            cache_key = canonical_key(signature, args, kwargs)
+
+            def lookup() -> Any:
+                return self.cache_backend.get(method_name, cache_key)
+
+            def fetch() -> Any:
+                if use_cache:
+                    # another call may have filled the entry since our lookup
+                    try:
+                        return lookup()
+                    except KeyError:
+                        pass
+                result = self.call(method, self, *args, **kwargs)
+                self.cache_backend.set(
+                    method_name,
+                    cache_key,
+                    result,
+                    policy.expires_at(result, time.time()),
+                )
+                return result
+
+            if use_cache:
                 try:
-                    d = json.load(f)
-                except json.JSONDecodeError:
-                    d = {}
-        else:
-            d = {}
-
-        cache_key = f"{args}_{kwargs}"
-        if use_cache and cache_key in d:
-            return d[cache_key]
-        result = method(self, *args, **kwargs)
-        d[cache_key] = method(self, *args, **kwargs)
+                    return lookup()
+                except KeyError:
+                    pass
 
-        with file_path.open("w") as f:
-            json.dump(d, f, indent=4)
+            result, shared = self.inflight.do((method_name, cache_key), fetch)
+            if shared:
+                # give each caller its own copy
+                return json.loads(json.dumps(result))
+            return result
 
-        return result
+        wrapper.key_migration = legacy_key_migration(signature)  # type: ignore
+        return wrapper
 
-    return wrapper
+    if method is not None:
+        return decorator(method)
+    return decorator
 
 
 class ServiceWrapper:
     cache_path: Path
     cache_name: str
-
-    def __init__(self, cache_name: str, cache_root: Path) -> None:
+    cache_backend: MemoryCacheTier
+    inflight: SingleFlight
+    rate_limiter: RateLimiter
+
+    # budget of the in-memory cache tier
+    memory_cache_entries: int = 10_000
+    memory_cache_bytes: int = 64 * 1024 * 1024
+    # seconds between write-backs of new cache entries to disk
+    cache_flush_interval: float = 30.0
+    # least recently used entries are evicted once the disk cache exceeds this
+    max_disk_cache_bytes: Optional[int] = 512 * 1024 * 1024
+    # default rate limits, see ServiceConfig
+    requests_per_second: Optional[float] = None
+    max_requests_per_second: Optional[float] = None
+
+    def __init__(
+        self,
+        cache_name: str,
+        cache_root: Path,
+        cache_backend: Optional[CacheBackend] = None,
+    ) -> None:
         self.cache_name = cache_name
         self.cache_path = cache_root / cache_name
         if not cache_root.exists():
             cache_root.mkdir()
         if not self.cache_path.exists():
             self.cache_path.mkdir()
+        disk_backend = (
+            cache_backend
+            if cache_backend is not None
+            else SqliteCacheBackend.open(self.cache_path / "cache.sqlite3")
+        )
+        for name, attr in inspect.getmembers(type(self)):
+            if hasattr(attr, "key_migration"):
+                disk_backend.register_key_migration(name, attr.key_migration)
+        self.cache_backend = MemoryCacheTier(
+            disk_backend,
+            max_entries=self.memory_cache_entries,
+            max_bytes=self.memory_cache_bytes,
+            flush_interval=self.cache_flush_interval,
+            max_disk_bytes=self.max_disk_cache_bytes,
+        )
+        self.inflight = SingleFlight()
+        self.rate_limiter = rate_limiter(
+            self.requests_per_second, self.max_requests_per_second
+        )
+
+    def call(self, request: Callable[..., T], *args, **kwargs) -> T:
+        """Makes an uncached request through the rate limiter, retrying it if the
+        service throttled it. Cached methods already do."""
+        return self.rate_limiter.call(
+            lambda: request(*args, **kwargs), self.throttle_delay
+        )
+
+    def request_report(self) -> str:
+        """Per endpoint request statistics, empty if the wrapper doesn't keep any."""
+        return ""
+
+    def throttle_delay(self, error: Exception) -> Optional[float]:
+        """Seconds to wait before retrying if error means the service throttled us,
+        0 if it doesn't say. None for other errors."""
+        return None
+
+    def flush_cache(self) -> None:
+        """Writes new cache entries back to disk."""
+        self.cache_backend.flush()
+
+    def cache_stats(self) -> CacheStats:
+        return self.cache_backend.stats
 
 
 @runtime_checkable
@@ -78,6 +211,14 @@ class PlaylistPullable(Protocol):
         """Gets metadata from a playlist"""
 
 
+@runtime_checkable
+class PlaylistVersioned(Protocol):
+    @abstractmethod
+    def playlist_version(self, uri: PlaylistURI) -> Optional[str]:
+        """Returns a cheap token that changes whenever the playlist changes.
+        None if the version can't be determined."""
+
+
 @runtime_checkable
 class TrackPullable(Protocol):
     @abstractmethod
@@ -97,6 +238,14 @@ class Searchable(Protocol):
         Sorted from most precise to least precise."""
 
 
+@runtime_checkable
+class QueryTemplated(Protocol):
+    @abstractmethod
+    def query_template(self, query: Any) -> str:
+        """Names the template a query from query_generator was made with, so query
+        statistics can be kept per template."""
+
+
 @runtime_checkable
 class Pushable(PlaylistPullable, Protocol):
     @abstractmethod
@@ -118,6 +267,24 @@ class Pushable(PlaylistPullable, Protocol):
         """Updates the metadata of a playlist"""
 
 
+@runtime_checkable
+class Replaceable(Protocol):
+    @abstractmethod
+    def replace_tracks(self, playlist_uri: PlaylistURI, tracks: List[Track]) -> None:
+        """Replaces the tracks of a playlist with tracks, in their order"""
+
+    @abstractmethod
+    def replace_calls(self, playlist_uri: PlaylistURI, tracks: int) -> Optional[int]:
+        """Estimated API calls replace_tracks makes for this many tracks. None if
+        the playlist can't be replaced."""
+
+    @abstractmethod
+    def skipped_items(self, playlist_uri: PlaylistURI) -> Optional[int]:
+        """Items the last pull_tracks of the playlist left out because they aren't
+        tracks, such as local files. A replace would delete them. None if the
+        playlist wasn't pulled."""
+
+
 @runtime_checkable
 class Checkable(Protocol):
     @abstractmethod
@@ -132,6 +299,11 @@ class StreamingService(ABC):
     config: ServiceConfig
     cache_root: Path
 
+    # tracks searched at once by search_playlist
+    search_concurrency: int = 1
+    # queries of one track's search in flight at once
+    parallel_queries: int = 1
+
     def __init__(self, name: str, type: ServiceType, cache_root: Path) -> None:
         self.name = name
         self.type = type
@@ -140,3 +312,33 @@ class StreamingService(ABC):
     @abstractmethod
     def load_config(self, config: ServiceConfig) -> None:
         """Loads the config for the service"""
+
+    def add_calls(self, playlist_uri: PlaylistURI, tracks: int) -> int:
+        """Estimated API calls add_tracks makes for this many tracks."""
+        return 1 if tracks else 0
+
+    def remove_calls(self, playlist_uri: PlaylistURI, tracks: int) -> int:
+        """Estimated API calls remove_tracks makes for this many tracks."""
+        return 1 if tracks else 0
+
+    def metadata_editable(self, playlist_uri: PlaylistURI) -> bool:
+        """Whether update_metadata can change the playlist's name and description."""
+        return True
+
+    def apply_limits(self, config: ServiceConfig) -> None:
+        """Applies the concurrency and rate budget of a config. Call after creating
+        the wrapper."""
+        self.search_concurrency = config.search_concurrency
+        rate = config.requests_per_second
+        if rate is None:
+            rate = self.wrapper.requests_per_second
+        max_rate = config.max_requests_per_second
+        if max_rate is None:
+            max_rate = self.wrapper.max_requests_per_second
+        self.wrapper.rate_limiter = rate_limiter(rate, max_rate)
+        if config.parallel_queries is not None:
+            self.parallel_queries = config.parallel_queries
+        else:
+            # speculative queries would only queue behind a slow limiter
+            fastest = max_rate if max_rate is not None else rate
+            self.parallel_queries = 1 if fastest is not None and fastest <= 1 else 2
@@ -1,8 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import math
 from pathlib import Path
-from typing import List
+from typing import Callable, Dict, List, Optional
 import spotipy
 from spotipy import SpotifyOAuth
 from unitunes.playlist import PlaylistDetails, PlaylistMetadata
+from unitunes.services.rate_limit import retry_after_seconds
+from unitunes.services.spotify_session import SpotifySession
 
 from unitunes.services.services import (
     ServiceConfig,
@@ -19,95 +24,179 @@ from unitunes.uri import (
 )
 
 
+# max tracks per request when changing a playlist, and the liked songs
+PLAYLIST_CHUNK_SIZE = 100
+SAVED_TRACKS_CHUNK_SIZE = 50
+
+
 class SpotifyConfig(ServiceConfig):
     client_id: str = ""
     client_secret: str = ""
     redirect_uri: str = ""
+    # max concurrent requests when fetching the pages of a playlist
+    page_concurrency: int = 4
+
+
+def fetch_all_pages(
+    get_page: Callable[[int, int], dict], page_size: int, max_workers: int = 1
+) -> List[dict]:
+    """Returns the items of a paged endpoint. get_page(limit, offset) returns a paging
+    object. The pages after the first are fetched concurrently, based on its total."""
+    first = get_page(page_size, 0)
+    offsets = range(page_size, first["total"], page_size)
+    if max_workers <= 1 or len(offsets) <= 1:
+        pages = [get_page(page_size, offset) for offset in offsets]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pages = list(
+                executor.map(lambda offset: get_page(page_size, offset), offsets)
+            )
+
+    items = list(first["items"])
+    for page in pages:
+        items.extend(page["items"])
+    return items
+
+
+def no_tracks_found(results: dict) -> bool:
+    return not results["tracks"]["items"]
 
 
 class SpotifyAPIWrapper(ServiceWrapper):
+    session: SpotifySession
+    _user_id: Optional[str]
+
     def __init__(self, config: SpotifyConfig, cache_root) -> None:
         super().__init__("spotify", cache_root=cache_root)
         self.init_config(config)
 
+    def throttle_delay(self, error: Exception) -> Optional[float]:
+        if isinstance(error, spotipy.SpotifyException) and error.http_status == 429:
+            headers = error.headers or {}
+            return retry_after_seconds(headers.get("Retry-After"))
+        return None
+
     def init_config(self, config: SpotifyConfig) -> None:
+        self.session = SpotifySession()
+        self._user_id = None
         self.sp = spotipy.Spotify(
+            requests_session=self.session,
             auth_manager=SpotifyOAuth(
                 client_id=config.client_id,
                 client_secret=config.client_secret,
                 redirect_uri=config.redirect_uri,
                 scope="user-library-read playlist-modify-private, playlist-modify-public, user-library-modify playlist-read-private",
-            )
+            ),
         )
 
-    @cache
-    def track(self, *args, use_cache=True, **kwargs):
-        return self.sp.track(*args, **kwargs)
+    def user_id(self) -> str:
+        """The current user's id, fetched once."""
+        if self._user_id is None:
+            self._user_id = self.call(self.sp.me)["id"]
+        return self._user_id
+
+    def request_report(self) -> str:
+        return self.session.report()
 
     @cache
-    def album_tracks(self, *args, use_cache=True, **kwargs):
-        return self.sp.album_tracks(*args, **kwargs)
+    def track(self, track_id: str, market=None, use_cache=True):
+        return self.sp.track(track_id, market=market)
 
     @cache
-    def search(self, *args, use_cache=True, **kwargs):
+    def album_tracks(
+        self, album_id: str, limit=50, offset=0, market=None, use_cache=True
+    ):
+        return self.sp.album_tracks(album_id, limit=limit, offset=offset, market=market)
+
+    @cache(
+        ttl=timedelta(days=7),
+        negative_ttl=timedelta(days=1),
+        is_negative=no_tracks_found,
+    )
+    def search(
+        self, q: str, limit=10, offset=0, type="track", market=None, use_cache=True
+    ):
         # Query length must be less than or equal to 100 characters, otherwise 404 is returned
-        return self.sp.search(*args, **kwargs)
+        return self.sp.search(q, limit=limit, offset=offset, type=type, market=market)
 
     def create_playlist(self, title: str, description: str = "") -> str:
-        id = self.sp.user_playlist_create(self.sp.me()["id"], title, public=False)["id"]
+        id = self.call(
+            self.sp.user_playlist_create, self.user_id(), title, public=False
+        )["id"]
         assert isinstance(id, str)
         return id
 
     def add_tracks(self, playlist_id: str, tracks: List[str]) -> None:
-        chunk_size = 100
+        chunk_size = PLAYLIST_CHUNK_SIZE
         chunks = [tracks[i : i + chunk_size] for i in range(0, len(tracks), chunk_size)]
         for chunk in chunks:
-            self.sp.user_playlist_add_tracks(self.sp.me()["id"], playlist_id, chunk)
+            self.call(
+                self.sp.user_playlist_add_tracks, self.user_id(), playlist_id, chunk
+            )
 
     def remove_tracks(self, playlist_id: str, tracks: List[str]) -> None:
-        self.sp.user_playlist_remove_all_occurrences_of_tracks(
-            self.sp.me()["id"], playlist_id, tracks
+        chunk_size = PLAYLIST_CHUNK_SIZE
+        chunks = [tracks[i : i + chunk_size] for i in range(0, len(tracks), chunk_size)]
+        for chunk in chunks:
+            self.call(
+                self.sp.user_playlist_remove_all_occurrences_of_tracks,
+                self.user_id(),
+                playlist_id,
+                chunk,
+            )
+
+    def replace_tracks(self, playlist_id: str, tracks: List[str]) -> None:
+        # a replace takes at most one chunk, the rest is appended
+        self.call(
+            self.sp.user_playlist_replace_tracks,
+            self.user_id(),
+            playlist_id,
+            tracks[:PLAYLIST_CHUNK_SIZE],
         )
+        self.add_tracks(playlist_id, tracks[PLAYLIST_CHUNK_SIZE:])
 
     def current_user_playlists(self, *args, **kwargs):
-        return self.sp.current_user_playlists(*args, **kwargs)
+        return self.call(self.sp.current_user_playlists, *args, **kwargs)
 
     def user_playlist_replace_tracks(self, *args, **kwargs):
-        return self.sp.user_playlist_replace_tracks(*args, **kwargs)
+        return self.call(self.sp.user_playlist_replace_tracks, *args, **kwargs)
 
     def playlist_tracks(self, *args, **kwargs):
-        return self.sp.playlist_items(*args, **kwargs)
+        return self.call(self.sp.playlist_items, *args, **kwargs)
 
     def playlist_metadata(self, playlist_id: str) -> PlaylistDetails:
         if playlist_id == "Liked Songs":
             # Liked songs has no metadata
             return PlaylistDetails(name="Liked Songs", description="")
 
-        res = self.sp.playlist(playlist_id, fields="name,description")
+        res = self.call(self.sp.playlist, playlist_id, fields="name,description")
         return PlaylistDetails(name=res["name"], description=res["description"])
 
+    def playlist_snapshot_id(self, playlist_id: str) -> str:
+        return self.call(self.sp.playlist, playlist_id, fields="snapshot_id")[
+            "snapshot_id"
+        ]
+
     def current_user(self, *args, **kwargs):
-        return self.sp.current_user(*args, **kwargs)
+        return self.call(self.sp.current_user, *args, **kwargs)
 
     def user_playlist_create(self, *args, **kwargs):
-        return self.sp.user_playlist_create(*args, **kwargs)
+        return self.call(self.sp.user_playlist_create, *args, **kwargs)
 
     def current_user_saved_tracks(self, limit: int = 20, offset: int = 0):
-        return self.sp.current_user_saved_tracks(limit=limit, offset=offset)
+        return self.call(self.sp.current_user_saved_tracks, limit=limit, offset=offset)
 
     def current_user_saved_tracks_add(self, tracks: List[str]):
-        # max 50 tracks per request
-        chunk_size = 50
+        chunk_size = SAVED_TRACKS_CHUNK_SIZE
         chunks = [tracks[i : i + chunk_size] for i in range(0, len(tracks), chunk_size)]
         for chunk in chunks:
-            self.sp.current_user_saved_tracks_add(chunk)
+            self.call(self.sp.current_user_saved_tracks_add, chunk)
 
     def current_user_saved_tracks_delete(self, tracks: List[str]):
-        # max 50 tracks per request
-        chunk_size = 50
+        chunk_size = SAVED_TRACKS_CHUNK_SIZE
         chunks = [tracks[i : i + chunk_size] for i in range(0, len(tracks), chunk_size)]
         for chunk in chunks:
-            self.sp.current_user_saved_tracks_delete(chunk)
+            self.call(self.sp.current_user_saved_tracks_delete, chunk)
 
     def change_details(self, playlist_id: str, title: str, description: str):
         if playlist_id == "Liked Songs":
@@ -115,29 +204,46 @@ class SpotifyAPIWrapper(ServiceWrapper):
             return
 
         if not description:
-            self.sp.user_playlist_change_details(
-                self.sp.me()["id"], playlist_id, name=title
+            self.call(
+                self.sp.user_playlist_change_details,
+                self.user_id(),
+                playlist_id,
+                name=title,
             )
         else:
-            self.sp.user_playlist_change_details(
-                self.sp.me()["id"], playlist_id, name=title, description=description
+            self.call(
+                self.sp.user_playlist_change_details,
+                self.user_id(),
+                playlist_id,
+                name=title,
+                description=description,
             )
 
 
 class SpotifyService(StreamingService):
     wrapper: SpotifyAPIWrapper
     config: SpotifyConfig
+    # playlist id -> items its last pull left out
+    _skipped: Dict[str, int]
 
     def __init__(self, name: str, config: SpotifyConfig, cache_root: Path) -> None:
         super().__init__(name, ServiceType.SPOTIFY, cache_root)
+        self._skipped = {}
         self.load_config(config)
 
     def load_config(self, config: SpotifyConfig) -> None:
         self.config = config
         self.wrapper = SpotifyAPIWrapper(config, self.cache_root)
+        self.apply_limits(config)
 
     def get_playlist_metadatas(self) -> list[PlaylistMetadata]:
-        results = self.wrapper.current_user_playlists()
+        playlists = fetch_all_pages(
+            lambda limit, offset: self.wrapper.current_user_playlists(
+                limit=limit, offset=offset
+            ),
+            page_size=50,
+            max_workers=self.config.page_concurrency,
+        )
 
         return [
             PlaylistMetadata(
@@ -145,7 +251,7 @@ class SpotifyService(StreamingService):
                 description=playlist["description"],
                 uri=SpotifyPlaylistURI.from_url(playlist["external_urls"]["spotify"]),
             )
-            for playlist in results["items"]
+            for playlist in playlists
         ] + [
             PlaylistMetadata(
                 name="Liked Songs",
@@ -155,35 +261,27 @@ class SpotifyService(StreamingService):
         ]
 
     def pull_tracks(self, uri: SpotifyPlaylistURI) -> List[Track]:
-        # query spotify until we get all tracks
-
-        def get_playlist_tracks(offset: int) -> list[Track]:
-            results = self.wrapper.playlist_tracks(
+        def get_playlist_tracks(limit: int, offset: int) -> dict:
+            return self.wrapper.playlist_tracks(
                 playlist_id=uri.uri,
-                fields="items(track(name,artists(name),album,duration_ms,id,external_urls))",
+                fields="total,items(track(name,artists(name),album,duration_ms,id,external_urls))",
+                limit=limit,
                 offset=offset,
             )
-            return [self.raw_to_track(track["track"]) for track in results["items"]]
-
-        def get_liked_tracks(offset: int) -> list[Track]:
-            results = self.wrapper.current_user_saved_tracks(limit=50, offset=offset)
-            return [self.raw_to_track(track["track"]) for track in results["items"]]
-
-        tracks = []
-        offset = 0
-        while True:
-            new_tracks = (
-                get_liked_tracks(offset)
-                if uri.is_liked_songs()
-                else get_playlist_tracks(offset)
-            )
-            if not new_tracks:
-                break
-            tracks.extend(new_tracks)
-            offset += len(new_tracks)
+
+        def get_liked_tracks(limit: int, offset: int) -> dict:
+            return self.wrapper.current_user_saved_tracks(limit=limit, offset=offset)
+
+        items = (
+            fetch_all_pages(get_liked_tracks, 50, self.config.page_concurrency)
+            if uri.is_liked_songs()
+            else fetch_all_pages(get_playlist_tracks, 100, self.config.page_concurrency)
+        )
+        tracks = [self.raw_to_track(item["track"]) for item in items]
 
         # filter out tracks withouth uris
         tracks = [track for track in tracks if track.uris]
+        self._skipped[uri.uri] = len(items) - len(tracks)
         return tracks
 
     def get_tracks_in_album(self, album_uri: AlbumURI) -> List[Track]:
@@ -201,6 +299,18 @@ class SpotifyService(StreamingService):
     def pull_metadata(self, uri: SpotifyPlaylistURI) -> PlaylistDetails:
         return self.wrapper.playlist_metadata(uri.uri)
 
+    def playlist_version(self, uri: SpotifyPlaylistURI) -> Optional[str]:
+        if not uri.is_liked_songs():
+            return self.wrapper.playlist_snapshot_id(uri.uri)
+
+        # Liked songs has no snapshot id. Saving a track puts it first and removing
+        # one changes the total.
+        results = self.wrapper.current_user_saved_tracks(limit=1)
+        if not results["items"]:
+            return "0"
+        latest = results["items"][0]
+        return f"{results['total']}:{latest['added_at']}:{latest['track']['id']}"
+
     def raw_to_track(self, raw: dict) -> Track:
         return Track(
             name=AliasedString(value=raw["name"]),
@@ -236,7 +346,7 @@ class SpotifyService(StreamingService):
 
     def create_playlist(self, name: str, description: str = "") -> SpotifyPlaylistURI:
         playlist = self.wrapper.user_playlist_create(
-            self.wrapper.current_user()["id"],
+            self.wrapper.user_id(),
             name,
             public=False,
             description=description,
@@ -270,6 +380,42 @@ class SpotifyService(StreamingService):
         else:
             self.wrapper.remove_tracks(playlist_uri.uri, track_ids)
 
+    def replace_tracks(
+        self, playlist_uri: SpotifyPlaylistURI, tracks: List[Track]
+    ) -> None:
+        assert not playlist_uri.is_liked_songs()
+        track_ids = []
+        for track in tracks:
+            uri = track.find_uri(self.type)
+            assert uri
+            track_ids.append(uri.uri)
+        self.wrapper.replace_tracks(playlist_uri.uri, track_ids)
+
+    def chunk_size(self, playlist_uri: SpotifyPlaylistURI) -> int:
+        if playlist_uri.is_liked_songs():
+            return SAVED_TRACKS_CHUNK_SIZE
+        return PLAYLIST_CHUNK_SIZE
+
+    def add_calls(self, playlist_uri: SpotifyPlaylistURI, tracks: int) -> int:
+        return math.ceil(tracks / self.chunk_size(playlist_uri))
+
+    def remove_calls(self, playlist_uri: SpotifyPlaylistURI, tracks: int) -> int:
+        return math.ceil(tracks / self.chunk_size(playlist_uri))
+
+    def metadata_editable(self, playlist_uri: SpotifyPlaylistURI) -> bool:
+        # Liked songs has no metadata
+        return not playlist_uri.is_liked_songs()
+
+    def replace_calls(
+        self, playlist_uri: SpotifyPlaylistURI, tracks: int
+    ) -> Optional[int]:
+        if playlist_uri.is_liked_songs():
+            return None
+        return max(1, math.ceil(tracks / PLAYLIST_CHUNK_SIZE))
+
+    def skipped_items(self, playlist_uri: SpotifyPlaylistURI) -> Optional[int]:
+        return self._skipped.get(playlist_uri.uri)
+
     def update_metadata(
         self, playlist_uri: SpotifyPlaylistURI, metadata: PlaylistDetails
     ) -> None:
@@ -0,0 +1,107 @@
+import random
+import threading
+import time
+from typing import Callable, Dict
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# path segments followed by an id, which endpoint names replace with {id}
+ID_COLLECTIONS = {"albums", "artists", "playlists", "tracks", "users"}
+# segments after a collection that aren't ids
+ID_EXCEPTIONS = {"contains"}
+# server errors retried by the session. 429 is left to the wrapper's rate limiter
+RETRY_STATUSES = {500, 502, 503, 504}
+# methods safe to repeat after a server error, which may come after the change was
+# made. Repeating a POST adding tracks would add them twice
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+def endpoint_name(method: str, url: str) -> str:
+    """Names the endpoint of a request, e.g. GET /v1/playlists/{id}/tracks."""
+    segments = urlparse(url).path.split("/")
+    for i in range(1, len(segments)):
+        if segments[i - 1] in ID_COLLECTIONS and segments[i] not in ID_EXCEPTIONS:
+            segments[i] = "{id}"
+    return f"{method.upper()} {'/'.join(segments)}"
+
+
+class EndpointStats:
+    calls: int = 0
+    throttled: int = 0  # calls answered with 429
+    seconds: float = 0.0
+
+    def __str__(self) -> str:
+        mean = self.seconds / self.calls * 1000 if self.calls else 0
+        return f"{self.calls} calls, {self.throttled} throttled, {mean:.0f} ms mean"
+
+
+class SpotifySession(requests.Session):
+    """
+    HTTP session for spotipy, sharing a connection pool between the threads of a
+    wrapper. Server errors of idempotent requests are retried after an exponential
+    backoff, plus jitter so concurrent callers don't retry at once. Throttled
+    requests are returned as is, so spotipy raises and the wrapper's rate limiter
+    backs off and retries them.
+    Counts calls and their latency per endpoint.
+    """
+
+    retries: int
+    backoff: float
+    stats: Dict[str, EndpointStats]
+    _sleep: Callable[[float], None]
+    _jitter: Callable[[], float]
+    _lock: threading.Lock
+
+    def __init__(
+        self,
+        pool_size: int = 32,
+        retries: int = 3,
+        backoff: float = 0.5,
+        sleep: Callable[[float], None] = time.sleep,
+        jitter: Callable[[], float] = random.random,
+    ) -> None:
+        super().__init__()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.retries = retries
+        self.backoff = backoff
+        self.stats = {}
+        self._sleep = sleep
+        self._jitter = jitter
+        self._lock = threading.Lock()
+
+    def request(self, method, url, *args, **kwargs) -> requests.Response:  # type: ignore[override]
+        endpoint = endpoint_name(method, url)
+        retries = self.retries if method.upper() in IDEMPOTENT_METHODS else 0
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            response = super().request(method, url, *args, **kwargs)
+            self.record(endpoint, response, time.perf_counter() - start)
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+
+            delay = self.backoff * 2**attempt
+            self._sleep(delay * (1 + self._jitter() / 2))
+            attempt += 1
+
+    def record(
+        self, endpoint: str, response: requests.Response, seconds: float
+    ) -> None:
+        with self._lock:
+            stats = self.stats.setdefault(endpoint, EndpointStats())
+            stats.calls += 1
+            stats.throttled += response.status_code == 429
+            stats.seconds += seconds
+
+    def report(self) -> str:
+        with self._lock:
+            return "\n".join(
+                f"{endpoint}: {stats}"
+                for endpoint, stats in sorted(
+                    self.stats.items(), key=lambda item: -item[1].calls
+                )
+            )
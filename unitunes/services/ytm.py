@@ -1,6 +1,7 @@
+from datetime import timedelta
 from pathlib import Path
-import time
-from typing import List, Optional
+import threading
+from typing import Dict, List, Optional
 from tqdm import tqdm
 from ytmusicapi import YTMusic
 from unitunes.playlist import PlaylistDetails, PlaylistMetadata
@@ -31,7 +32,83 @@ class YtmConfig(ServiceConfig):
     headers: str = "accept: */*\naccept-encoding: ... Paste your headers here ..."
 
 
+def is_unplayable(song: dict) -> bool:
+    return song.get("playabilityStatus", {}).get("status") != "OK"
+
+
+class PlaylistItems:
+    """
+    The videoId and setVideoId of each item of playlists, as last fetched or edited.
+    Removing an item takes its setVideoId, so with these a removal doesn't need to
+    fetch the playlist again.
+    """
+
+    _items: Dict[str, List[dict]]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self._items = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def ids(items: List[dict]) -> List[dict]:
+        return [
+            {"videoId": item["videoId"], "setVideoId": item["setVideoId"]}
+            for item in items
+            if item and item.get("videoId") and item.get("setVideoId")
+        ]
+
+    def has(self, playlist_id: str) -> bool:
+        with self._lock:
+            return playlist_id in self._items
+
+    def set(self, playlist_id: str, items: List[dict]) -> None:
+        with self._lock:
+            self._items[playlist_id] = self.ids(items)
+
+    def add(self, playlist_id: str, items: List[dict]) -> None:
+        with self._lock:
+            if playlist_id in self._items:
+                self._items[playlist_id] += self.ids(items)
+
+    def find(
+        self, playlist_id: str, video_ids: List[str], allow_missing: bool = False
+    ) -> Optional[List[dict]]:
+        """
+        All items of the videos, None if the playlist has no record. Also None if
+        any video has no known item, unless allow_missing, which skips such videos.
+        """
+        with self._lock:
+            items = self._items.get(playlist_id)
+            if items is None:
+                return None
+            found = [item for item in items if item["videoId"] in video_ids]
+        if not allow_missing and set(video_ids) - {item["videoId"] for item in found}:
+            return None
+        return found
+
+    def remove(self, playlist_id: str, items: List[dict]) -> None:
+        removed = {item["setVideoId"] for item in items}
+        with self._lock:
+            if playlist_id in self._items:
+                self._items[playlist_id] = [
+                    item
+                    for item in self._items[playlist_id]
+                    if item["setVideoId"] not in removed
+                ]
+
+    def invalidate(self, playlist_id: str) -> None:
+        with self._lock:
+            self._items.pop(playlist_id, None)
+
+
 class YtmAPIWrapper(ServiceWrapper):
+    playlist_items: PlaylistItems
+
+    # the old fixed pace of liking songs, ramping up until YouTube throttles
+    requests_per_second = 1.25
+    max_requests_per_second = 20.0
+
     def __init__(self, config: YtmConfig, cache_root: Path) -> None:
         super().__init__("ytm", cache_root=cache_root)
         headers_path = (
@@ -39,21 +116,42 @@ class YtmAPIWrapper(ServiceWrapper):
         )  # not the best place but convenient to code
         YTMusic.setup(headers_raw=config.headers, filepath=str(headers_path))
         self.ytm = YTMusic(str(headers_path))
+        self.playlist_items = PlaylistItems()
 
-    def get_playlist(self, *args, **kwargs):
-        kwargs["limit"] = 100000  # probably no playlist this big
-        return self.ytm.get_playlist(*args, **kwargs)
-
-    @cache
-    def get_song(self, *args, use_cache=True, **kwargs):
-        return self.ytm.get_song(*args, **kwargs)
+    def throttle_delay(self, error: Exception) -> Optional[float]:
+        # ytmusicapi raises plain exceptions with the status in the message
+        return 0 if "HTTP 429" in str(error) else None
 
-    @cache
-    def search(self, *args, use_cache=True, **kwargs):
-        return self.ytm.search(*args, **kwargs)
+    def get_playlist(self, playlist_id: str, *args, **kwargs):
+        kwargs["limit"] = 100000  # probably no playlist this big
+        playlist = self.call(self.ytm.get_playlist, playlist_id, *args, **kwargs)
+        self.playlist_items.set(playlist_id, playlist["tracks"])
+        return playlist
+
+    @cache(negative_ttl=timedelta(days=1), is_negative=is_unplayable)
+    def get_song(self, videoId: str, use_cache=True):
+        return self.ytm.get_song(videoId)
+
+    @cache(ttl=timedelta(days=7), negative_ttl=timedelta(days=1))
+    def search(
+        self,
+        query: str,
+        filter: Optional[str] = None,
+        scope: Optional[str] = None,
+        limit=20,
+        ignore_spelling=False,
+        use_cache=True,
+    ):
+        return self.ytm.search(
+            query,
+            filter=filter,
+            scope=scope,
+            limit=limit,
+            ignore_spelling=ignore_spelling,
+        )
 
     def create_playlist(self, title: str, description: str = "") -> str:
-        id = self.ytm.create_playlist(title, description)
+        id = self.call(self.ytm.create_playlist, title, description)
         assert isinstance(id, str)
         return id
 
@@ -61,39 +159,55 @@ class YtmAPIWrapper(ServiceWrapper):
         """Add tracks to a playlist."""
         if playlist_id == "LM":
             for track_id in tqdm(track_ids, desc="Rating songs"):
-                self.ytm.rate_song(track_id, "LIKE")
-                time.sleep(0.8)
+                self.call(self.ytm.rate_song, track_id, "LIKE")
 
         else:
-            self.ytm.add_playlist_items(playlist_id, track_ids)
+            result = self.call(self.ytm.add_playlist_items, playlist_id, track_ids)
+            if isinstance(result, dict) and "playlistEditResults" in result:
+                self.playlist_items.add(playlist_id, result["playlistEditResults"])
+            else:
+                self.playlist_items.invalidate(playlist_id)
 
     def remove_tracks(self, playlist_id: str, track_ids: List[str]) -> None:
         """Remove tracks from a playlist."""
 
         if playlist_id == "LM":
             for track_id in tqdm(track_ids, desc="Unrating songs"):
-                self.ytm.rate_song(track_id, "INDIFFERENT")
-                time.sleep(0.8)
+                self.call(self.ytm.rate_song, track_id, "INDIFFERENT")
             return
 
-        playlist = self.get_playlist(playlist_id)
-        playlist_items = playlist["tracks"]
-        videos_to_remove = [
-            video
-            for video in playlist_items
-            if "videoId" in video and video["videoId"] in track_ids
-        ]
-        self.ytm.remove_playlist_items(playlist_id, videos_to_remove)
+        videos_to_remove = self.playlist_items.find(playlist_id, track_ids)
+        if videos_to_remove is None:
+            # not pulled yet, or changed since
+            self.get_playlist(playlist_id)
+            # videos no longer in the playlist have nothing to remove
+            videos_to_remove = (
+                self.playlist_items.find(playlist_id, track_ids, allow_missing=True)
+                or []
+            )
+            if not videos_to_remove:
+                return
+        try:
+            self.call(self.ytm.remove_playlist_items, playlist_id, videos_to_remove)
+        except Exception:
+            self.playlist_items.invalidate(playlist_id)
+            raise
+        self.playlist_items.remove(playlist_id, videos_to_remove)
 
     def get_library_playlists(self, *args, **kwargs):
-        return self.ytm.get_library_playlists(*args, **kwargs)
+        return self.call(self.ytm.get_library_playlists, *args, **kwargs)
 
     def edit_playlist(self, playlist_id: str, title: str, description: str) -> None:
         if playlist_id == "LM":
             # Your Likes playlist cannot be edited
             return
         try:
-            self.ytm.edit_playlist(playlist_id, title=title, description=description)
+            self.call(
+                self.ytm.edit_playlist,
+                playlist_id,
+                title=title,
+                description=description,
+            )
         except Exception as e:
             print(e)
             print("Failed to edit playlist")
@@ -101,13 +215,16 @@ class YtmAPIWrapper(ServiceWrapper):
 
 class YTM(StreamingService):
     wrapper: YtmAPIWrapper
+    config: YtmConfig
 
     def __init__(self, name: str, config: YtmConfig, cache_root: Path) -> None:
         super().__init__(name, ServiceType.YTM, cache_root)
         self.load_config(config, cache_root)
 
     def load_config(self, config: YtmConfig, cache_root: Path) -> None:
+        self.config = config
         self.wrapper = YtmAPIWrapper(config, cache_root)
+        self.apply_limits(config)
 
     def get_playlist_metadatas(self) -> list[PlaylistMetadata]:
         results = self.wrapper.get_library_playlists()
@@ -216,6 +333,24 @@ class YTM(StreamingService):
 
         self.wrapper.remove_tracks(playlist_uri.uri, track_ids)
 
+    def add_calls(self, playlist_uri: PlaylistURI, tracks: int) -> int:
+        # liked songs are rated one by one
+        if playlist_uri.uri == "LM":
+            return tracks
+        return 1 if tracks else 0
+
+    def remove_calls(self, playlist_uri: PlaylistURI, tracks: int) -> int:
+        if playlist_uri.uri == "LM":
+            return tracks
+        if not tracks:
+            return 0
+        # the playlist is fetched for the items' setVideoIds if it wasn't pulled
+        return 1 if self.wrapper.playlist_items.has(playlist_uri.uri) else 2
+
+    def metadata_editable(self, playlist_uri: PlaylistURI) -> bool:
+        # Your Likes playlist cannot be edited
+        return playlist_uri.uri != "LM"
+
     def is_uri_alive(self, uri: TrackURIs) -> bool:
         raw = self.wrapper.get_song(uri.uri)
         return "playabilityStatus" in raw and raw["playabilityStatus"]["status"] == "OK"
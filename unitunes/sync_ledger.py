@@ -0,0 +1,40 @@
+from typing import Dict, Optional
+
+from pydantic import BaseModel
+
+from unitunes.uri import PlaylistURI
+
+
+class SyncLedger(BaseModel):
+    """
+    The sync ledger stores the version of each remote playlist as of its last sync,
+    so pulls can skip remote playlists that have not changed since.
+    """
+
+    # playlist id -> service name -> playlist uri -> version
+    versions: Dict[str, Dict[str, Dict[str, str]]] = {}
+
+    def get_version(
+        self, playlist_id: str, service_name: str, uri: PlaylistURI
+    ) -> Optional[str]:
+        return self.versions.get(playlist_id, {}).get(service_name, {}).get(uri.uri)
+
+    def set_version(
+        self, playlist_id: str, service_name: str, uri: PlaylistURI, version: str
+    ) -> None:
+        services = self.versions.setdefault(playlist_id, {})
+        services.setdefault(service_name, {})[uri.uri] = version
+
+    def remove_uri(self, playlist_id: str, service_name: str, uri: PlaylistURI) -> None:
+        self.versions.get(playlist_id, {}).get(service_name, {}).pop(uri.uri, None)
+
+    def remove_service(self, service_name: str) -> None:
+        for services in self.versions.values():
+            services.pop(service_name, None)
+
+    def remove_playlist(self, playlist_id: str) -> None:
+        self.versions.pop(playlist_id, None)
+
+    def rename_playlist(self, old_id: str, new_id: str) -> None:
+        if old_id in self.versions:
+            self.versions[new_id] = self.versions.pop(old_id)
@@ -1,8 +1,13 @@
 from typing import (
+    Any,
+    Dict,
+    FrozenSet,
     List,
     Optional,
+    Tuple,
 )
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
+from unitunes.normalize import NormalizedValue, normalize, tokenize
 from unitunes.types import ServiceType
 from unitunes.uri import TrackURIs
 
@@ -11,6 +16,10 @@ class AliasedString(BaseModel):
     value: str
     aliases: List[str] = []
 
+    # normalized forms of all values, computed on first use
+    _normalized: Optional[List[NormalizedValue]] = PrivateAttr(None)
+    _tokens: Optional[FrozenSet[str]] = PrivateAttr(None)
+
     def __init__(self, value: str, aliases: List[str] = []):
         super().__init__(value=value, aliases=aliases)
         # remove duplicates
@@ -24,13 +33,38 @@ class AliasedString(BaseModel):
             s += f" ({', '.join(self.aliases)})"
         return s
 
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        if name in self.__fields__:
+            self.invalidate()
+
+    def invalidate(self) -> None:
+        """Drops the normalized forms. Call after changing aliases in place."""
+        self._normalized = None
+        self._tokens = None
+
     def all_values(self) -> List[str]:
         return [self.value] + self.aliases
 
+    def normalized_values(self) -> List[NormalizedValue]:
+        """Lowercased values and their special term masks."""
+        if self._normalized is None:
+            self._normalized = [normalize(value) for value in self.all_values()]
+        return self._normalized
+
+    def tokens(self) -> FrozenSet[str]:
+        """Words of all values, lowercased."""
+        if self._tokens is None:
+            self._tokens = frozenset().union(
+                *(tokenize(lowered) for lowered, _ in self.normalized_values())
+            )
+        return self._tokens
+
     def add_alias(self, alias: str) -> None:
         """Add an alias to the list of aliases if it doesn't already exist."""
         if alias not in self.all_values():
             self.aliases.append(alias)
+            self.invalidate()
 
     def shares_alias(self, other: "AliasedString") -> bool:
         return any(a in other.all_values() for a in self.all_values())
@@ -48,6 +82,11 @@ class Track(BaseModel):
     uris: List[TrackURIs] = []
     bad_uris: List[TrackURIs] = []
 
+    # field -> (normalized values of each string, their concatenation)
+    _flattened: Dict[
+        str, Tuple[List[List[NormalizedValue]], List[NormalizedValue]]
+    ] = PrivateAttr(default_factory=dict)
+
     def __rich__(self):
         s = f"[b]{self.name.__rich__()}[/b]"
         if self.artists:
@@ -61,8 +100,40 @@ class Track(BaseModel):
 
         return s
 
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        if name in self.__fields__:
+            self.invalidate()
+
+    def invalidate(self) -> None:
+        """Drops the normalized forms. Strings changed through their own methods are
+        picked up without this."""
+        self._flattened = {}
+
+    def _flatten(
+        self, field: str, strings: List[AliasedString]
+    ) -> List[NormalizedValue]:
+        parts = [s.normalized_values() for s in strings]
+        cached = self._flattened.get(field)
+        # the cache is valid while each string still has the same normalized values
+        if cached is not None and len(cached[0]) == len(parts):
+            if all(a is b for a, b in zip(cached[0], parts)):
+                return cached[1]
+        values = [value for part in parts for value in part]
+        self._flattened[field] = (parts, values)
+        return values
+
+    def artist_values(self) -> List[NormalizedValue]:
+        """Normalized values of all artists."""
+        return self._flatten("artists", self.artists)
+
+    def album_values(self) -> List[NormalizedValue]:
+        """Normalized values of all albums."""
+        return self._flatten("albums", self.albums)
+
     def shares_uri(self, track: "Track") -> bool:
-        return any(uri in track.uris for uri in self.uris)
+        # uris are frozen, so hashing is cheaper than comparing them as dicts
+        return not set(self.uris).isdisjoint(track.uris)
 
     def shared_uri(self, track: "Track") -> Optional[TrackURIs]:
         for uri in self.uris:
@@ -101,6 +172,7 @@ class Track(BaseModel):
         merge_albums(other.albums)
         merge_artists(other.artists)
         merge_length(other.length)
+        self.invalidate()
 
     def is_on_service(self, service: ServiceType) -> bool:
         return any(uri.service == service for uri in self.uris)
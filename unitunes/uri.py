@@ -1,19 +1,66 @@
 from abc import ABC, abstractmethod
-from typing import Literal, Union
+from enum import Enum
+from typing import ClassVar, Dict, Hashable, List, Literal, Optional, Type, Union
+from weakref import WeakValueDictionary
 from pydantic import BaseModel
 from pydantic.validators import dict_validator
 from unitunes.types import EntityType, ServiceType
 
 
+# One shared instance per uri, see URIBase.interned
+_interned: "WeakValueDictionary[Hashable, URIBase]" = WeakValueDictionary()
+
+
+def enum_value(value):
+    return value.value if isinstance(value, Enum) else value
+
+
 class URIBase(BaseModel, ABC):
+    __slots__ = ("__weakref__",)
+
     service: Literal[ServiceType.SPOTIFY, ServiceType.YTM, ServiceType.MB]
     type: Literal[EntityType.TRACK, EntityType.PLAYLIST, EntityType.ALBUM]
     uri: str
     url: str
 
+    # urls of this type start with this, followed by the uri
+    url_prefix: ClassVar[Optional[str]] = None
+
     class Config:
         frozen = True
 
+    @classmethod
+    def interned(cls, **fields):
+        """
+        Returns the shared instance with these fields, creating it if needed.
+        uris are immutable, so a library holds one instance per uri instead of one
+        per reference, and only validates each once.
+        """
+        # the class fixes the service and type, so reject other uris before
+        # looking them up, like validation would
+        for name in ("service", "type"):
+            if name in fields and enum_value(fields[name]) != enum_value(
+                cls.__fields__[name].default
+            ):
+                raise ValueError(f"{fields[name]} is not a {name} of {cls.__name__}")
+        key = (cls, fields.get("uri"), fields.get("url"))
+        uri = _interned.get(key)
+        if uri is None:
+            uri = cls(**fields)
+            _interned[key] = uri
+        return uri
+
+    def __eq__(self, other: object) -> bool:
+        # interned uris are compared by identity first
+        return self is other or super().__eq__(other)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        # immutable, so copies of tracks keep sharing it
+        return self
+
     @staticmethod
     @abstractmethod
     def uri_to_url(uri: str) -> str:
@@ -41,7 +88,7 @@ class URIBase(BaseModel, ABC):
         if isinstance(value, cls):
             return value
         else:
-            return cls(**dict_validator(value))
+            return cls.interned(**dict_validator(value))
 
 
 class TrackURI(URIBase):
@@ -58,10 +105,11 @@ class AlbumURI(URIBase):
 
 class SpotifyTrackURI(TrackURI):
     service: Literal[ServiceType.SPOTIFY] = ServiceType.SPOTIFY
+    url_prefix = "https://open.spotify.com/track/"
 
     @classmethod
     def from_uri(cls, uri: str) -> "SpotifyTrackURI":
-        return cls(uri=uri, url=cls.uri_to_url(uri))
+        return cls.interned(uri=uri, url=cls.uri_to_url(uri))
 
     @staticmethod
     def uri_to_url(uri: str) -> str:
@@ -73,7 +121,7 @@ class SpotifyTrackURI(TrackURI):
 
     @staticmethod
     def valid_url(url: str) -> bool:
-        return url.startswith("https://open.spotify.com/track/")
+        return url.startswith(SpotifyTrackURI.url_prefix)
 
     @staticmethod
     def from_url(url: str) -> "SpotifyTrackURI":
@@ -82,10 +130,11 @@ class SpotifyTrackURI(TrackURI):
 
 class SpotifyPlaylistURI(PlaylistURI):
     service: Literal[ServiceType.SPOTIFY] = ServiceType.SPOTIFY
+    url_prefix = "https://open.spotify.com/playlist/"
 
     @classmethod
     def from_uri(cls, uri: str) -> "SpotifyPlaylistURI":
-        return cls(uri=uri, url=cls.uri_to_url(uri))
+        return cls.interned(uri=uri, url=cls.uri_to_url(uri))
 
     def is_liked_songs(self) -> bool:
         return self.uri == "Liked Songs"
@@ -107,7 +156,7 @@ class SpotifyPlaylistURI(PlaylistURI):
     @staticmethod
     def valid_url(url: str) -> bool:
         return (
-            url.startswith("https://open.spotify.com/playlist/")
+            url.startswith(SpotifyPlaylistURI.url_prefix)
             or url == "spotify:liked_songs"
         )
 
@@ -118,10 +167,11 @@ class SpotifyPlaylistURI(PlaylistURI):
 
 class YtmTrackURI(TrackURI):
     service: Literal[ServiceType.YTM] = ServiceType.YTM
+    url_prefix = "https://music.youtube.com/watch?v="
 
     @classmethod
     def from_uri(cls, uri: str) -> "YtmTrackURI":
-        return cls(uri=uri, url=cls.uri_to_url(uri))
+        return cls.interned(uri=uri, url=cls.uri_to_url(uri))
 
     @staticmethod
     def url_to_uri(url: str) -> str:
@@ -133,7 +183,7 @@ class YtmTrackURI(TrackURI):
 
     @staticmethod
     def valid_url(url: str) -> bool:
-        return url.startswith("https://music.youtube.com/watch?v=")
+        return url.startswith(YtmTrackURI.url_prefix)
 
     @staticmethod
     def from_url(url: str) -> "YtmTrackURI":
@@ -142,10 +192,11 @@ class YtmTrackURI(TrackURI):
 
 class YtmPlaylistURI(PlaylistURI):
     service: Literal[ServiceType.YTM] = ServiceType.YTM
+    url_prefix = "https://music.youtube.com/playlist?list="
 
     @classmethod
     def from_uri(cls, uri: str) -> "YtmPlaylistURI":
-        return cls(uri=uri, url=cls.uri_to_url(uri))
+        return cls.interned(uri=uri, url=cls.uri_to_url(uri))
 
     @staticmethod
     def url_to_uri(url: str) -> str:
@@ -157,7 +208,7 @@ class YtmPlaylistURI(PlaylistURI):
 
     @staticmethod
     def valid_url(url: str) -> bool:
-        return url.startswith("https://music.youtube.com/playlist?list=")
+        return url.startswith(YtmPlaylistURI.url_prefix)
 
     @staticmethod
     def from_url(url: str) -> "YtmPlaylistURI":
@@ -166,10 +217,11 @@ class YtmPlaylistURI(PlaylistURI):
 
 class MB_RECORDING_URI(TrackURI):
     service: Literal[ServiceType.MB] = ServiceType.MB
+    url_prefix = "https://musicbrainz.org/recording/"
 
     @classmethod
     def from_uri(cls, uri: str) -> "MB_RECORDING_URI":
-        return cls(uri=uri, url=cls.uri_to_url(uri))
+        return cls.interned(uri=uri, url=cls.uri_to_url(uri))
 
     @staticmethod
     def uri_to_url(uri: str) -> str:
@@ -181,7 +233,7 @@ class MB_RECORDING_URI(TrackURI):
 
     @staticmethod
     def valid_url(url: str) -> bool:
-        return url.startswith("https://musicbrainz.org/recording/")
+        return url.startswith(MB_RECORDING_URI.url_prefix)
 
     @staticmethod
     def from_url(url: str) -> "MB_RECORDING_URI":
@@ -190,10 +242,11 @@ class MB_RECORDING_URI(TrackURI):
 
 class MB_RELEASE_URI(AlbumURI):
     service: Literal[ServiceType.MB] = ServiceType.MB
+    url_prefix = "https://musicbrainz.org/release/"
 
     @classmethod
     def from_uri(cls, uri: str) -> "MB_RELEASE_URI":
-        return cls(uri=uri, url=cls.uri_to_url(uri))
+        return cls.interned(uri=uri, url=cls.uri_to_url(uri))
 
     @staticmethod
     def uri_to_url(uri: str) -> str:
@@ -205,7 +258,7 @@ class MB_RELEASE_URI(AlbumURI):
 
     @staticmethod
     def valid_url(url: str) -> bool:
-        return url.startswith("https://musicbrainz.org/release/")
+        return url.startswith(MB_RELEASE_URI.url_prefix)
 
     @staticmethod
     def from_url(url: str) -> "MB_RELEASE_URI":
@@ -214,10 +267,11 @@ class MB_RELEASE_URI(AlbumURI):
 
 class BeatsaberTrackURI(TrackURI):
     service: Literal[ServiceType.BEATSABER] = ServiceType.BEATSABER
+    url_prefix = "https://beatsaver.com/maps/"
 
     @classmethod
     def from_uri(cls, uri: str) -> "BeatsaberTrackURI":
-        return cls(uri=uri, url=cls.uri_to_url(uri))
+        return cls.interned(uri=uri, url=cls.uri_to_url(uri))
 
     @staticmethod
     def uri_to_url(uri: str) -> str:
@@ -229,7 +283,7 @@ class BeatsaberTrackURI(TrackURI):
 
     @staticmethod
     def valid_url(url: str) -> bool:
-        return url.startswith("https://beatsaber.com/maps/")
+        return url.startswith(BeatsaberTrackURI.url_prefix)
 
     @staticmethod
     def from_url(url: str) -> "BeatsaberTrackURI":
@@ -241,7 +295,7 @@ class BeatsaberPlaylistURI(PlaylistURI):
 
     @classmethod
     def from_uri(cls, uri: str) -> "BeatsaberPlaylistURI":
-        return cls(uri=uri, url=cls.uri_to_url(uri))
+        return cls.interned(uri=uri, url=cls.uri_to_url(uri))
 
     @staticmethod
     def uri_to_url(uri: str) -> str:
@@ -267,7 +321,7 @@ AlbumURIs = MB_RELEASE_URI
 playlist_uri_types = [SpotifyPlaylistURI, YtmPlaylistURI, BeatsaberPlaylistURI]
 track_uri_types = [SpotifyTrackURI, YtmTrackURI, MB_RECORDING_URI, BeatsaberTrackURI]
 album_uri_types = [MB_RELEASE_URI]
-all_uri_types = [..., *playlist_uri_types, *track_uri_types, *album_uri_types]
+all_uri_types = [*playlist_uri_types, *track_uri_types, *album_uri_types]
 
 
 def URI_Builder(service: ServiceType, type: EntityType, uri: str) -> URIBase:
@@ -292,33 +346,55 @@ def URI_Builder(service: ServiceType, type: EntityType, uri: str) -> URIBase:
     raise ValueError(f"Unknown entity type {type} for service {service}")
 
 
-def playlistURI_from_url(url: str) -> PlaylistURIs:
-    for cls in playlist_uri_types:
-        if cls.valid_url(url):
-            return cls.from_url(url)
+def url_prefix(url: str) -> str:
+    """The url up to where the uri starts: its last "/" or "="."""
+    return url[: max(url.rfind("/"), url.rfind("=")) + 1]
 
-    raise ValueError(f"Unknown URL format {url}")
 
+class URLParser:
+    """
+    Parses urls into uris of the given types. The type is looked up by the url's
+    prefix, falling back to trying each type's valid_url in order, for types
+    without a prefix and urls with extra parameters.
+    """
 
-def trackURI_from_url(url: str) -> TrackURIs:
-    for cls in track_uri_types:
-        if cls.valid_url(url):
-            return cls.from_url(url)
+    types: List[Type[URIBase]]
+    by_prefix: Dict[str, Type[URIBase]]
 
-    raise ValueError(f"Unknown URL format {url}")
+    def __init__(self, types: List[Type[URIBase]]) -> None:
+        self.types = types
+        self.by_prefix = {
+            cls.url_prefix: cls for cls in types if cls.url_prefix is not None
+        }
 
+    def parse(self, url: str) -> URIBase:
+        cls = self.by_prefix.get(url_prefix(url))
+        if cls is not None and cls.valid_url(url):  # type: ignore
+            return cls.from_url(url)  # type: ignore
+        for cls in self.types:
+            if cls.valid_url(url):  # type: ignore
+                return cls.from_url(url)  # type: ignore
 
-def albumURI_from_url(url: str) -> AlbumURIs:
-    for cls in album_uri_types:
-        if cls.valid_url(url):
-            return cls.from_url(url)
+        raise ValueError(f"Unknown URL format {url}")
 
-    raise ValueError(f"Unknown URL format {url}")
 
+playlist_url_parser = URLParser(playlist_uri_types)  # type: ignore
+track_url_parser = URLParser(track_uri_types)  # type: ignore
+album_url_parser = URLParser(album_uri_types)  # type: ignore
+url_parser = URLParser(all_uri_types)  # type: ignore
+
+
+def playlistURI_from_url(url: str) -> PlaylistURIs:
+    return playlist_url_parser.parse(url)  # type: ignore
 
-def URI_from_url(url: str) -> URIBase:
-    for cls in all_uri_types:
-        if cls.valid_url(url):
-            return cls.from_url(url)
 
-    raise ValueError(f"Unknown URL format {url}")
+def trackURI_from_url(url: str) -> TrackURIs:
+    return track_url_parser.parse(url)  # type: ignore
+
+
+def albumURI_from_url(url: str) -> AlbumURIs:
+    return album_url_parser.parse(url)  # type: ignore
+
+
+def URI_from_url(url: str) -> URIBase:
+    return url_parser.parse(url)
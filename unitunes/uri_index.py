@@ -0,0 +1,71 @@
+from collections import defaultdict
+from typing import DefaultDict, Dict, List, Set, Tuple
+
+from unitunes.playlist import Playlist
+from unitunes.track import Track
+from unitunes.uri import PlaylistURIs, TrackURIs
+
+
+class UriIndex:
+    """
+    Hash index from uris to the playlists and tracks that have them, so membership
+    checks don't scan the library.
+
+    Tracks are changed in place by pulls and searches, so update a playlist after
+    changing it.
+    """
+
+    _playlists: DefaultDict[PlaylistURIs, Set[str]]
+    _tracks: DefaultDict[TrackURIs, Dict[str, List[Track]]]
+    # playlist id -> the uris indexed for it, to unindex it
+    _indexed: Dict[str, Tuple[List[PlaylistURIs], List[TrackURIs]]]
+
+    def __init__(self, playlists: Dict[str, Playlist] = {}) -> None:
+        self._playlists = defaultdict(set)
+        self._tracks = defaultdict(dict)
+        self._indexed = {}
+        for playlist_id, playlist in playlists.items():
+            self.add_playlist(playlist_id, playlist)
+
+    def add_playlist(self, playlist_id: str, playlist: Playlist) -> None:
+        playlist_uris = [uri for uris in playlist.uris.values() for uri in uris]
+        for uri in playlist_uris:
+            self._playlists[uri].add(playlist_id)
+
+        track_uris = []
+        for track in playlist.tracks:
+            for uri in track.uris:
+                self._tracks[uri].setdefault(playlist_id, []).append(track)
+                track_uris.append(uri)
+        self._indexed[playlist_id] = (playlist_uris, track_uris)
+
+    def remove_playlist(self, playlist_id: str) -> None:
+        playlist_uris, track_uris = self._indexed.pop(playlist_id, ([], []))
+        for uri in playlist_uris:
+            self._playlists[uri].discard(playlist_id)
+            if not self._playlists[uri]:
+                del self._playlists[uri]
+        for uri in track_uris:
+            if uri in self._tracks:
+                self._tracks[uri].pop(playlist_id, None)
+                if not self._tracks[uri]:
+                    del self._tracks[uri]
+
+    def update_playlist(self, playlist_id: str, playlist: Playlist) -> None:
+        """Reindexes a playlist after its uris or tracks changed."""
+        self.remove_playlist(playlist_id)
+        self.add_playlist(playlist_id, playlist)
+
+    def is_tracking(self, uri: PlaylistURIs) -> bool:
+        return uri in self._playlists
+
+    def playlists_with_uri(self, uri: PlaylistURIs) -> Set[str]:
+        return set(self._playlists.get(uri, set()))
+
+    def tracks_with_uri(self, uri: TrackURIs) -> List[Tuple[str, Track]]:
+        """Returns (playlist id, track) for each track with the uri."""
+        return [
+            (playlist_id, track)
+            for playlist_id, tracks in self._tracks.get(uri, {}).items()
+            for track in tracks
+        ]